@@ -3,12 +3,12 @@ import glob
 import logging
 import os
 from collections import defaultdict
-from concurrent.futures import ProcessPoolExecutor, as_completed
 
 import pandas as pd
 from pandas import DataFrame
 from tqdm import tqdm
 
+from utils.area_and_volume_estimation.executor import run_area_tasks
 from utils.area_and_volume_estimation.general import (
     media_mensal_por_ano,
     medias_mensais_por_ano,
@@ -16,17 +16,78 @@ from utils.area_and_volume_estimation.general import (
 from utils.area_and_volume_estimation.plots import (
     plot_series_ano_mes,
 )
+from utils.area_and_volume_estimation.result_store import (
+    ResultStore,
+    acquisition_dates,
+    config_hash,
+    file_digest,
+    file_mtime,
+)
+from utils.area_and_volume_estimation.roi_plan import build_roi_plans
 from utils.area_and_volume_estimation.water import (
+    areas_long_format,
     calculate_volumes_to_multiple_methods,
     calculate_water_area,
-    process_single_mask,
+    mask_date,
+    update_volumes,
+    volumes_by_threshold,
 )
-from utils.metrics.regression import calculate_metrics_regression_by_month
+from utils.download.cloud_screening import load_roi_cloud_percentages
+from utils.metrics.regression import calculate_metrics_regression_by_group
+from utils.scene_catalog.scene_catalog import SceneCatalog
 
 logger = logging.getLogger(__name__)
 
 
 
+def append_area_records(results: dict, records: list) -> None:
+    """Add the rows of process_single_mask (or of the fused segmentation) to
+    the columns of their threshold"""
+    for r in records:
+        tr = r["threshold"]
+        results[tr]["water_masks"].append(r["water_masks"])
+        results[tr]["year"].append(r["year"])
+        results[tr]["month"].append(r["month"])
+        results[tr]["day"].append(r["day"])
+        results[tr]["m2_area"].append(r["m2_area"])
+        results[tr]["km2_area"].append(r["km2_area"])
+        results[tr]["CLOUDY_PIXEL_PERCENTAGE"].append(
+            r["CLOUDY_PIXEL_PERCENTAGE"]
+        )
+
+
+def store_areas(
+    store: ResultStore,
+    thresholds_results_df: dict,
+    thresholds: list,
+    location_name: str,
+    method: str,
+    config: str = None,
+) -> dict:
+    """Upsert the new area rows of each threshold, and return the whole
+    stored series of each one (computed with config), sorted by date"""
+    stored_dfs = {}
+    for threshold in thresholds:
+        key = f"df_areas_trh_{threshold}"
+        df = thresholds_results_df[key]
+        if len(df):
+            df["date"] = acquisition_dates(df)
+            df["mask_mtime"] = [file_mtime(path) for path in df["water_masks"]]
+            partition, _ = store.upsert(
+                "areas", location_name, method, threshold, df, config=config
+            )
+        else:
+            partition = store.read("areas", location_name, method, threshold, config)
+
+        if partition is not None:
+            stored_dfs[key] = partition.drop(
+                columns=["date", "mask_mtime", "config"], errors="ignore"
+            )
+        else:
+            stored_dfs[key] = df
+    return stored_dfs
+
+
 def estimate_water_area(
     water_masks_path: str,
     path_shapefile: str,
@@ -35,9 +96,17 @@ def estimate_water_area(
     location_name: str,
     dependency1=None,
     max_workers: int | None = None,
+    scene_catalog_path: str = None,
+    metadata_path: str = None,
+    area_method: str = "reprojected",
+    save_histograms: bool = False,
+    area_backend: str = "processes",
+    method_name: str = None,
+    results_store: bool = False,
+    export_csv: bool = False,
 ):
 
-    logger.info(f"Estimating water area using {max_workers} workers...")
+    logger.info(f"Estimating water area using {max_workers} {area_backend} workers...")
     # Estrutura final
     results = {
         threshold: {
@@ -56,47 +125,102 @@ def estimate_water_area(
     save_dir = os.path.join(save_path, location_name)
     os.makedirs(save_dir, exist_ok=True)
 
-    water_masks = glob.glob(
-        os.path.join(masks_path, "**", "*.tif"),
-        recursive=True
-    )
+    # Porcentagem de nuvens na ROI de cada data, salva pelo download
+    cloud_percentages = {}
+    if metadata_path:
+        cloud_percentages = load_roi_cloud_percentages(
+            os.path.join(metadata_path, location_name, "metadata")
+        )
 
-    tasks = [
-        (mask_path, path_shapefile, thresholds)
-        for mask_path in water_masks
-    ]
+    if isinstance(dependency1, list):
+        # fused_area: áreas já calculadas pela segmentação, com os mapas em memória
+        logger.info(f"Using {len(dependency1)} area rows of the segmentation")
+        for r in dependency1:
+            date = f"{r['year']}{r['month']}{r['day']}"
+            r["CLOUDY_PIXEL_PERCENTAGE"] = cloud_percentages.get(date) or 0
+        append_area_records(results, dependency1)
+        scenes = []
+    elif scene_catalog_path:
+        with SceneCatalog(scene_catalog_path) as catalog:
+            scenes = [
+                (scene["path"], scene["date"])
+                for scene in catalog.scenes(location_name, root=water_masks_path)
+            ]
+    else:
+        water_masks = glob.glob(
+            os.path.join(masks_path, "**", "*.tif"),
+            recursive=True
+        )
+        scenes = [(mask_path, mask_date(mask_path)) for mask_path in water_masks]
+
+    # store de resultados: só as máscaras novas (ou alteradas) são processadas;
+    # mudar o método de área, a ROI ou a pasta das máscaras recalcula tudo
+    store = ResultStore(os.path.join(save_path, "store")) if results_store else None
+    area_config = config_hash(area_method, file_digest(path_shapefile), water_masks_path)
+    if store is not None:
+        stored = store.scenes(
+            "areas", location_name, method_name, thresholds, area_config
+        )
+        n_scenes = len(scenes)
+        scenes = [
+            (mask_path, date)
+            for mask_path, date in scenes
+            if stored.get(mask_path) != file_mtime(mask_path)
+        ]
+        logger.info(f"{n_scenes - len(scenes)} masks already in the results store")
 
-    with ProcessPoolExecutor(max_workers=max_workers) as executor:
-        futures = [executor.submit(process_single_mask, task) for task in tasks]
+    # histogramas salvos por máscara: novos limiares sem reler os rasters
+    histogram_dir = os.path.join(save_dir, "histograms") if save_histograms else None
 
-        with tqdm(total=len(futures), desc="Estimate Area", unit="images") as pbar:
-            for future in as_completed(futures):
-                batch_results = future.result()
+    tasks = [
+        (
+            mask_path,
+            path_shapefile,
+            thresholds,
+            date,
+            cloud_percentages.get(date),
+            area_method,
+            histogram_dir,
+        )
+        for mask_path, date in scenes
+    ]
 
-                for r in batch_results:
-                    tr = r["threshold"]
-                    results[tr]["water_masks"].append(r["water_masks"])
-                    results[tr]["year"].append(r["year"])
-                    results[tr]["month"].append(r["month"])
-                    results[tr]["day"].append(r["day"])
-                    results[tr]["m2_area"].append(r["m2_area"])
-                    results[tr]["km2_area"].append(r["km2_area"])
-                    results[tr]["CLOUDY_PIXEL_PERCENTAGE"].append(
-                        r["CLOUDY_PIXEL_PERCENTAGE"]
-                    )
+    # recorte da ROI e área dos pixels calculados uma vez e enviados aos workers
+    roi_plans = build_roi_plans(
+        [mask_path for mask_path, _ in scenes], path_shapefile, area_method
+    )
 
-                pbar.update(1)
+    with tqdm(total=len(tasks), desc="Estimate Area", unit="images") as pbar:
+        for records in run_area_tasks(tasks, roi_plans, area_backend, max_workers):
+            append_area_records(results, records)
+            pbar.update(1)
 
     # ---------- DATAFRAME BUILD ----------
+    # as linhas chegam fora de ordem (as_completed), os filtros precisam da
+    # série ordenada pela data de aquisição
     thresholds_results_df = {
         f"df_areas_trh_{threshold}": pd.DataFrame(data)
+        .sort_values(["year", "month", "day", "water_masks"], kind="mergesort")
+        .reset_index(drop=True)
         for threshold, data in results.items()
     }
 
+    if store is not None:
+        thresholds_results_df = store_areas(
+            store,
+            thresholds_results_df,
+            thresholds,
+            location_name,
+            method_name,
+            area_config,
+        )
+
     # ---------- SAVE ----------
-    os.makedirs(save_dir, exist_ok=True)
-    for name, df in thresholds_results_df.items():
-        df.to_csv(os.path.join(save_dir, f"{name}.csv"), index=False)
+    # com o store, os CSVs são só uma exportação opcional
+    if store is None or export_csv:
+        os.makedirs(save_dir, exist_ok=True)
+        for name, df in thresholds_results_df.items():
+            df.to_csv(os.path.join(save_dir, f"{name}.csv"), index=False)
 
     return thresholds_results_df
 
@@ -113,25 +237,70 @@ def estimate_water_volume(
     cloud_percentage_column: str = "CLOUDY_PIXEL_PERCENTAGE",
     areas_columns=[],
     escale: float = 1,
-) -> tuple:
+    export_csv: bool = False,
+    method_name: str = None,
+    results_store: bool = False,
+) -> pd.DataFrame:
     """
-    Reproject a .tif image with geographic CRS (degrees) to UTM (meters),
-    and calculates the volume of water pixels (value > 0).
+    Estimate the water volume of every area with the CAV (area-volume)
+    curve of the reservoir, for all the thresholds at once.
+
+    The areas of every threshold are stacked in one long table (threshold,
+    date, area), interpolated in a single pass and filtered per threshold.
+    The result is saved as volumes.parquet, and as one CSV per threshold
+    when export_csv is set.
 
-    parameters:
-    - tif_path (str): path to the .tif file
-    - path_shapefile (str): path to the GeoJSON clipping file
-    - binarization_gt (int): threshold value to consider a pixel as water
-    - save_path (str): path to save the reprojected raster
+    With results_store, the volumes of each threshold are kept in the
+    ResultStore and only the new scenes are interpolated and filtered.
 
     returns:
-    - Tuple: (volume_m3, volume_km3)
+    - DataFrame: volumes and filtered volumes, with a threshold column
     """
-    dfs = {}
-    for key, df in water_areas_dfs.items():
-        df_cav = pd.read_csv(cav_path)
-        df_volume = calculate_volumes_to_multiple_methods(
-            df_areas=df,
+    df_areas = areas_long_format(water_areas_dfs)
+    df_cav = pd.read_csv(cav_path)
+
+    if results_store:
+        store = ResultStore(os.path.join(save_path, "store"))
+        df_areas["date"] = acquisition_dates(df_areas)
+        # volumes de outra curva CAV ou escala são recalculados
+        volume_config = config_hash(
+            file_digest(cav_path), escale, cav_area_column, cav_volume_column
+        )
+
+        partitions = []
+        for threshold, df in df_areas.groupby("threshold", sort=False):
+            stored = store.read(
+                "volumes", location_name, method_name, threshold, volume_config
+            )
+            df_threshold = update_volumes(
+                stored=stored,
+                df_areas=df,
+                df_cav=df_cav,
+                cav_area_column=cav_area_column,
+                cav_volume_column=cav_volume_column,
+                year_column=year_column,
+                month_column=month_column,
+                cloud_percentage_column=cloud_percentage_column,
+                areas_columns=areas_columns,
+                escale=escale,
+            )
+            store.write(
+                "volumes",
+                location_name,
+                method_name,
+                threshold,
+                df_threshold.assign(config=volume_config),
+            )
+            partitions.append(
+                df_threshold.drop(columns="config", errors="ignore").assign(
+                    threshold=threshold
+                )
+            )
+
+        df_volumes = pd.concat(partitions, ignore_index=True)
+    else:
+        df_volumes = calculate_volumes_to_multiple_methods(
+            df_areas=df_areas,
             df_cav=df_cav,
             cav_area_column=cav_area_column,
             cav_volume_column=cav_volume_column,
@@ -140,14 +309,18 @@ def estimate_water_volume(
             cloud_percentage_column=cloud_percentage_column,
             areas_columns=areas_columns,
             escale=escale,
+            group_column="threshold",
         )
 
-        df_volume.to_csv(
-            f"{save_path}{location_name}/{key.replace('areas', 'volumes')}.csv",
-            index=False,
-        )
-        dfs[key.replace("areas", "volumes")] = df_volume
-    return dfs
+    save_dir = os.path.join(save_path, location_name)
+    os.makedirs(save_dir, exist_ok=True)
+    df_volumes.to_parquet(os.path.join(save_dir, "volumes.parquet"), index=False)
+
+    if export_csv:
+        for key, df in volumes_by_threshold(df_volumes).items():
+            df.to_csv(os.path.join(save_dir, f"{key}.csv"), index=False)
+
+    return df_volumes
 
 
 def calculate_metrics(
@@ -163,15 +336,14 @@ def calculate_metrics(
     logger.info("Calculating metrics")
     real_df = pd.read_csv(path_real_df)
 
-    real_df["year"] = real_df["Data da Medição"].apply(lambda x: x.split("/")[-1])
-    real_df["month"] = real_df["Data da Medição"].apply(lambda x: x.split("/")[-2])
-    real_df["Volume Útil (hm³)"] = real_df["Volume Útil (hm³)"].apply(
-        lambda x: float(x.replace(",", ".")) if isinstance(x, str) else x
+    dates = real_df["Data da Medição"].str.split("/")
+    real_df["year"] = dates.str[-1]
+    real_df["month"] = dates.str[-2]
+    real_df["Volume Útil (hm³)"] = (
+        real_df["Volume Útil (hm³)"].astype(str).str.replace(",", ".").astype(float)
     )
 
-    real_df["volume_m2_real"] = real_df["Volume Útil (hm³)"].apply(
-        lambda x: x * 1000000 / 1e6
-    )
+    real_df["volume_m2_real"] = real_df["Volume Útil (hm³)"] * 1000000 / 1e6
 
     real_df = media_mensal_por_ano(
         real_df,
@@ -180,37 +352,31 @@ def calculate_metrics(
 
     real_df.rename(columns={"volume_m2": "volume_m2_real"}, inplace=True)
 
-    global_metrics_df = []
-    for key, df in pred_dfs.items():
-        df = media_mensal_por_ano(
-            df,
-            column="volume_m2",
-        )
-
-        metrics, df_erros = calculate_metrics_regression_by_month(
-            df_real=real_df,
-            df_pred=df,
-            col_real="volume_m2_real",
-            col_pred="volume_m2",
-            on=["year", "month"],
-        )
+    # médias mensais de todos os thresholds e um único merge com o real
+    pred_df = media_mensal_por_ano(pred_dfs, column="volume_m2", keys=["threshold"])
 
-        metrics["threshold"] = float(key.replace("df_volumes_trh_", ""))
+    metrics_df, df_erros = calculate_metrics_regression_by_group(
+        df_real=real_df,
+        df_pred=pred_df,
+        col_real="volume_m2_real",
+        col_pred="volume_m2",
+        on=["year", "month"],
+        by="threshold",
+    )
 
-        global_metrics_df.append(metrics)
-        df_erros.to_csv(
-            f"{save_path}{location_name}/volume_errors_{float(key.replace('df_volumes_trh_', ''))}.csv",
+    for threshold, df in df_erros.groupby("threshold"):
+        df.drop(columns="threshold").to_csv(
+            f"{save_path}{location_name}/volume_errors_{threshold}.csv",
             index=False,
         )
 
-    metrics_df = pd.DataFrame(global_metrics_df)
     metrics_df.to_csv(f"{save_path}{location_name}/volume_metrics.csv", index=False)
 
     return True
 
 def plot_results(
     areas_df: DataFrame,
-    volumes_dfs: dict,
+    volumes_dfs: DataFrame,
     location_name: str,
     save_path: str,
     method_name: str,
@@ -248,6 +414,9 @@ def plot_results(
 
     logger.info(f"Saving plots to {final_dir}")
 
+    # tabela longa de estimate_water_volume, um DataFrame por threshold
+    volumes_dfs = volumes_by_threshold(volumes_dfs)
+
     # ======================================================
     # 2. LOAD AND PREPROCESS GROUND TRUTH DATA
     # ======================================================
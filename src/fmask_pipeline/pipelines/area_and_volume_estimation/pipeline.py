@@ -15,6 +15,14 @@ def create_pipeline(dependencies=['water_mask_dependency'], **kwargs) -> Pipelin
                     "location_name": "params:configs.location_name",
                     "thresholds": "params:configs.thresholds",
                     "max_workers": "params:configs.max_workers",
+                    "scene_catalog_path": "params:configs.scene_catalog_path",
+                    "metadata_path": "params:configs.boa_dowload_path",
+                    "area_method": "params:configs.area_method",
+                    "save_histograms": "params:configs.save_histograms",
+                    "area_backend": "params:configs.area_backend",
+                    "method_name": "params:configs.method_name",
+                    "results_store": "params:configs.results_store",
+                    "export_csv": "params:configs.export_csv",
                     "dependency1": dependencies[0],
                 },
                 outputs="water_areas_dfs",
@@ -34,6 +42,9 @@ def create_pipeline(dependencies=['water_mask_dependency'], **kwargs) -> Pipelin
                     "areas_columns": "params:configs.areas_columns",
                     "location_name": "params:configs.location_name",
                     "escale": "params:configs.escale",
+                    "export_csv": "params:configs.export_csv",
+                    "method_name": "params:configs.method_name",
+                    "results_store": "params:configs.results_store",
                 },
                 outputs="water_volumes_dfs",
                 name="Estimate_Water_Volume",
@@ -7,7 +7,12 @@ from tqdm import tqdm
 
 import utils.deepwatermap.inference as deep_water_map
 from utils.calculate_spectral_indices import spectral_indices
+from utils.raster_io.band_reader import read_band_stack
+from utils.raster_io.cog import write_raster
+from utils.scene_catalog.scene_catalog import SceneCatalog, register_scene_paths
 
+# Posições das bandas de cada índice, usadas quando a imagem não tem os nomes
+# das bandas (ver spectral_index_bands)
 map_strategies_sentinel = {
     # "EVI": spectral_indices.EVI(),
     "NDVI": spectral_indices.GenericSpectralIndex(7, 3),  # NIR (B8) / RED (B4)
@@ -32,10 +37,38 @@ map_strategies_landsat_5_7 = {
     "MNDWI": spectral_indices.GenericSpectralIndex(1, 4),  # GREEN / SWIR1
 }
 
+# Bandas (nomes do download) de cada índice, na ordem usada pela estratégia;
+# só elas são lidas da imagem
+spectral_index_bands = {
+    "EVI": ["blue", "red", "nir"],
+    "NDVI": ["nir", "red"],
+    "NDBI": ["swir1", "nir"],
+    "NDWI": ["green", "nir"],
+    "MNDWI": ["green", "swir1"],
+}
+
+map_strategies_named_bands = {
+    "EVI": spectral_indices.EVI(0, 1, 2),
+    "NDVI": spectral_indices.GenericSpectralIndex(0, 1),
+    "NDBI": spectral_indices.GenericSpectralIndex(0, 1),
+    "NDWI": spectral_indices.GenericSpectralIndex(0, 1),
+    "MNDWI": spectral_indices.GenericSpectralIndex(0, 1),
+}
+
 
 logger = logging.getLogger(__name__)
 
 
+def strategy_band_indexes(strategy) -> list:
+    """Rasterio (1-based) indexes of the bands of a positional strategy, used
+    when the image has no band names"""
+    if isinstance(strategy, spectral_indices.GenericSpectralIndex):
+        return [strategy.b1_idx + 1, strategy.b2_idx + 1]
+    if isinstance(strategy, spectral_indices.EVI):
+        return [strategy.blue_idx + 1, strategy.red_idx + 1, strategy.nir_idx + 1]
+    return None
+
+
 def create_dirs(
     spectral_indice: str,
     spectral_index_save_path: str,
@@ -66,6 +99,7 @@ def calculate_spectral_indices(
     location_name: str,
     spectral_indice_name,
     skip_spectral_indice,
+    scene_catalog_path: str = None,
     *args,
     **kwargs,
 ):
@@ -73,44 +107,76 @@ def calculate_spectral_indices(
         logger.warning("Skip Spectral Indices processing")
         return True
 
-    path = f"{images_path}{location_name}"
-    tif_files = glob.glob(os.path.join(path, "**", "*.tif"), recursive=True)
-    total_tifs = len(tif_files)
+    # (caminho, satélite) de cada imagem
+    if scene_catalog_path:
+        with SceneCatalog(scene_catalog_path) as catalog:
+            scenes = [
+                (scene["path"], scene["satellite"])
+                for scene in catalog.scenes(location_name, root=images_path)
+            ]
+    else:
+        path = f"{images_path}{location_name}"
+        scenes = [
+            (tif_path, tif_path.split("/")[-1].split("_")[3])
+            for tif_path in (
+                tif_path.replace("\\", "/")
+                for tif_path in glob.glob(
+                    os.path.join(path, "**", "*.tif"), recursive=True
+                )
+            )
+        ]
+    total_tifs = len(scenes)
+
+    save_root = f"{spectral_index_save_path}{spectral_indice_name}/"
+    output_paths = []
 
     with tqdm(
         total=total_tifs, desc="Calculating Spectral Indices", unit="images"
     ) as pbar:
-        for tif_path in tif_files:
-            tif_path = tif_path.replace("\\", "/")
-            output_path = f"{spectral_index_save_path}{spectral_indice_name}/{location_name}/{tif_path.split('/')[-2]}/{tif_path.split('/')[-1]}"
+        for tif_path, setelite_name in scenes:
+            output_path = f"{save_root}{location_name}/{tif_path.split('/')[-2]}/{tif_path.split('/')[-1]}"
             with rasterio.open(tif_path) as src:
-                bands = src.read()
-                setelite_name = tif_path.split("/")[-1].split("_")[3]
                 spectral_strategy_obj = None
 
                 if setelite_name in ["LC08", "LC09"]:
-                    spectral_strategy_obj = map_strategies_landsat_8_9[
+                    spectral_strategy_obj = map_strategies_landsat_8_9.get(
                         spectral_indice_name
-                    ]
-                elif setelite_name in ["LC05", "LC07"]:
-                    spectral_strategy_obj = map_strategies_landsat_5_7[
+                    )
+                elif setelite_name in ["LT05", "LE07", "LC05", "LC07"]:
+                    spectral_strategy_obj = map_strategies_landsat_5_7.get(
                         spectral_indice_name
-                    ]
-                elif setelite_name in ["S2"]:
-                    spectral_strategy_obj = map_strategies_sentinel[
+                    )
+                elif setelite_name in ["S2", "S2_SR"]:
+                    spectral_strategy_obj = map_strategies_sentinel.get(
                         spectral_indice_name
-                    ]
+                    )
                 else:
                     logger.error(f"Unknown satellite name: {setelite_name}")
                     continue
 
-                spectral_indice = spectral_strategy_obj.calculate(bands)
-                profile = src.profile
-                profile.update(
-                    count=1, dtype=rasterio.float32
-                )  # Atualize o tipo de dados e o número de bandas
-                with rasterio.open(output_path, "w", **profile) as dst:
-                    dst.write(spectral_indice, 1)
+                # lê só as bandas do índice
+                bands = read_band_stack(
+                    src,
+                    spectral_index_bands[spectral_indice_name],
+                    satellite=setelite_name,
+                    default_indexes=strategy_band_indexes(spectral_strategy_obj),
+                )
+                spectral_indice = map_strategies_named_bands[
+                    spectral_indice_name
+                ].calculate(bands)
+                write_raster(
+                    output_path,
+                    spectral_indice,
+                    src.profile,
+                    overview_resampling="average",
+                    count=1,
+                    dtype=rasterio.float32,
+                )
+                output_paths.append(output_path)
                 pbar.update(1)
 
+    register_scene_paths(
+        save_root, location_name, output_paths, "spectral_indice", scene_catalog_path
+    )
+
     return True
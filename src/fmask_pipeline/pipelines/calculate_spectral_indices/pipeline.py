@@ -34,6 +34,7 @@ def create_pipeline(dependencies: list=["created_spectral_indice_dirs_dependency
                     "location_name": "params:configs.location_name",
                     "skip_spectral_indice": "params:configs.skip_spectral_indice",
                     "spectral_indice_name": "params:configs.spectral_indice",
+                    "scene_catalog_path": "params:configs.scene_catalog_path",
                 } | dependencies,
                 outputs="spectral_dependency",
                 name="calculate_spectral_indices",
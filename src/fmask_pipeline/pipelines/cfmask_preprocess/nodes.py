@@ -11,6 +11,7 @@ from tqdm import tqdm
 
 from utils.cfmask.cfmask_utils import get_binary_mask_from_path
 from utils.fmask.fmask_utils import save_mask_tif, save_overlayed_mask_plot
+from utils.scene_catalog.scene_catalog import register_scene_paths
 
 logger = logging.getLogger(__name__)
 
@@ -22,6 +23,7 @@ def apply_cfmask(
     save_plots_path: str,
     scale_factor: int = 1,
     skip_masks: bool = False,
+    scene_catalog_path: str = None,
     *args,
     **kwargs,
 ):
@@ -30,6 +32,7 @@ def apply_cfmask(
         return True
 
     inputs = glob.glob(f"{boa_path}{location_name}/*/*.tif")
+    mask_paths = []
     with tqdm(
         total=len(inputs),
         desc="Segmenting Cloud and Cloud Shadows in Images",
@@ -58,6 +61,7 @@ def apply_cfmask(
                 original_tif_file=image_input,
                 output_file=f"{save_masks_path}{file_name}.tif",
             )
+            mask_paths.append(f"{save_masks_path}{file_name}.tif")
             pbar.update(1)
 
             del masks
@@ -68,4 +72,8 @@ def apply_cfmask(
 
             gc.collect()
 
+    register_scene_paths(
+        save_masks_path, location_name, mask_paths, "mask", scene_catalog_path
+    )
+
     return True
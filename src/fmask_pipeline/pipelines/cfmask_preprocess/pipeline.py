@@ -24,6 +24,7 @@ def create_pipeline(**kwargs) -> Pipeline:
                     "save_plots_path": "params:configs.save_plot_masks_path",
                     "scale_factor": "params:configs.scale_factor",
                     "skip_masks": "params:configs.skip_cfmasks",
+                    "scene_catalog_path": "params:configs.scene_catalog_path",
                 },
                 outputs="CF_mask_dependency",
                 name="apply_CFMask",
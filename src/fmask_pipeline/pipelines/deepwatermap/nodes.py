@@ -1,10 +1,12 @@
-import glob
 import logging
 import os
 
 from tqdm import tqdm
 
 import utils.deepwatermap.inference as deep_water_map
+from utils.area_and_volume_estimation.streaming import StreamingAreaEstimator
+from utils.datacube.datacube import append_scene_paths
+from utils.scene_catalog.scene_catalog import list_scene_paths, register_scene_paths
 
 logger = logging.getLogger(__name__)
 
@@ -35,6 +37,16 @@ def apply_deep_water_map(
     offset,
     skip_deepewatermap,
     threshold,
+    batch_mode: bool = False,
+    batch_memory_mb: float = 2048,
+    scene_catalog_path: str = None,
+    datacube_path: str = None,
+    probability_encoding: str = "float32",
+    thresholds: list = (),
+    fused_area: bool = False,
+    probability_map_write: str = "sync",
+    path_shapefile: str = None,
+    area_method: str = "reprojected",
     *args,
     **kwargs,
 ):
@@ -42,22 +54,62 @@ def apply_deep_water_map(
         logger.warning("Skip Deep Water Mask processing")
         return True
 
-    path = f"{images_path}{location_name}"
-    tif_files = glob.glob(os.path.join(path, "**", "*.tif"), recursive=True)
+    tif_files = list_scene_paths(images_path, location_name, scene_catalog_path)
+    save_paths = [
+        f"{water_masks_save_path}{location_name}/{tif_path.split('/')[-2]}/{tif_path.split('/')[-1]}"
+        for tif_path in tif_files
+    ]
     total_tifs = len(tif_files)
 
+    if probability_map_write == "none" and not fused_area:
+        logger.warning("probability_map_write none needs fused_area, using sync")
+        probability_map_write = "sync"
+
+    # areas computed from the maps in memory, estimate_water_area does not
+    # read the probability GeoTIFFs again
+    area_estimator = None
+    if fused_area:
+        area_estimator = StreamingAreaEstimator(path_shapefile, thresholds, area_method)
+
+    # the model is loaded once and shared by every scene
+    session = deep_water_map.DeepWaterMapSession(
+        encoding=probability_encoding,
+        thresholds=thresholds,
+        write_mode=probability_map_write,
+        area_estimator=area_estimator,
+    )
+
     with tqdm(
         total=total_tifs, desc="Segmenting Water in Images", unit="images"
     ) as pbar:
-        for path in tif_files:
-            tif_path = path.replace("\\", "/")
-            deep_water_map.main(
-                image_path=tif_path,
-                save_path=f"{water_masks_save_path}{location_name}/{tif_path.split('/')[-2]}/{tif_path.split('/')[-1]}",
-                scale_factor=scale_factor,
-                offset=offset,
-                threshold=threshold,
-            )
-            pbar.update(1)
+        if batch_mode:
+            # scenes with the same padded shape share a single prediction
+            for n_scenes in session.infer_batch(
+                image_paths=tif_files,
+                save_paths=save_paths,
+                memory_budget_mb=batch_memory_mb,
+            ):
+                pbar.update(n_scenes)
+        else:
+            for tif_path, save_path in zip(tif_files, save_paths):
+                deep_water_map.main(
+                    image_path=tif_path,
+                    save_path=save_path,
+                    scale_factor=scale_factor,
+                    offset=offset,
+                    threshold=threshold,
+                    session=session,
+                )
+                pbar.update(1)
 
-    return True
+    # wait for the maps still being written in the background
+    session.close()
+
+    if probability_map_write != "none":
+        register_scene_paths(
+            water_masks_save_path, location_name, save_paths, "water_mask", scene_catalog_path
+        )
+        append_scene_paths(datacube_path, location_name, save_paths, "water_mask")
+
+    # fused mode: the area rows go to estimate_water_area with the dependency
+    return area_estimator.records if fused_area else True
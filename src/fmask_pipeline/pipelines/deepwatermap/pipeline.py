@@ -32,6 +32,16 @@ def create_pipeline(dependencies: list=["created_deep_water_map_dirs_dependency"
                     "offset": "params:configs.offset",
                     "skip_deepewatermap": "params:configs.skip_deepewatermap",
                     "threshold": "params:configs.deepwatermap_threshold",
+                    "batch_mode": "params:configs.deepwatermap_batch_mode",
+                    "batch_memory_mb": "params:configs.deepwatermap_batch_memory_mb",
+                    "scene_catalog_path": "params:configs.scene_catalog_path",
+                    "datacube_path": "params:configs.datacube_path",
+                    "probability_encoding": "params:configs.probability_encoding",
+                    "thresholds": "params:configs.thresholds",
+                    "fused_area": "params:configs.fused_area",
+                    "probability_map_write": "params:configs.probability_map_write",
+                    "path_shapefile": "params:configs.path_shapefile",
+                    "area_method": "params:configs.area_method",
                     dependencies[0]: dependencies[0],
                     dependencies[1]: dependencies[1],
                 },
@@ -7,17 +7,27 @@ import geojson
 import geopandas as gpd
 from tqdm import tqdm
 
+from utils.datacube.datacube import append_scene_paths
+from utils.download.bands import get_original_bands_name
+from utils.download.cloud_screening import ROI_CLOUD_COLUMN, roi_cloud_percentages
 from utils.download.download import (
     adjust_date,
     download_mosaic_image,
     download_scene,
+    get_band_layout,
     get_image_metadata,
-    get_original_bands_name,
+    get_roi_bounds,
     group_images_by_date,
     is_TOA,
+    request_grid,
     save_metadata_as_csv,
     validate_date,
 )
+from utils.download.manifest import DownloadManifest, roi_hash
+from utils.download.metadata import get_collection_summary, get_images_properties
+from utils.download.tiling import plan_tiles
+from utils.download.transfer import create_session, run_concurrently
+from utils.scene_catalog.scene_catalog import SceneCatalog, list_scene_paths
 
 # Obter o logger específico do node
 logger = logging.getLogger(__name__)
@@ -69,6 +79,14 @@ def shapefile2feature_collection(
     return fc
 
 
+def index_downloaded_scenes(
+    scene_catalog_path: str, dowload_path: str, location_name: str, level: str
+) -> None:
+    """Rebuild the catalogue entries of the downloaded images"""
+    with SceneCatalog(scene_catalog_path) as catalog:
+        catalog.index_directory(dowload_path, location_name, level)
+
+
 def donwload_images(
     collection_ids: list,
     location_name: str,
@@ -81,11 +99,38 @@ def donwload_images(
     skip_download: bool = False,
     save_metadata: bool = True,
     scale: int = 10,
+    scene_catalog_path: str = None,
+    max_concurrent_downloads: int = 4,
+    download_max_retries: int = 5,
+    incremental_download: bool = True,
+    verify_checksum: bool = False,
+    tiled_download: bool = True,
+    max_request_mb: float = 40,
+    tile_workers: int = 4,
+    cloud_screening: bool = False,
+    max_roi_cloud_percentage: float = 100,
+    cloud_screening_source: str = "probability",
+    cloud_probability_threshold: int = 50,
+    cloud_screening_scale: int = 60,
+    datacube_path: str = None,
     *args,
     **kwargs,
 ) -> bool:
+    # TOA ou BOA, último termo do prefixo (ex.: sentinel_6B_TOA)
+    level = prefix_images_name.split("_")[-1]
+
     if skip_download:
         logger.warning("Skip Download of images")
+        if scene_catalog_path:
+            index_downloaded_scenes(
+                scene_catalog_path, dowload_path, location_name, level
+            )
+        append_scene_paths(
+            datacube_path,
+            location_name,
+            list_scene_paths(dowload_path, location_name, scene_catalog_path),
+            level,
+        )
         return True
 
     for collection_id in collection_ids:
@@ -124,18 +169,17 @@ def donwload_images(
             .filterDate(new_init_date, new_final_date)
             .filterBounds(roi)
         )
-        collection_lenght = collection.size().getInfo()
+        # Tamanho, ids e datas da coleção em uma única consulta
+        summary = get_collection_summary(collection)
+        collection_lenght = summary["size"]
         logger.info(f"Total images: {collection_lenght}")
 
         if collection_lenght == 0:
             logger.warning("Coleção com 0 imagens, passando para a próxima coleção")
             continue
 
-        min_date = collection.aggregate_min("system:time_start")
-        max_date = collection.aggregate_max("system:time_start")
-
-        min_date = ee.Date(min_date).format("YYYY-MM-dd").getInfo()
-        max_date = ee.Date(max_date).format("YYYY-MM-dd").getInfo()
+        min_date = summary["min_date"]
+        max_date = summary["max_date"]
 
         logger.info(f"Donwload: {collection_id} collection")
         logger.info(f"Collection Date Availability: {min_date} - {max_date}")
@@ -151,14 +195,44 @@ def donwload_images(
             )
             logger.warning(f"Download Bands: {new_selected_bands}")
 
-        images = collection.toList(collection.size()).getInfo()
+        images = [{"id": image_id} for image_id in summary["ids"]]
         image_info_df = []
 
         images_ids_group = group_images_by_date(images)
 
-        for i, images_ids in enumerate(
-            tqdm(images_ids_group, desc="Downloading Images", unit="imagem")
-        ):
+        path = Path(f"{dowload_path}{location_name}")
+        output_file_csv = Path(path / "metadata")
+
+        # Grupos já baixados (e íntegros) em execuções anteriores são pulados
+        manifest = None
+        if incremental_download:
+            manifest = DownloadManifest(output_file_csv / "download_manifest.jsonl")
+        roi_key = roi_hash(roi)
+        skipped, screened = 0, 0
+
+        # Limites da ROI, para dividir em tiles os downloads maiores que o
+        # limite do getDownloadURL, e número de bandas e bytes por valor
+        # (iguais em toda a coleção, ex.: 4 nas bandas float do TOA Landsat).
+        # A grade das requisições (região ou tiles) entra na chave do manifesto
+        roi_bounds, n_bands, bytes_per_value = None, None, None
+        grid = "region"
+        if tiled_download:
+            roi_bounds = get_roi_bounds(roi)
+            image = ee.Image(summary["ids"][0])
+            if new_selected_bands:
+                image = image.select(new_selected_bands)
+            n_bands, bytes_per_value = get_band_layout(image)
+            tiles = plan_tiles(
+                roi_bounds,
+                scale=scale,
+                n_bands=n_bands,
+                bytes_per_value=bytes_per_value,
+                max_request_bytes=int(max_request_mb * 1024 * 1024),
+            )
+            grid = request_grid(tiles, max_request_mb)
+
+        tasks = []
+        for images_ids in images_ids_group:
             image_id = images_ids[0]
             date = None
 
@@ -167,34 +241,145 @@ def donwload_images(
             else:
                 date = image_id.split("/")[-1].split("_")[1]
 
-            path = Path(f"{dowload_path}{location_name}")
-
             output_file_tif = Path(
                 path
                 / date[:4]
                 / f"{prefix_images_name}_{satelite_name}_{location_name}_{date[:8]}.tif"
             )
+            key = DownloadManifest.key(
+                collection_id=collection_id,
+                date=date[:8],
+                image_ids=images_ids,
+                bands=new_selected_bands,
+                scale=scale,
+                roi_hash=roi_key,
+                grid=grid,
+            )
+            if manifest is not None and manifest.is_complete(
+                key, output_file_tif, verify_checksum=verify_checksum
+            ):
+                image_info_df.extend(manifest.metadata(key))
+                skipped += 1
+                continue
+            # grupos já descartados pela triagem de nuvens não são recalculados
+            if (
+                cloud_screening
+                and manifest is not None
+                and manifest.is_screened(key, output_file_tif, max_roi_cloud_percentage)
+            ):
+                screened += 1
+                continue
+
+            tasks.append((images_ids, output_file_tif, key))
+
+        logger.info(
+            f"{skipped} date groups already downloaded, {screened} already "
+            f"screened out, {len(tasks)} to download"
+        )
+
+        # Porcentagem de nuvens dentro da ROI, calculada no GEE antes do
+        # download; grupos acima do limite não são baixados
+        roi_clouds = {}
+        if cloud_screening and tasks:
+            percentages = roi_cloud_percentages(
+                [images_ids for images_ids, _, _ in tasks],
+                satellite=satelite_name,
+                roi=roi,
+                scale=cloud_screening_scale,
+                source=cloud_screening_source,
+                probability_threshold=cloud_probability_threshold,
+            )
+            roi_clouds = {
+                output_file_tif: percentage
+                for (_, output_file_tif, _), percentage in zip(tasks, percentages)
+            }
+            cloudy = [
+                task
+                for task in tasks
+                if roi_clouds[task[1]] is not None
+                and roi_clouds[task[1]] > max_roi_cloud_percentage
+            ]
+            tasks = [task for task in tasks if task not in cloudy]
+            logger.info(
+                f"{len(cloudy)} date groups with more than "
+                f"{max_roi_cloud_percentage}% of clouds in the ROI skipped"
+            )
+            if manifest is not None:
+                for images_ids, output_file_tif, key in cloudy:
+                    manifest.record_screened(
+                        key,
+                        output_file_tif,
+                        roi_clouds[output_file_tif],
+                        collection_id=collection_id,
+                        image_ids=images_ids,
+                    )
+
+        # Metadados das imagens a baixar, em lote e com cache local
+        properties = get_images_properties(
+            [image_id for images_ids, _, _ in tasks for image_id in images_ids],
+            cache_path=output_file_csv / "ee_properties_cache.json",
+        )
 
-            output_file_csv = Path(path / "metadata")
+        # Os mosaicos são baixados em paralelo, compartilhando as conexões
+        session = create_session(pool_size=max_concurrent_downloads * tile_workers)
+
+        def download_group(images_ids, output_file_tif, key):
+            return download_mosaic_image(
+                image_ids=images_ids,
+                roi=roi,
+                selected_bands=new_selected_bands,
+                scale=scale,
+                output_file=output_file_tif,
+                session=session,
+                max_retries=download_max_retries,
+                metadata=properties,
+                roi_bounds=roi_bounds,
+                max_request_mb=max_request_mb,
+                n_bands=n_bands,
+                bytes_per_value=bytes_per_value,
+                tile_workers=tile_workers,
+            )
 
-            image_info_export = []
-            try:
-                image_info_export = download_mosaic_image(
+        for (images_ids, output_file_tif, key), image_info_export in tqdm(
+            run_concurrently(download_group, tasks, max_workers=max_concurrent_downloads),
+            total=len(tasks),
+            desc="Downloading Images",
+            unit="imagem",
+        ):
+            image_id = images_ids[0]
+            if isinstance(image_info_export, Exception):
+                logger.error(f"Error downloading image {image_id}: {image_info_export}")
+                continue
+
+            for image in image_info_export:
+                image["image_id"] = image_id
+                image["location_name"] = location_name
+                image["file_name"] = output_file_tif.resolve()
+                if cloud_screening:
+                    image[ROI_CLOUD_COLUMN] = roi_clouds.get(output_file_tif)
+                image_info_df.append(image)
+
+            # download_mosaic_image retorna [] quando o download falha
+            if manifest is not None and image_info_export:
+                manifest.record(
+                    key,
+                    output_file_tif,
+                    metadata=image_info_export,
+                    collection_id=collection_id,
                     image_ids=images_ids,
-                    roi=roi,
-                    selected_bands=new_selected_bands,
+                    bands=new_selected_bands,
                     scale=scale,
-                    output_file=output_file_tif,
+                    roi_hash=roi_key,
+                    grid=grid,
                 )
 
-                for image in image_info_export:
-                    image["image_id"] = image_id
-                    image["location_name"] = location_name
-                    image["file_name"] = output_file_tif.resolve()
-                    image_info_df.append(image)
-            except Exception as e:
-                logger.error(f"Error downloading image {image_id}: {e}")
-                continue
+        session.close()
+
+        if manifest is not None:
+            manifest.compact()
+
+        # Os downloads terminam fora de ordem, o CSV segue a ordem das datas
+        image_info_df.sort(key=lambda image: str(image["file_name"]))
 
         if save_metadata:
             save_metadata_as_csv(
@@ -202,4 +387,15 @@ def donwload_images(
             )
             logger.info("Metadata saved as CSV")
 
+    if scene_catalog_path:
+        index_downloaded_scenes(scene_catalog_path, dowload_path, location_name, level)
+
+    # Datacube (Zarr) das imagens, atualizado apenas com as datas novas
+    append_scene_paths(
+        datacube_path,
+        location_name,
+        list_scene_paths(dowload_path, location_name, scene_catalog_path),
+        level,
+    )
+
     return True
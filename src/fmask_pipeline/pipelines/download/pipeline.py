@@ -51,6 +51,20 @@ def create_pipeline(**kwargs) -> Pipeline:
                     "selected_bands": "params:configs.selected_bands",
                     "scale": "params:configs.scale",
                     "skip_download": "params:configs.toa_skip_download",
+                    "scene_catalog_path": "params:configs.scene_catalog_path",
+                    "datacube_path": "params:configs.datacube_path",
+                    "max_concurrent_downloads": "params:configs.max_concurrent_downloads",
+                    "download_max_retries": "params:configs.download_max_retries",
+                    "incremental_download": "params:configs.incremental_download",
+                    "verify_checksum": "params:configs.download_verify_checksum",
+                    "tiled_download": "params:configs.tiled_download",
+                    "max_request_mb": "params:configs.max_request_mb",
+                    "tile_workers": "params:configs.tile_workers",
+                    "cloud_screening": "params:configs.cloud_screening",
+                    "max_roi_cloud_percentage": "params:configs.max_roi_cloud_percentage",
+                    "cloud_screening_source": "params:configs.cloud_screening_source",
+                    "cloud_probability_threshold": "params:configs.cloud_probability_threshold",
+                    "cloud_screening_scale": "params:configs.cloud_screening_scale",
                     "roi": "shapefile_features",
                 },
                 outputs="TOA_download_images_dependency",
@@ -70,6 +84,20 @@ def create_pipeline(**kwargs) -> Pipeline:
                     "selected_bands": "params:configs.selected_bands",
                     "scale": "params:configs.scale",
                     "skip_download": "params:configs.boa_skip_download",
+                    "scene_catalog_path": "params:configs.scene_catalog_path",
+                    "datacube_path": "params:configs.datacube_path",
+                    "max_concurrent_downloads": "params:configs.max_concurrent_downloads",
+                    "download_max_retries": "params:configs.download_max_retries",
+                    "incremental_download": "params:configs.incremental_download",
+                    "verify_checksum": "params:configs.download_verify_checksum",
+                    "tiled_download": "params:configs.tiled_download",
+                    "max_request_mb": "params:configs.max_request_mb",
+                    "tile_workers": "params:configs.tile_workers",
+                    "cloud_screening": "params:configs.cloud_screening",
+                    "max_roi_cloud_percentage": "params:configs.max_roi_cloud_percentage",
+                    "cloud_screening_source": "params:configs.cloud_screening_source",
+                    "cloud_probability_threshold": "params:configs.cloud_probability_threshold",
+                    "cloud_screening_scale": "params:configs.cloud_screening_scale",
                     "roi": "shapefile_features",
                 },
                 outputs="BOA_download_images_dependency",
@@ -1,13 +1,25 @@
 import glob
 import logging
 import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
 
 import rasterio as TIFF
 from tqdm import tqdm
 
 from utils.cloud_removal.bcl import BCL
-from utils.fmask.Fmask import Fmask
-from utils.fmask.fmask_utils import save_mask_tif, save_overlayed_mask_plot
+from utils.cloud_removal.compositing import (
+    composite_year,
+    list_year_scenes,
+    pair_scenes,
+)
+from utils.datacube.datacube import append_scene_paths
+from utils.fmask.Fmask import process_single_scene
+from utils.scene_catalog.scene_catalog import (
+    SceneCatalog,
+    list_scene_paths,
+    register_scene_paths,
+)
 
 logger = logging.getLogger(__name__)
 
@@ -19,6 +31,12 @@ def apply_fmask(
     save_plots_path: str,
     scale_factor: int = 1,
     skip_masks: bool = False,
+    tiled: bool = False,
+    block_size: int = 1024,
+    max_workers: int | None = 1,
+    skip_existing: bool = False,
+    scene_catalog_path: str = None,
+    datacube_path: str = None,
     *args,
     **kwargs,
 ):
@@ -26,27 +44,63 @@ def apply_fmask(
         logger.warning("Skip generation of cloud and shadow masks")
         return True
 
-    fmask = Fmask(scale_factor=scale_factor)
-    inputs = glob.glob(f"{toa_path}{location_name}/*/*.tif")
+    inputs = list_scene_paths(toa_path, location_name, scene_catalog_path)
 
+    tasks = []
     for inp in inputs:
         inp = inp.replace("\\", "/")
         file_name = f"{location_name}/{inp.split('/')[-2]}/mask_{inp.split('/')[-1].split('.')[0]}"
-
-        color_composite, cloud_mask, shadow_mask, water_mask = fmask.create_fmask(inp)
-
-        save_overlayed_mask_plot(
-            [cloud_mask, shadow_mask, water_mask],
-            color_composite,
-            output_file=f"{save_plots_path}{file_name}.png",
+        tasks.append(
+            (
+                inp,
+                f"{save_masks_path}{file_name}.tif",
+                f"{save_plots_path}{file_name}.png",
+                scale_factor,
+                tiled,
+                block_size,
+                skip_existing,
+            )
         )
 
-        save_mask_tif(
-            cloud_mask=cloud_mask,
-            cloud_shadow_mask=shadow_mask,
-            water_mask=water_mask,
-            original_tif_file=inp,
-            output_file=f"{save_masks_path}{file_name}.tif",
+    logger.info(f"Applying Fmask using {max_workers} workers...")
+    start = time.perf_counter()
+    results = []
+
+    with tqdm(total=len(tasks), desc="Fmask", unit="images") as pbar:
+        if max_workers == 1:
+            for task in tasks:
+                results.append(process_single_scene(task))
+                pbar.update(1)
+        else:
+            with ProcessPoolExecutor(max_workers=max_workers) as executor:
+                futures = [
+                    executor.submit(process_single_scene, task) for task in tasks
+                ]
+                for future in as_completed(futures):
+                    results.append(future.result())
+                    pbar.update(1)
+
+    register_scene_paths(
+        save_masks_path, location_name, [task[1] for task in tasks], "mask", scene_catalog_path
+    )
+    append_scene_paths(
+        datacube_path, location_name, [task[1] for task in tasks], "mask"
+    )
+
+    processed = [r for r in results if not r["skipped"]]
+    for r in processed:
+        logger.debug(f"Fmask {r['scene']}: {r['seconds']:.2f} s")
+
+    logger.info(
+        f"Fmask: {len(processed)} scenes processed, "
+        f"{len(results) - len(processed)} already up to date, "
+        f"{time.perf_counter() - start:.1f} s total"
+    )
+    if processed:
+        seconds = [r["seconds"] for r in processed]
+        logger.info(
+            f"Fmask time per scene: mean {sum(seconds) / len(seconds):.2f} s, "
+            f"max {max(seconds):.2f} s"
         )
 
     return True
@@ -62,6 +116,10 @@ def cloud_removal(
     final_date: str,
     skip_clean: bool,
     color_file_log_path: str,
+    engine: str = "vectorized",
+    max_block_mb: float = 256,
+    scene_catalog_path: str = None,
+    datacube_path: str = None,
     *args,
     **kwargs,
 ):
@@ -73,8 +131,15 @@ def cloud_removal(
 
     year_range = range(int(init_date.split("-")[0]), int(final_date.split("-")[0]) + 1)
 
-    tif_files = glob.glob(os.path.join(path_images, "**", "*.tif"), recursive=True)
-    total_tifs = len(tif_files)
+    # Sem o catálogo, as imagens e máscaras são buscadas listando os diretórios
+    catalog = SceneCatalog(scene_catalog_path) if scene_catalog_path else None
+    if catalog is not None:
+        total_tifs = len(catalog.scenes(location_name, root=path_images))
+    else:
+        tif_files = glob.glob(os.path.join(path_images, "**", "*.tif"), recursive=True)
+        total_tifs = len(tif_files)
+
+    clean_paths = []
 
     with tqdm(total=total_tifs, desc="Cleaning Images", unit="file") as pbar:
         for year in year_range:
@@ -82,17 +147,48 @@ def cloud_removal(
             path_masks_year = f"{path_masks}{location_name}/{year}/"
             color_file_log = f"{color_file_log_path}{location_name}/{year}/"
 
-            for image in os.listdir(path_images_year):
-                # Greping img_size limits
-                with TIFF.open(path_images_year + image) as tiff:
-                    image_tiff = tiff.read()
+            images_by_date, masks_by_date = None, None
+            if catalog is not None:
+                images_by_date = catalog.paths_by_date(location_name, path_images, year)
+                masks_by_date = catalog.paths_by_date(location_name, path_masks, year)
+
+            if engine == "vectorized":
+                output_path_year = f"{output_path}{location_name}/{year}/"
+                os.makedirs(output_path_year, exist_ok=True)
+                os.makedirs(color_file_log, exist_ok=True)
 
-                size = image_tiff.shape[1], image_tiff.shape[2]
+                if catalog is not None:
+                    scenes = pair_scenes(images_by_date, masks_by_date)
+                else:
+                    scenes = list_year_scenes(path_images_year, path_masks_year)
+
+                for output_file in composite_year(
+                    scenes=scenes,
+                    output_path=output_path_year,
+                    color_file_path=color_file_log,
+                    cloud_pixels=cloud_and_cloud_shadow_pixels,
+                    max_block_mb=max_block_mb,
+                ):
+                    if catalog is not None:
+                        catalog.register(output_path, location_name, output_file, "clean")
+                    clean_paths.append(output_file)
+                    pbar.update(1)
+                continue
+
+            images = (
+                [os.path.basename(path) for path in images_by_date.values()]
+                if catalog is not None
+                else os.listdir(path_images_year)
+            )
+            for image in images:
+                # Greping img_size limits, sem ler as bandas
+                with TIFF.open(path_images_year + image) as tiff:
+                    size = tiff.height, tiff.width
 
                 # obtenção da data
                 date = image.split("_")[-1].split(".")[0].replace("-", "")
 
-                # logger.info(f"Image shape: {image_tiff.shape} | Image date: {date}")
+                # logger.info(f"Image shape: {size} | Image date: {date}")
 
                 # Classe que será utilizada
                 i = BCL(
@@ -105,6 +201,8 @@ def cloud_removal(
                     cloud_pixels=cloud_and_cloud_shadow_pixels,
                     use_dec_tree=False,
                     color_file_path=color_file_log,
+                    images_by_date=images_by_date,
+                    masks_by_date=masks_by_date,
                 )
 
                 # Correção
@@ -119,8 +217,18 @@ def cloud_removal(
                     logger.error(e)
                     continue
 
+                clean_path = f"{output_path}{location_name}/{year}/{image.replace('.tif', '')}_clean.tif"
+                if catalog is not None:
+                    catalog.register(output_path, location_name, clean_path, "clean")
+                clean_paths.append(clean_path)
+
                 pbar.update(1)
                 # cv2.imwrite(output_path + f"mask_{image}.png", i.mask)
                 i.death()
 
+    if catalog is not None:
+        catalog.close()
+
+    append_scene_paths(datacube_path, location_name, clean_paths, "clean")
+
     return True
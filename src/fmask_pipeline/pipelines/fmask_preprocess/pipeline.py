@@ -22,6 +22,12 @@ def create_pipeline(**kwargs) -> Pipeline:
                     "save_plots_path": "params:configs.save_plot_masks_path",
                     "scale_factor": "params:configs.scale_factor",
                     "skip_masks": "params:configs.skip_masks",
+                    "tiled": "params:configs.fmask_tiled",
+                    "block_size": "params:configs.fmask_block_size",
+                    "max_workers": "params:configs.fmask_max_workers",
+                    "skip_existing": "params:configs.fmask_skip_existing",
+                    "scene_catalog_path": "params:configs.scene_catalog_path",
+                    "datacube_path": "params:configs.datacube_path",
                 },
                 outputs="Fmask_dependency",
                 name="appy_FMask",
@@ -39,6 +45,10 @@ def create_pipeline(**kwargs) -> Pipeline:
                     "final_date": "params:configs.final_date",
                     "skip_clean": "params:configs.skip_clean",
                     "color_file_log_path": "params:configs.cloud_removal_log",
+                    "engine": "params:configs.cloud_removal_engine",
+                    "max_block_mb": "params:configs.cloud_removal_max_block_mb",
+                    "scene_catalog_path": "params:configs.scene_catalog_path",
+                    "datacube_path": "params:configs.datacube_path",
                 },
                 outputs="cloud_removed_dependency",
                 name="Cloud_removal",
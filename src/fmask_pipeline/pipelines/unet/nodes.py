@@ -9,6 +9,7 @@ import torch
 from tqdm import tqdm
 
 from utils.pytorch.pytorch_general_utils import torch_model_cloud_and_shadows_inference
+from utils.scene_catalog.scene_catalog import register_scene_paths
 from utils.unet.unet_utils import load_unet_model
 
 logger = logging.getLogger(__name__)
@@ -22,6 +23,7 @@ def apply_unet(
     model_path: str = None,
     unet_params: dict = None,
     scale_factor: float = 1.0,
+    scene_catalog_path: str = None,
     *args,
     **kwargs,
 ):
@@ -37,6 +39,8 @@ def apply_unet(
         skip_masks (bool, opcional): Se True, pula a geração das máscaras. Default é False.
          (str, opcional): Caminho do modelo UNet. Default é None.
         unet_params (dict, opcional): Parâmetros adicionais para a UNet. Default é None.
+        scene_catalog_path (str, opcional): Catálogo de cenas onde as máscaras são
+            registradas. Default é None.
     """
     if skip_masks:
         logger.warning("Pular geração das máscaras com UNet")
@@ -54,6 +58,7 @@ def apply_unet(
     # Procura os arquivos TIFF com 13 bandas usando pathlib
     inputs = list(Path(toa_path, location_name).rglob("*.tif"))
     total_tifs = len(inputs)
+    mask_paths = []
 
 
     with tqdm(
@@ -73,6 +78,14 @@ def apply_unet(
                 model=model,
                 scale_factor=scale_factor
             )
+            # imagens sem 13 bandas não geram máscara
+            mask_path = f"{save_masks_path}{file_name}.tif"
+            if os.path.exists(mask_path):
+                mask_paths.append(mask_path)
             pbar.update(1)
 
+    register_scene_paths(
+        save_masks_path, location_name, mask_paths, "mask", scene_catalog_path
+    )
+
     return True
@@ -25,6 +25,7 @@ def create_pipeline(**kwargs) -> Pipeline:
                     "skip_masks": "params:configs.skip_unet_masks",
                     "unet_params": "params:configs.unet",
                     "scale_factor": "params:configs.scale_factor",
+                    "scene_catalog_path": "params:configs.scene_catalog_path",
                 },
                 outputs="unet_segmentation_output",
                 name="apply_UNet",
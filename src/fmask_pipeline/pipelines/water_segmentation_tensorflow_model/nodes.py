@@ -1,10 +1,11 @@
-import glob
 import logging
 import os
 
 from tqdm import tqdm
 
-from utils.watnet.watnet_infer import watnet_infer
+from utils.datacube.datacube import append_scene_paths
+from utils.scene_catalog.scene_catalog import list_scene_paths, register_scene_paths
+from utils.watnet.watnet_infer import watnet_infer_stream
 
 logger = logging.getLogger(__name__)
 
@@ -35,6 +36,10 @@ def apply_water_segmentation_tensorflow_model(
     model_path,
     patch_size,
     threshold,
+    batch_size: int = 32,
+    blend: bool = False,
+    scene_catalog_path: str = None,
+    datacube_path: str = None,
     *args,
     **kwargs,
 ):
@@ -42,22 +47,31 @@ def apply_water_segmentation_tensorflow_model(
         logger.warning("Skip Watnet Mask processing")
         return True
 
-    path = f"{tensorflow_model_images_paths}{location_name}"
-    tif_files = glob.glob(os.path.join(path, "**", "*.tif"), recursive=True)
+    tif_files = list_scene_paths(tensorflow_model_images_paths, location_name, scene_catalog_path)
+    save_paths = [
+        f"{water_masks_save_path}{location_name}/{tif_path.split('/')[-2]}/{tif_path.split('/')[-1]}"
+        for tif_path in tif_files
+    ]
     total_tifs = len(tif_files)
 
     with tqdm(
         total=total_tifs, desc="Segmenting Water in Images", unit="images"
     ) as pbar:
-        for path in tif_files:
-            tif_path = path.replace("\\", "/")
-            watnet_infer(
-                image_path=tif_path,
-                save_path=f"{water_masks_save_path}{location_name}/{tif_path.split('/')[-2]}/{tif_path.split('/')[-1]}",
-                path_model=model_path,
-                patch_size=patch_size,
-                # threshold=threshold,
-            )
+        # patches of consecutive scenes share batches, each scene is saved
+        # as soon as its last patch is predicted
+        for _ in watnet_infer_stream(
+            image_paths=tif_files,
+            save_path=save_paths,
+            path_model=model_path,
+            patch_size=patch_size,
+            batch_size=batch_size,
+            blend=blend,
+        ):
             pbar.update(1)
 
+    register_scene_paths(
+        water_masks_save_path, location_name, save_paths, "water_mask", scene_catalog_path
+    )
+    append_scene_paths(datacube_path, location_name, save_paths, "water_mask")
+
     return True
@@ -41,6 +41,10 @@ def create_pipeline(
                     "threshold": "params:configs.watnet_threshold",
                     "model_path": "params:configs.model_path",
                     "patch_size": "params:configs.patch_size",
+                    "batch_size": "params:configs.tensorflow_model_batch_size",
+                    "blend": "params:configs.tensorflow_model_blend",
+                    "scene_catalog_path": "params:configs.scene_catalog_path",
+                    "datacube_path": "params:configs.datacube_path",
                     dependencies[0]: dependencies[0],
                     dependencies[1]: dependencies[1],
                 },
@@ -1,10 +1,12 @@
-import glob
 import logging
 import os
 
 from tqdm import tqdm
 
-from utils.watnet.watnet_infer import watnet_infer
+from utils.area_and_volume_estimation.streaming import StreamingAreaEstimator
+from utils.datacube.datacube import append_scene_paths
+from utils.scene_catalog.scene_catalog import list_scene_paths, register_scene_paths
+from utils.watnet.watnet_infer import watnet_infer_stream
 
 logger = logging.getLogger(__name__)
 
@@ -33,6 +35,17 @@ def apply_watnet(
     location_name: str,
     skip_watnet,
     threshold,
+    batch_size: int = 32,
+    blend: bool = False,
+    scene_catalog_path: str = None,
+    datacube_path: str = None,
+    probability_encoding: str = "float32",
+    thresholds: list = (),
+    bands: list = None,
+    fused_area: bool = False,
+    probability_map_write: str = "sync",
+    path_shapefile: str = None,
+    area_method: str = "reprojected",
     *args,
     **kwargs,
 ):
@@ -40,20 +53,46 @@ def apply_watnet(
         logger.warning("Skip Watnet Mask processing")
         return True
 
-    path = f"{images_path}{location_name}"
-    tif_files = glob.glob(os.path.join(path, "**", "*.tif"), recursive=True)
+    tif_files = list_scene_paths(images_path, location_name, scene_catalog_path)
+    save_paths = [
+        f"{water_masks_save_path}{location_name}/{tif_path.split('/')[-2]}/{tif_path.split('/')[-1]}"
+        for tif_path in tif_files
+    ]
     total_tifs = len(tif_files)
 
+    if probability_map_write == "none" and not fused_area:
+        logger.warning("probability_map_write none needs fused_area, using sync")
+        probability_map_write = "sync"
+
+    # areas computed from the maps in memory, estimate_water_area does not
+    # read the probability GeoTIFFs again
+    area_estimator = None
+    if fused_area:
+        area_estimator = StreamingAreaEstimator(path_shapefile, thresholds, area_method)
+
     with tqdm(
         total=total_tifs, desc="Segmenting Water in Images", unit="images"
     ) as pbar:
-        for path in tif_files:
-            tif_path = path.replace("\\", "/")
-            watnet_infer(
-                image_path=tif_path,
-                save_path=f"{water_masks_save_path}{location_name}/{tif_path.split('/')[-2]}/{tif_path.split('/')[-1]}",
-                # threshold=threshold,
-            )
+        # patches of consecutive scenes share batches, each scene is saved
+        # as soon as its last patch is predicted
+        for _ in watnet_infer_stream(
+            image_paths=tif_files,
+            save_path=save_paths,
+            batch_size=batch_size,
+            blend=blend,
+            encoding=probability_encoding,
+            thresholds=thresholds,
+            bands=bands,
+            write_mode=probability_map_write,
+            area_estimator=area_estimator,
+        ):
             pbar.update(1)
 
-    return True
+    if probability_map_write != "none":
+        register_scene_paths(
+            water_masks_save_path, location_name, save_paths, "water_mask", scene_catalog_path
+        )
+        append_scene_paths(datacube_path, location_name, save_paths, "water_mask")
+
+    # fused mode: the area rows go to estimate_water_area with the dependency
+    return area_estimator.records if fused_area else True
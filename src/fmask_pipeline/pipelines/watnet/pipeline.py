@@ -36,6 +36,17 @@ def create_pipeline(
                     "location_name": "params:configs.location_name",
                     "skip_watnet": "params:configs.skip_watnet",
                     "threshold": "params:configs.watnet_threshold",
+                    "batch_size": "params:configs.watnet_batch_size",
+                    "blend": "params:configs.watnet_blend",
+                    "scene_catalog_path": "params:configs.scene_catalog_path",
+                    "datacube_path": "params:configs.datacube_path",
+                    "probability_encoding": "params:configs.probability_encoding",
+                    "thresholds": "params:configs.thresholds",
+                    "fused_area": "params:configs.fused_area",
+                    "probability_map_write": "params:configs.probability_map_write",
+                    "path_shapefile": "params:configs.path_shapefile",
+                    "area_method": "params:configs.area_method",
+                    "bands": "params:configs.watnet_bands",
                     dependencies[0]: dependencies[0],
                     dependencies[1]: dependencies[1],
                 },
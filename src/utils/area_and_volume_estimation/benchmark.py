@@ -0,0 +1,112 @@
+"""Area estimation time of the execution backends, by archive size.
+
+Writes an archive of synthetic water probability maps (COGs, like the
+segmentation outputs) on one grid, then times run_area_tasks with the
+serial, threads and processes backends for each number of scenes. The
+pool start-up (and, for processes, sending the ROI plans to each worker)
+is part of the time, as in estimate_water_area. Reports the time of each
+backend, whether the areas match the serial run and the fastest backend.
+
+example:
+$ PYTHONPATH=src python -m utils.area_and_volume_estimation.benchmark
+$ PYTHONPATH=src python -m utils.area_and_volume_estimation.benchmark --size 4096 --scenes 4 16 64 --workers 8
+"""
+
+import argparse
+import logging
+import os
+import tempfile
+
+from utils.area_and_volume_estimation.executor import AREA_BACKENDS, run_area_tasks
+from utils.area_and_volume_estimation.roi_plan import _roi_plans, build_roi_plans
+from utils.raster_io.benchmark import (
+    THRESHOLDS,
+    measure,
+    source_profile,
+    synthetic_probability_map,
+    write_roi,
+)
+from utils.raster_io.quantization import write_probability_map
+
+logger = logging.getLogger(__name__)
+
+
+def write_archive(
+    tmp_dir: str, n_scenes: int, size: int, encoding: str = "float32"
+) -> list:
+    """n_scenes water maps of the same grid, one per day."""
+    profile = source_profile(size)
+    paths = []
+    for i in range(n_scenes):
+        date = f"2024{i // 28 + 1:02d}{i % 28 + 1:02d}"
+        path = os.path.join(tmp_dir, f"water_S2_SR_loc_{date}.tif")
+        data = synthetic_probability_map(size, seed=i)
+        write_probability_map(
+            path, data, profile, encoding=encoding, thresholds=THRESHOLDS
+        )
+        paths.append(path)
+    return paths
+
+
+def area_by_mask(results: list) -> dict:
+    """Areas of the run, by mask and threshold (completion order differs)."""
+    return {
+        (r["water_masks"], r["threshold"]): r["m2_area"]
+        for records in results
+        for r in records
+    }
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--size", type=int, default=2048)
+    parser.add_argument("--scenes", type=int, nargs="+", default=[4, 16, 64])
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--roi-fraction", type=float, default=0.5)
+    parser.add_argument("--area-method", default="reprojected")
+    parser.add_argument("--encoding", default="float32")
+    args = parser.parse_args()
+
+    logger.info(
+        f"Scene: {args.size}x{args.size}, ROI: {args.roi_fraction:.0%}, "
+        f"{args.workers} workers, {args.encoding}"
+    )
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        roi_path = os.path.join(tmp_dir, "roi.geojson")
+        write_roi(source_profile(args.size), roi_path, args.roi_fraction)
+        mask_paths = write_archive(tmp_dir, max(args.scenes), args.size, args.encoding)
+
+        for n_scenes in sorted(args.scenes):
+            paths = mask_paths[:n_scenes]
+            tasks = [
+                (path, roi_path, THRESHOLDS, None, None, args.area_method)
+                for path in paths
+            ]
+            _roi_plans.clear()
+            roi_plans = build_roi_plans(paths, roi_path, args.area_method)
+
+            times, reference = {}, None
+            for backend in AREA_BACKENDS:
+                seconds, results = measure(
+                    lambda: list(
+                        run_area_tasks(tasks, roi_plans, backend, args.workers)
+                    ),
+                    args.repeat,
+                )
+                areas = area_by_mask(results)
+                if reference is None:
+                    reference = areas
+                times[backend] = seconds
+
+                logger.info(
+                    f"{n_scenes:5d} scenes  {backend:10s} {seconds:8.3f} s  "
+                    f"{seconds / n_scenes * 1000:8.1f} ms/scene  "
+                    f"same areas: {areas == reference}"
+                )
+
+            logger.info(
+                f"{n_scenes:5d} scenes  fastest: {min(times, key=times.get)}\n"
+            )
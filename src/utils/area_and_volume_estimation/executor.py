@@ -0,0 +1,55 @@
+import logging
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+
+from .roi_plan import set_roi_plans
+from .water import process_single_mask
+
+logger = logging.getLogger(__name__)
+
+# Execução da estimativa de área: serial, threads (as leituras do GDAL liberam
+# o GIL) ou processos (um initializer carrega os planos da ROI em cada worker)
+AREA_BACKENDS = ("serial", "threads", "processes")
+
+
+def run_area_tasks(
+    tasks: list,
+    roi_plans: dict,
+    backend: str = "processes",
+    max_workers: int | None = None,
+):
+    """Run process_single_mask over the tasks with the chosen backend
+
+    The ROI plans (crop window and pixel weights of each grid) are shared in
+    memory by the threads and the serial loop, and sent once to each worker
+    process by the pool initializer, so no worker reads the shapefile.
+
+    Args:
+        tasks (list): Arguments of process_single_mask, one tuple per mask
+        roi_plans (dict): Plans from build_roi_plans
+        backend (str): serial, threads or processes
+        max_workers (int): Workers of the pool, the executor default when None
+
+    Yields:
+        list: area rows of each mask, in completion order
+    """
+    if backend not in AREA_BACKENDS:
+        raise ValueError(f"Unknown area backend {backend}, use {AREA_BACKENDS}")
+
+    if backend == "serial":
+        set_roi_plans(roi_plans)
+        for task in tasks:
+            yield process_single_mask(task)
+        return
+
+    if backend == "threads":
+        set_roi_plans(roi_plans)
+        executor = ThreadPoolExecutor(max_workers=max_workers)
+    else:
+        executor = ProcessPoolExecutor(
+            max_workers=max_workers, initializer=set_roi_plans, initargs=(roi_plans,)
+        )
+
+    with executor:
+        futures = [executor.submit(process_single_mask, task) for task in tasks]
+        for future in as_completed(futures):
+            yield future.result()
@@ -21,6 +21,9 @@ def crop_raster_with_geojson_obj(src, geojson_path):
             "transform": transform,
         }
     )
+    # o recorte fica em memória, sem compressão nem os blocos do COG
+    for key in ("compress", "predictor", "tiled", "blockxsize", "blockysize"):
+        perfil.pop(key, None)
 
     memfile = MemoryFile()
     dataset = memfile.open(**perfil)
@@ -31,20 +34,23 @@ def crop_raster_with_geojson_obj(src, geojson_path):
 
 
 
-def media_mensal_por_ano(df, column="volume_m2"):
+def media_mensal_por_ano(df, column="volume_m2", keys=()):
     """
     Calcula a média de valores para cada mês de cada ano.
 
     Parâmetros:
         df (pd.DataFrame): DataFrame com colunas ['ano', 'mes', 'valor'].
+        keys (list): Colunas de agrupamento antes de ano e mês (ex: ['threshold']),
+                     as médias de todos os grupos são calculadas de uma vez.
 
     Retorna:
         pd.DataFrame: Agrupado com média por ano e mês.
     """
+    group = list(keys) + ["year", "month"]
     return (
-        df.groupby(["year", "month"], as_index=False)
+        df.groupby(group, as_index=False)
         .agg({f"{column}": "mean"})
-        .sort_values(["year", "month"])
+        .sort_values(group)
         .rename(columns={column: "volume_m2"})
     )
 
@@ -0,0 +1,124 @@
+import logging
+import os
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+
+def threshold_array(thresholds, dtype) -> np.ndarray:
+    """Thresholds in the dtype used by image > t (float32 maps compare in float32)"""
+    dtype = np.dtype(dtype)
+    if not np.issubdtype(dtype, np.floating):
+        dtype = np.dtype(np.float64)
+    return np.asarray(thresholds, dtype=dtype)
+
+
+def weighted_areas_above(
+    image: np.ndarray, weights: np.ndarray, pixel_area: float, thresholds: list
+) -> dict:
+    """Area (m², km²) of the pixels above each threshold, in one pass
+
+    Each pixel is placed between the sorted thresholds (searchsorted) and
+    its weight added to that bin, so the image is read once whatever the
+    number of thresholds. NaN (nodata) pixels are not counted.
+    """
+    levels = np.unique(threshold_array(thresholds, image.dtype))
+    valid = weights != 0
+    if np.issubdtype(image.dtype, np.floating):
+        valid &= ~np.isnan(image)
+
+    # quantidade de limiares abaixo de cada pixel
+    bins = np.searchsorted(levels, image[valid], side="left")
+    totals = np.bincount(bins, weights=weights[valid], minlength=len(levels) + 1)
+    above = np.cumsum(totals[::-1])[::-1][1:] * pixel_area
+
+    results = {}
+    for t in thresholds:
+        level = np.searchsorted(levels, threshold_array([t], image.dtype)[0])
+        area_m2 = float(above[level])
+        results[t] = (area_m2, area_m2 / 1e6)
+    return results
+
+
+class AreaHistogram:
+    """Area above every value of the in-ROI pixels of a scene
+
+    The distinct values of the pixels inside the ROI, sorted, with the area
+    (m²) of the pixels greater or equal to each one. The area above any
+    threshold is a binary search, and the histogram can be saved so new
+    thresholds are evaluated later without reading the raster again.
+    """
+
+    def __init__(self, values: np.ndarray, areas: np.ndarray):
+        self.values = values
+        self.cumulative_areas = areas
+
+    @classmethod
+    def from_image(
+        cls, image: np.ndarray, weights: np.ndarray, pixel_area: float = 1.0
+    ) -> "AreaHistogram":
+        """Histogram of image weighted by the pixel weights of a ROIPlan"""
+        valid = weights != 0
+        if np.issubdtype(image.dtype, np.floating):
+            valid &= ~np.isnan(image)
+
+        values, inverse = np.unique(image[valid], return_inverse=True)
+        totals = np.bincount(inverse.ravel(), weights=weights[valid])
+        areas = np.cumsum(totals[::-1])[::-1] * pixel_area
+        return cls(values, areas)
+
+    def area_above(self, threshold: float) -> float:
+        """Area (m²) of the pixels greater than threshold"""
+        threshold = threshold_array([threshold], self.values.dtype)[0]
+        index = np.searchsorted(self.values, threshold, side="right")
+        return float(self.cumulative_areas[index]) if index < len(self.values) else 0.0
+
+    def areas(self, thresholds: list) -> dict:
+        """Area (m², km²) above each threshold, as ROIPlan.areas"""
+        results = {}
+        for t in thresholds:
+            area_m2 = self.area_above(t)
+            results[t] = (area_m2, area_m2 / 1e6)
+        return results
+
+    def save(self, path: str, **metadata) -> None:
+        """Save as .npz, metadata (ROI, area method, ...) is stored as text"""
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        tmp_file = f"{path}.part.npz"
+        np.savez_compressed(
+            tmp_file,
+            values=self.values,
+            areas=self.cumulative_areas,
+            **{key: np.array(str(value)) for key, value in metadata.items()},
+        )
+        os.replace(tmp_file, path)
+
+    @classmethod
+    def load(cls, path: str, **metadata) -> "AreaHistogram":
+        """Saved histogram, None when it is missing or its metadata differs"""
+        if not os.path.exists(path):
+            return None
+        with np.load(path) as data:
+            for key, value in metadata.items():
+                if key not in data or str(data[key]) != str(value):
+                    return None
+            return cls(data["values"], data["areas"])
+
+
+def histogram_file(histogram_dir: str, mask_path: str) -> str:
+    """Path of the saved histogram of a mask"""
+    name = os.path.splitext(os.path.basename(mask_path))[0]
+    return os.path.join(histogram_dir, f"{name}.npz")
+
+
+def is_histogram_stale(path: str, *sources) -> bool:
+    """True if the histogram is missing or older than any of its sources;
+    sources that no longer exist (archived masks) do not invalidate it"""
+    if not os.path.exists(path):
+        return True
+    mtime = os.path.getmtime(path)
+    return any(
+        os.path.exists(source) and os.path.getmtime(source) > mtime
+        for source in sources
+    )
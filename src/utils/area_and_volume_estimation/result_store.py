@@ -0,0 +1,177 @@
+import hashlib
+import json
+import logging
+import os
+
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+# Colunas das partições do store (diretórios location=.../method=.../threshold=...)
+PARTITION_COLUMNS = ("location", "method", "threshold")
+
+
+def acquisition_dates(df: pd.DataFrame) -> pd.Series:
+    """Acquisition date of the area / volume rows, from year, month and day"""
+    return pd.to_datetime(
+        df["year"].astype(str)
+        + df["month"].astype(str).str.zfill(2)
+        + df["day"].astype(str).str.zfill(2),
+        format="%Y%m%d",
+    )
+
+
+def file_mtime(path: str) -> float:
+    """Modification time of a file, NaN when it does not exist"""
+    return os.path.getmtime(path) if os.path.exists(path) else float("nan")
+
+
+def file_digest(path: str) -> str:
+    """sha256 of a file (ROI, CAV curve), None when it does not exist"""
+    if not path or not os.path.exists(path):
+        return None
+    with open(path, "rb") as file:
+        return hashlib.sha256(file.read()).hexdigest()[:16]
+
+
+def config_hash(*values) -> str:
+    """Hash of the settings the rows of a table are computed with"""
+    return hashlib.sha256(json.dumps(values, default=str).encode()).hexdigest()[:16]
+
+
+def merge_rows(stored: pd.DataFrame, rows: pd.DataFrame, key: str = "water_masks"):
+    """Rows of stored with those of rows inserted or replaced (by key)
+
+    Returns:
+        tuple: (rows sorted by date and key, boolean array of the rows that
+                came from rows)
+    """
+    scenes = rows[key]
+    if stored is not None:
+        stored = stored[~stored[key].isin(scenes)]
+        rows = pd.concat([stored, rows], ignore_index=True)
+
+    # ordem estável por data e cena, igual em todas as execuções
+    partition = rows.sort_values(["date", key], kind="mergesort").reset_index(
+        drop=True
+    )
+    return partition, partition[key].isin(scenes).to_numpy()
+
+
+class ResultStore:
+    """Partitioned Parquet store of the area and volume results
+
+    Each table (areas, volumes) is split in one Parquet file per location,
+    method and threshold (hive partitions, readable at once with
+    pd.read_parquet(root/table)). The rows of a partition are sorted by
+    acquisition date, and upsert replaces the rows of the scenes it receives,
+    so running a date again does not duplicate it.
+
+    Each row keeps the hash of the settings it was computed with (config:
+    area method, ROI and mask source for the areas; CAV curve and scale for
+    the volumes). Reads with another config leave those rows out, and
+    upserts drop them, so changed settings are never answered from the store.
+    """
+
+    def __init__(self, root: str):
+        self.root = root
+
+    def partition_path(
+        self, table: str, location: str, method: str, threshold: float
+    ) -> str:
+        return os.path.join(
+            self.root,
+            table,
+            f"location={location}",
+            f"method={method}",
+            f"threshold={threshold}",
+            "part.parquet",
+        )
+
+    def read(
+        self,
+        table: str,
+        location: str,
+        method: str,
+        threshold: float,
+        config: str = None,
+    ) -> pd.DataFrame:
+        """Rows of a partition sorted by date (only those computed with config,
+        when it is given), None when there are none"""
+        path = self.partition_path(table, location, method, threshold)
+        if not os.path.exists(path):
+            return None
+        df = pd.read_parquet(path)
+        if config is not None:
+            if "config" not in df.columns:
+                return None
+            df = df[df["config"] == config].reset_index(drop=True)
+        return df if len(df) else None
+
+    def write(
+        self,
+        table: str,
+        location: str,
+        method: str,
+        threshold: float,
+        df: pd.DataFrame,
+    ) -> None:
+        """Replace a partition (written to a temporary file and renamed)"""
+        path = self.partition_path(table, location, method, threshold)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_file = f"{path}.part"
+        # as colunas das partições ficam só nos nomes dos diretórios
+        df.drop(columns=list(PARTITION_COLUMNS), errors="ignore").to_parquet(
+            tmp_file, index=False
+        )
+        os.replace(tmp_file, path)
+
+    def upsert(
+        self,
+        table: str,
+        location: str,
+        method: str,
+        threshold: float,
+        rows: pd.DataFrame,
+        key: str = "water_masks",
+        config: str = None,
+    ) -> tuple:
+        """Insert or replace the rows of each scene (key) in a partition
+
+        With config, the rows are stored with it and the stored rows computed
+        with another config are dropped.
+
+        Returns:
+            tuple: (partition sorted by date, boolean array of the rows
+                    inserted or replaced)
+        """
+        stored = self.read(table, location, method, threshold, config)
+        if config is not None:
+            rows = rows.assign(config=config)
+        partition, changed = merge_rows(stored, rows, key)
+        self.write(table, location, method, threshold, partition)
+        return partition, changed
+
+    def scenes(
+        self,
+        table: str,
+        location: str,
+        method: str,
+        thresholds: list,
+        config: str = None,
+    ) -> dict:
+        """Modification time of the masks stored in the partitions of every
+        threshold, computed with config (masks missing in any of them are not
+        returned)"""
+        common = None
+        for threshold in thresholds:
+            stored = self.read(table, location, method, threshold, config)
+            if stored is None:
+                return {}
+            mtimes = dict(zip(stored["water_masks"], stored["mask_mtime"]))
+            common = mtimes if common is None else {
+                path: mtime
+                for path, mtime in common.items()
+                if mtimes.get(path) == mtime
+            }
+        return common or {}
@@ -0,0 +1,208 @@
+import logging
+
+import geopandas as gpd
+import numpy as np
+import rasterio
+from pyproj import CRS, Proj, Transformer
+from rasterio.mask import raster_geometry_mask
+from rasterio.transform import array_bounds
+from rasterio.warp import Resampling, calculate_default_transform, reproject
+
+from utils.area_and_volume_estimation.histogram import (
+    AreaHistogram,
+    weighted_areas_above,
+)
+from utils.raster_io.quantization import read_values
+
+logger = logging.getLogger(__name__)
+
+# CRS métrico em que as áreas são medidas: SIRGAS 2000 / UTM zone 24S (Paraíba)
+AREA_CRS = "EPSG:31984"
+
+# Métodos de área: "reprojected" (padrão) conta os pixels reprojetados para
+# AREA_CRS, como antes; "geodesic" soma a área de cada pixel no elipsoide
+AREA_METHODS = ("reprojected", "geodesic")
+
+# Planos já construídos no processo, por (ROI, grade, método)
+_roi_plans = {}
+
+
+def authalic_q(latitude: np.ndarray, eccentricity: float) -> np.ndarray:
+    """q(φ) of the authalic latitude; the ellipsoid area between two parallels
+    is a² / 2 * (q(φ2) - q(φ1)) per radian of longitude"""
+    sin_lat = np.sin(np.radians(latitude))
+    if eccentricity == 0:
+        return 2 * sin_lat
+    e_sin = eccentricity * sin_lat
+    return (1 - eccentricity**2) * (
+        sin_lat / (1 - e_sin**2)
+        - np.log((1 - e_sin) / (1 + e_sin)) / (2 * eccentricity)
+    )
+
+
+def cell_areas(crs, transform, height: int, width: int) -> np.ndarray:
+    """Area (m²) of each pixel of a grid on the ellipsoid of its CRS
+
+    Geographic grids use the exact area of the latitude band of each row;
+    projected grids divide the pixel area by the areal scale factor of the
+    projection at the pixel center.
+
+    Returns:
+        np.ndarray: (height, width) float64 areas
+    """
+    crs = CRS.from_user_input(crs)
+    ellipsoid = crs.ellipsoid
+
+    if crs.is_geographic:
+        if transform.b or transform.d:
+            raise ValueError("Rotated geographic grids are not supported")
+        a = ellipsoid.semi_major_metre
+        f = 1 / ellipsoid.inverse_flattening if ellipsoid.inverse_flattening else 0
+        eccentricity = np.sqrt(f * (2 - f))
+
+        edges = transform.f + np.arange(height + 1) * transform.e
+        q = authalic_q(edges, eccentricity)
+        row_areas = np.abs(np.diff(q)) * a**2 / 2 * abs(np.radians(transform.a))
+        return np.repeat(row_areas[:, np.newaxis], width, axis=1)
+
+    rows, cols = np.mgrid[:height, :width] + 0.5
+    x, y = transform * (cols, rows)
+    to_geodetic = Transformer.from_crs(crs, crs.geodetic_crs, always_xy=True)
+    longitude, latitude = to_geodetic.transform(x, y)
+    factors = Proj(crs).get_factors(longitude, latitude)
+
+    pixel_area = abs(transform.a * transform.e - transform.b * transform.d)
+    return pixel_area / np.asarray(factors.areal_scale)
+
+
+def grid_key(src) -> tuple:
+    """CRS, transform and shape of a raster, equal for every scene of a grid"""
+    crs = src.crs.to_wkt() if src.crs else ""
+    return crs, tuple(src.transform)[:6], src.width, src.height
+
+
+class ROIPlan:
+    """Crop, ROI mask and pixel areas of one raster grid, built once
+
+    Precomputed for a grid: the window of the ROI and a weight for each
+    pixel of the window, 0 outside the ROI. The area of a threshold is then
+    one windowed read and a weighted sum, with no GeoJSON, MemoryFile or
+    warp per scene.
+
+    - geodesic: the weight is the area (m²) of the pixel on the ellipsoid,
+      independent of any projection
+    - reprojected: the weight is the number of pixels that take its value
+      in the nearest reprojection to AREA_CRS, times their area; equal to
+      crop_raster_with_geojson_obj + preprocess_raster
+    """
+
+    def __init__(self, window, weights: np.ndarray, pixel_area: float):
+        self.window = window
+        self.weights = weights
+        self.pixel_area = pixel_area
+
+    @classmethod
+    def build(
+        cls,
+        src,
+        path_shapefile: str,
+        method: str = "reprojected",
+        dst_crs: str = AREA_CRS,
+    ) -> "ROIPlan":
+        """Plan of the grid of src for the ROI of path_shapefile"""
+        if method not in AREA_METHODS:
+            raise ValueError(f"Unknown area method {method}, use {AREA_METHODS}")
+
+        gdf = gpd.read_file(path_shapefile)
+        if gdf.crs != src.crs:
+            gdf = gdf.to_crs(src.crs)
+
+        # mesma janela e máscara de rasterio.mask.mask(crop=True)
+        outside, transform, window = raster_geometry_mask(
+            src, list(gdf.geometry), crop=True
+        )
+        height, width = outside.shape
+
+        if method == "geodesic":
+            weights = cell_areas(src.crs, transform, height, width)
+            weights[outside] = 0
+            return cls(window, weights, 1.0)
+
+        dst_transform, dst_width, dst_height = calculate_default_transform(
+            src.crs,
+            dst_crs,
+            width,
+            height,
+            *array_bounds(height, width, transform),
+        )
+
+        # reprojeta o índice de cada pixel: o pixel de origem de cada pixel
+        # de destino, escolhido pelo próprio GDAL (vizinho mais próximo)
+        source_index = np.arange(height * width, dtype=np.int32).reshape(height, width)
+        destination = np.full((dst_height, dst_width), -1, dtype=np.int32)
+        reproject(
+            source=source_index,
+            destination=destination,
+            src_transform=transform,
+            src_crs=src.crs,
+            dst_transform=dst_transform,
+            dst_crs=dst_crs,
+            dst_nodata=-1,
+            resampling=Resampling.nearest,
+        )
+
+        mapped = destination[destination >= 0]
+        weights = np.bincount(mapped, minlength=height * width).reshape(height, width)
+        weights[outside] = 0
+
+        pixel_area = abs(dst_transform.a) * abs(dst_transform.e)
+        return cls(window, weights.astype(np.int32), pixel_area)
+
+    def read(self, src) -> np.ndarray:
+        """Values of the ROI window of src, decoded when quantized"""
+        return read_values(src, window=self.window)
+
+    def crop(self, array: np.ndarray) -> np.ndarray:
+        """ROI window of an in-memory array on the grid of the plan"""
+        return array[self.window.toslices()]
+
+    def areas(self, image: np.ndarray, thresholds: list) -> dict:
+        """Area (m², km²) above each threshold, as calculate_areas_from_array,
+        in a single pass over the image"""
+        return weighted_areas_above(image, self.weights, self.pixel_area, thresholds)
+
+    def histogram(self, image: np.ndarray) -> AreaHistogram:
+        """Areas above every value of the window, for any threshold"""
+        return AreaHistogram.from_image(image, self.weights, self.pixel_area)
+
+
+def set_roi_plans(plans: dict) -> None:
+    """Pool initializer: plans built by the parent, keyed by (ROI, grid, method)"""
+    _roi_plans.update(plans)
+
+
+def get_roi_plan(src, path_shapefile: str, method: str = "reprojected") -> ROIPlan:
+    """Plan of the grid of src, built on the first scene of each grid"""
+    key = (path_shapefile, grid_key(src), method)
+    if key not in _roi_plans:
+        _roi_plans[key] = ROIPlan.build(src, path_shapefile, method)
+    return _roi_plans[key]
+
+
+def build_roi_plans(
+    mask_paths: list, path_shapefile: str, method: str = "reprojected"
+) -> dict:
+    """Plans of every grid of the masks of a location
+
+    Only the headers of the masks are read; the scenes of a location usually
+    share one grid, so a single plan is built.
+    """
+    plans = {}
+    for mask_path in mask_paths:
+        with rasterio.open(mask_path) as src:
+            key = (path_shapefile, grid_key(src), method)
+            if key not in plans:
+                plans[key] = get_roi_plan(src, path_shapefile, method)
+
+    logger.info(f"{len(plans)} ROI plans built for {len(mask_paths)} masks")
+    return plans
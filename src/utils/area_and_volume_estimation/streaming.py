@@ -0,0 +1,37 @@
+import logging
+
+import numpy as np
+import rasterio
+
+from .roi_plan import get_roi_plan
+from .water import area_records
+
+logger = logging.getLogger(__name__)
+
+
+class StreamingAreaEstimator:
+    """Water areas computed from the probability maps while they are in memory
+
+    The segmentation nodes hand every water map to add() before saving (or
+    instead of saving) it, so estimate_water_area does not read the GeoTIFFs
+    again. The maps are on the grid of their source image, whose header gives
+    the ROIPlan; the areas are the ones of the saved float32 map (and of the
+    quantized maps, for the configured thresholds).
+    """
+
+    def __init__(
+        self, path_shapefile: str, thresholds: list, area_method: str = "reprojected"
+    ):
+        self.path_shapefile = path_shapefile
+        self.thresholds = thresholds
+        self.area_method = area_method
+        self.records = []
+
+    def add(self, image_path: str, mask_path: str, probabilities: np.ndarray) -> None:
+        """Areas of the water map of image_path, saved (or not) as mask_path"""
+        with rasterio.open(image_path) as src:
+            plan = get_roi_plan(src, self.path_shapefile, self.area_method)
+
+        image = plan.crop(np.asarray(np.squeeze(probabilities), dtype=np.float32))
+        areas = plan.areas(image, self.thresholds)
+        self.records.extend(area_records(str(mask_path), areas))
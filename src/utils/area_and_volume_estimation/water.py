@@ -5,27 +5,50 @@ import rasterio
 import gc
 from rasterio.warp import Resampling, calculate_default_transform, reproject
 from scipy.signal import savgol_filter
-from scipy.stats import zscore
+
+from utils.raster_io.quantization import read_values
 
 from .general import crop_raster_with_geojson_obj
+from .histogram import AreaHistogram, histogram_file, is_histogram_stale
+from .result_store import merge_rows
+from .roi_plan import get_roi_plan
+
+def mask_date(mask_path):
+    """Date (YYYYMMDD) in the name of a water mask"""
+    filename = os.path.basename(mask_path).replace("_clean", "")
+    return filename.split("_")[-1][:8]
+
 
 def process_single_mask(args):
-    mask_path, path_shapefile, thresholds = args
+    # a data (YYYYMMDD), vinda do catálogo de cenas, a porcentagem de
+    # nuvens na ROI, vinda dos metadados do download, o método de área
+    # (reprojected ou geodesic) e a pasta dos histogramas são opcionais
+    mask_path, path_shapefile, thresholds, *optional = args
+    date_str, cloud_percentage, area_method, histogram_dir = (
+        list(optional) + [None] * 4
+    )[:4]
+    area_method = area_method or "reprojected"
+
+    if histogram_dir:
+        areas = histogram_areas(
+            mask_path, path_shapefile, thresholds, area_method, histogram_dir
+        )
+    else:
+        # recorte e área dos pixels pré-calculados para a grade da máscara
+        with rasterio.open(mask_path) as src:
+            plan = get_roi_plan(src, path_shapefile, area_method)
+            image = plan.read(src)
 
-    filename = os.path.basename(mask_path).replace("_clean", "")
-    date_str = filename.split("_")[-1][:8]
-    year, month, day = date_str[:4], date_str[4:6], date_str[6:8]
+        areas = plan.areas(image, thresholds)
 
-    image, pixel_area = preprocess_raster(
-        tif_path=mask_path,
-        path_shapefile=path_shapefile
-    )
+    return area_records(mask_path, areas, date_str, cloud_percentage)
 
-    areas = calculate_areas_from_array(
-        image=image,
-        pixel_area=pixel_area,
-        thresholds=thresholds
-    )
+
+def area_records(mask_path, areas, date_str=None, cloud_percentage=None):
+    """Rows (one per threshold) of the areas of a water mask"""
+    if date_str is None:
+        date_str = mask_date(mask_path)
+    year, month, day = date_str[:4], date_str[4:6], date_str[6:8]
 
     # Resultado compacto (retorno único)
     results = []
@@ -38,13 +61,34 @@ def process_single_mask(args):
             "day": day,
             "m2_area": area_m2,
             "km2_area": area_km2,
-            "CLOUDY_PIXEL_PERCENTAGE": 0,
+            "CLOUDY_PIXEL_PERCENTAGE": cloud_percentage or 0,
         })
 
     return results
 
 
 
+def histogram_areas(mask_path, path_shapefile, thresholds, area_method, histogram_dir):
+    """Areas from the saved histogram of the mask, computed and saved when it
+    is missing, older than the mask or the ROI, or of another ROI / method.
+    New thresholds are then evaluated without reading the mask again.
+    """
+    path = histogram_file(histogram_dir, mask_path)
+    metadata = {"roi": path_shapefile, "area_method": area_method}
+
+    histogram = None
+    if not is_histogram_stale(path, mask_path, path_shapefile):
+        histogram = AreaHistogram.load(path, **metadata)
+
+    if histogram is None:
+        with rasterio.open(mask_path) as src:
+            plan = get_roi_plan(src, path_shapefile, area_method)
+            histogram = plan.histogram(plan.read(src))
+        histogram.save(path, **metadata)
+
+    return histogram.areas(thresholds)
+
+
 def preprocess_raster(tif_path, path_shapefile):
     with rasterio.open(tif_path) as src_file:
 
@@ -81,7 +125,8 @@ def preprocess_raster(tif_path, path_shapefile):
                     resampling=Resampling.nearest,
                 )
 
-                image = dst.read(1)
+                # mapas quantizados (uint8/uint16) voltam a ser probabilidades
+                image = read_values(src_file, dst.read(1))
 
         memfile_src.close()
 
@@ -150,7 +195,7 @@ def calculate_water_area(tif_path, path_shapefile, threshold=0, save_path=None):
                         resampling=Resampling.nearest,
                     )
 
-                image = dst.read(1)
+                image = read_values(src_file, dst.read(1))
                 pixel_width = abs(dst.transform.a)
                 pixel_height = abs(dst.transform.e)
                 pixel_area = pixel_width * pixel_height
@@ -164,6 +209,63 @@ def calculate_water_area(tif_path, path_shapefile, threshold=0, save_path=None):
         return water_area_m2, water_area_km2
 
 
+def areas_long_format(water_areas_dfs: dict) -> pd.DataFrame:
+    """One (threshold, date, area) table from the DataFrames of
+    estimate_water_area, keyed df_areas_trh_{threshold}"""
+    return pd.concat(
+        [
+            df.assign(threshold=float(key.replace("df_areas_trh_", "")))
+            for key, df in water_areas_dfs.items()
+        ],
+        ignore_index=True,
+    )
+
+
+def volumes_by_threshold(df_volumes: pd.DataFrame) -> dict:
+    """DataFrame of each threshold, keyed df_volumes_trh_{threshold}"""
+    return {
+        f"df_volumes_trh_{threshold}": df.drop(columns="threshold").reset_index(
+            drop=True
+        )
+        for threshold, df in df_volumes.groupby("threshold", sort=False)
+    }
+
+
+def savgol_or_raw(values: pd.Series, window_size: int, savgol_poly: int):
+    """Savitzky-Golay of a series, the series itself when it is too short"""
+    if len(values) < window_size:
+        return values  # fallback
+    return savgol_filter(
+        values, window_length=window_size, polyorder=savgol_poly, mode="interp"
+    )
+
+
+def volume_column(area_column: str) -> str:
+    """Name of the volume column of an area column (m2_area -> volume_m2)"""
+    return f"volume_{area_column.replace('_area', '')}"
+
+
+def interpolate_volumes(
+    areas: pd.Series,
+    df_cav: pd.DataFrame,
+    cav_area_column="area",
+    cav_volume_column="volume",
+    escale: float = 1.0,
+) -> np.ndarray:
+    """Volumes of the areas on the CAV curve, clipped to its area range"""
+    df_cav = df_cav.sort_values(cav_area_column).drop_duplicates(
+        subset=[cav_area_column]
+    )
+    min_area = df_cav[cav_area_column].min()
+    max_area = df_cav[cav_area_column].max()
+
+    areas = areas.clip(lower=min_area, upper=max_area)
+    return (
+        np.interp(areas, df_cav[cav_area_column], df_cav[cav_volume_column])
+        / escale
+    )
+
+
 def calculate_volumes_to_multiple_methods(
     df_areas: pd.DataFrame,
     df_cav: pd.DataFrame,
@@ -176,60 +278,178 @@ def calculate_volumes_to_multiple_methods(
     escale: float = 1.0,
     window_size: int = 6,  # usado para média, mediana e savgol
     savgol_poly: int = 2,  # grau do polinômio para Savitzky-Golay
+    group_column: str = None,
 ):
-    """Calcula volumes e aplica filtros (média, mediana, Savgol, Z-score)."""
+    """Calcula volumes e aplica filtros (média, mediana, Savgol, Z-score).
 
-    df_cav = df_cav.sort_values(cav_area_column).drop_duplicates(
-        subset=[cav_area_column]
-    )
-    min_area = df_cav[cav_area_column].min()
-    max_area = df_cav[cav_area_column].max()
+    With group_column (threshold, in the long format table) every row is
+    interpolated at once and the filters run per group (groupby-transform),
+    as if each group was processed on its own.
+    """
 
     df_volumes = pd.DataFrame()
+    if group_column:
+        df_volumes[group_column] = df_areas[group_column]
     df_volumes["year"] = df_areas[year_column]
     df_volumes["month"] = df_areas[month_column]
     df_volumes["CLOUDY_PIXEL_PERCENTAGE"] = df_areas[cloud_percentage_column]
 
-    for column in areas_columns:
-        areas = df_areas[column].clip(lower=min_area, upper=max_area)
+    # sem coluna de grupo, a tabela inteira é um grupo
+    groups = (
+        df_areas[group_column].to_numpy()
+        if group_column
+        else np.zeros(len(df_areas), dtype=int)
+    )
 
-        volumes = (
-            np.interp(areas, df_cav[cav_area_column], df_cav[cav_volume_column])
-            / escale
+    for column in areas_columns:
+        volume_col = volume_column(column)
+        df_volumes[volume_col] = interpolate_volumes(
+            df_areas[column], df_cav, cav_area_column, cav_volume_column, escale
         )
-        volume_col = f"volume_{column.replace('_area', '')}"
-        df_volumes[volume_col] = volumes
 
-        # Média móvel
-        df_volumes[f"{volume_col}_mean"] = (
-            df_volumes[volume_col]
-            .rolling(window=window_size, min_periods=1, center=True)
-            .mean()
+        filters = volume_filters(
+            df_volumes[volume_col], groups, window_size, savgol_poly
         )
+        for name, values in filters.items():
+            df_volumes[f"{volume_col}_{name}"] = values
+
+    return df_volumes
 
-        # Mediana móvel
-        df_volumes[f"{volume_col}_median"] = (
-            df_volumes[volume_col]
-            .rolling(window=window_size, min_periods=1, center=True)
-            .median()
-        )
 
+def volume_filters(
+    volumes: pd.Series, groups, window_size: int = 6, savgol_poly: int = 2
+) -> dict:
+    """Média e mediana móveis, Savitzky-Golay e Z-score dos volumes de cada grupo"""
+    grouped = volumes.groupby(groups, sort=False)
+    rolling = grouped.rolling(window=window_size, min_periods=1, center=True)
+
+    return {
+        # Média móvel
+        "mean": rolling.mean().droplevel(0),
+        # Mediana móvel
+        "median": rolling.median().droplevel(0),
         # Savitzky-Golay
-        if len(df_volumes) >= window_size:
-            df_volumes[f"{volume_col}_savgol"] = savgol_filter(
-                df_volumes[volume_col],
-                window_length=window_size,
-                polyorder=savgol_poly,
-                mode="interp",
-            )
-        else:
-            df_volumes[f"{volume_col}_savgol"] = df_volumes[volume_col]  # fallback
-
-        # Z-score (com outliers substituídos por NaN)
-        z_scores = zscore(df_volumes[volume_col], nan_policy="omit")
-        mask = np.abs(z_scores) > 3
-        filtered = df_volumes[volume_col].copy()
-        filtered[mask] = np.nan
-        df_volumes[f"{volume_col}_zscore"] = filtered
+        "savgol": grouped.transform(
+            savgol_or_raw, window_size=window_size, savgol_poly=savgol_poly
+        ),
+        "zscore": zscore_filter(volumes, groups),
+    }
+
+
+def zscore_filter(volumes: pd.Series, groups) -> pd.Series:
+    """Z-score (com outliers substituídos por NaN) dos volumes de cada grupo"""
+    grouped = volumes.groupby(groups, sort=False)
+    z_scores = (volumes - grouped.transform("mean")) / grouped.transform(
+        "std", ddof=0
+    )
+    filtered = volumes.copy()
+    filtered[np.abs(z_scores) > 3] = np.nan
+    return filtered
+
+
+def update_volume_filters(
+    df_volumes: pd.DataFrame,
+    volume_col: str,
+    changed: np.ndarray,
+    window_size: int = 6,
+    savgol_poly: int = 2,
+) -> pd.DataFrame:
+    """Recompute the filters of a date-sorted series only around the new rows
+
+    The rolling and Savitzky-Golay values of a row depend on the rows less
+    than window_size away (the last window_size rows on the series edges),
+    so they are recomputed on the changed rows with 2 * window_size rows of
+    context and kept for the rows up to window_size away. The Z-score uses
+    the mean and deviation of the whole series and is always recomputed.
+    """
+    columns = [f"{volume_col}_{name}" for name in ("mean", "median", "savgol")]
+    positions = np.flatnonzero(changed)
+    if len(positions) == 0 and all(c in df_volumes for c in columns):
+        return df_volumes
+
+    n_rows = len(df_volumes)
+    if not all(c in df_volumes for c in columns):
+        # série nova: filtros de todas as linhas
+        start, stop, keep_start, keep_stop = 0, n_rows, 0, n_rows
+    else:
+        first, last = positions[0], positions[-1] + 1
+        start = max(first - 2 * window_size, 0)
+        stop = min(last + 2 * window_size, n_rows)
+        keep_start = max(first - window_size, 0)
+        keep_stop = min(last + window_size, n_rows)
+
+    window = df_volumes[volume_col].iloc[start:stop]
+    filters = volume_filters(
+        window, np.zeros(len(window), dtype=int), window_size, savgol_poly
+    )
+
+    df_volumes = df_volumes.copy()
+    for column, name in zip(columns, ("mean", "median", "savgol")):
+        if column not in df_volumes:
+            df_volumes[column] = np.nan
+        values = np.asarray(filters[name], dtype=float)
+        df_volumes.iloc[
+            keep_start:keep_stop, df_volumes.columns.get_loc(column)
+        ] = values[keep_start - start : keep_stop - start]
+
+    df_volumes[f"{volume_col}_zscore"] = zscore_filter(
+        df_volumes[volume_col], np.zeros(n_rows, dtype=int)
+    )
+    return df_volumes
+
+
 
+def update_volumes(
+    stored: pd.DataFrame,
+    df_areas: pd.DataFrame,
+    df_cav: pd.DataFrame,
+    cav_area_column="area",
+    cav_volume_column="volume",
+    year_column="year",
+    month_column="month",
+    cloud_percentage_column="CLOUDY_PIXEL_PERCENTAGE",
+    areas_columns=[],
+    escale: float = 1.0,
+    window_size: int = 6,
+    savgol_poly: int = 2,
+) -> pd.DataFrame:
+    """Volumes of one threshold, updated from the stored ones (ResultStore)
+
+    Only the scenes that are new or whose areas changed are interpolated,
+    and the filters are recomputed around them (update_volume_filters), so a
+    daily update costs O(new scenes) instead of the whole series.
+
+    Args:
+        stored (pd.DataFrame): Stored volumes of the threshold, or None
+        df_areas (pd.DataFrame): Areas of the threshold, with water_masks and date
+
+    Returns:
+        pd.DataFrame: Volumes sorted by date, with the areas they come from
+    """
+    columns = ["water_masks", "date", year_column, month_column]
+    columns += [cloud_percentage_column] + list(areas_columns)
+    rows = df_areas[columns].rename(
+        columns={
+            year_column: "year",
+            month_column: "month",
+            cloud_percentage_column: "CLOUDY_PIXEL_PERCENTAGE",
+        }
+    )
+
+    if stored is not None:
+        # cenas já armazenadas com as mesmas áreas não são recalculadas
+        compare = ["water_masks", "CLOUDY_PIXEL_PERCENTAGE"] + list(areas_columns)
+        same = rows[compare].merge(stored[compare], how="left", indicator=True)
+        rows = rows[(same["_merge"] == "left_only").to_numpy()].copy()
+
+    for column in areas_columns:
+        rows[volume_column(column)] = interpolate_volumes(
+            rows[column], df_cav, cav_area_column, cav_volume_column, escale
+        )
+
+    df_volumes, changed = merge_rows(stored, rows)
+    for column in areas_columns:
+        df_volumes = update_volume_filters(
+            df_volumes, volume_column(column), changed, window_size, savgol_poly
+        )
     return df_volumes
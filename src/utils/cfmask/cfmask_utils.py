@@ -6,7 +6,7 @@ import numpy as np
 import rasterio
 import tifffile as tiff
 
-from utils.fmask.fmask_utils import read_bands
+from utils.raster_io.band_reader import read_band_stack
 
 logger = logging.getLogger(__name__)
 
@@ -31,21 +31,27 @@ def get_mask(val, typ="cloud"):
 
 
 def get_binary_mask_from_path(image_path, qa_index=-1, bgr_index=[0, 1, 2]):
-    all_bands = read_bands(image_path)
+    # Lê só as bandas RGB e a QA_PIXEL; sem os nomes das bandas na imagem,
+    # usa as posições bgr_index e qa_index
+    with rasterio.open(image_path) as src:
+        default_indexes = [i % src.count + 1 for i in [*bgr_index, qa_index]]
+        all_bands = read_band_stack(
+            src, ["blue", "green", "red", "QA_PIXEL"], default_indexes=default_indexes
+        )
 
     rgb_composite = np.transpose(
         np.array(
             [
-                all_bands[bgr_index[0]],  # R
-                all_bands[bgr_index[1]],  # G
-                all_bands[bgr_index[2]],  # B
+                all_bands[0],  # R
+                all_bands[1],  # G
+                all_bands[2],  # B
             ]
         ),
         [1, 2, 0],
     )
 
     # QA_Pixel é a ultima banda, mas é possível alterar usando qa_index
-    qa_pixel = np.array(all_bands[qa_index])
+    qa_pixel = np.array(all_bands[3])
 
     bits = {"cloud": 3, "dilated_cloud": 1, "cirrus": 2, "shadow": 4, "water": 7}
 
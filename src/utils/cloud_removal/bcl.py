@@ -10,6 +10,8 @@ import rasterio as TIFF
 from matplotlib import pyplot as plt
 from PIL import Image as img
 
+from utils.raster_io.cog import tifffile_predictor, write_raster
+
 # Suprime todos os warnings
 # warnings.filterwarnings("ignore", category=UserWarning, module="rasterio")
 logging.getLogger("rasterio").setLevel(logging.ERROR)
@@ -27,9 +29,15 @@ class BCL:
         intern_reservoir,
         cloud_pixels,
         use_dec_tree,
-        color_file_path
+        color_file_path,
+        images_by_date=None,
+        masks_by_date=None,
     ):
         self.intern_reservoir = intern_reservoir
+        # {data: caminho} das imagens e máscaras do ano, vindos do catálogo de
+        # cenas; sem eles os diretórios são listados a cada busca
+        self.images_by_date = images_by_date
+        self.masks_by_date = masks_by_date
         self.width, self.height = img_dim
         self.scl_path = scl_path
         self.path_6B = path_6B
@@ -38,6 +46,7 @@ class BCL:
         self.idx_class_cloud = 0
         self.color_file = open(f"{color_file_path}color_file_{data}.txt", "w")
         self.imgNDWI = None
+        self.ndwiDescriptions = None
         pass
 
     def death(self):
@@ -49,19 +58,31 @@ class BCL:
     # Função que carrega em memórias as imagens que serão corrigidas
     # TODO OTIMIZAR URGENTEMENTE, sem fazer esse for
     def getImageSCLandNDNWI(self, data, year):
-        # procurando a mascara pela data
-        for imageSCL in os.listdir(self.scl_path):
-            if imageSCL.replace("-", "").find(data) != -1:
-                with TIFF.open(self.scl_path + imageSCL) as img:
-                    self.imgSCL = img.read()
-                    self.sclMETA = img.meta
-
-        # procurando a imagem pela data
-        for imageNDWI in os.listdir(self.path_6B):
-            if imageNDWI.replace("-", "").find(data) != -1:
-                with TIFF.open(self.path_6B + imageNDWI) as img:
-                    self.imgNDWI = img.read()
-                    self.ndwiMETA = img.meta
+        if self.images_by_date is not None and self.masks_by_date is not None:
+            # busca direta no catálogo de cenas
+            with TIFF.open(self.masks_by_date[data]) as img:
+                self.imgSCL = img.read()
+                self.sclMETA = img.meta
+
+            with TIFF.open(self.images_by_date[data]) as img:
+                self.imgNDWI = img.read()
+                self.ndwiMETA = img.meta
+                self.ndwiDescriptions = img.descriptions
+        else:
+            # procurando a mascara pela data
+            for imageSCL in os.listdir(self.scl_path):
+                if imageSCL.replace("-", "").find(data) != -1:
+                    with TIFF.open(self.scl_path + imageSCL) as img:
+                        self.imgSCL = img.read()
+                        self.sclMETA = img.meta
+
+            # procurando a imagem pela data
+            for imageNDWI in os.listdir(self.path_6B):
+                if imageNDWI.replace("-", "").find(data) != -1:
+                    with TIFF.open(self.path_6B + imageNDWI) as img:
+                        self.imgNDWI = img.read()
+                        self.ndwiMETA = img.meta
+                        self.ndwiDescriptions = img.descriptions
 
         # se alguma das duas imagens são vazias, lança exceção
         if self.imgNDWI.shape[0] == 0 or self.imgSCL.shape[0] == 0:
@@ -95,6 +116,14 @@ class BCL:
     # Função que carrega em memória todas as imagens do ano
     def getAllImagesYear(self, year, data):
         self.imagesSclOfTheYear = []
+        if self.masks_by_date is not None:
+            self.imagesSclOfTheYear = [
+                os.path.basename(path)
+                for date, path in self.masks_by_date.items()
+                if date != data
+            ]
+            return
+
         for image in os.listdir(self.scl_path):
             if image.replace("-", "").find(data) != -1:
                 continue
@@ -160,11 +189,15 @@ class BCL:
                 .replace("-", "")
             )
 
-            for i6b in os.listdir(self.path_6B):
-                if i6b.replace("-", "").find(date) != -1:
-                    with TIFF.open(self.path_6B + i6b) as tiff:
-                        image_more_close_6b = tiff.read()
-                        break
+            if self.images_by_date is not None:
+                with TIFF.open(self.images_by_date[date]) as tiff:
+                    image_more_close_6b = tiff.read()
+            else:
+                for i6b in os.listdir(self.path_6B):
+                    if i6b.replace("-", "").find(date) != -1:
+                        with TIFF.open(self.path_6B + i6b) as tiff:
+                            image_more_close_6b = tiff.read()
+                            break
 
             # A imagem mais próxima é carregada
             with TIFF.open(path_image_more_close_scl) as tiff:
@@ -285,7 +318,10 @@ class BCL:
 
         # Salvando novo arquivo com resultado e rasterio
         # cv2.imwrite(scl_output_path + "/" + data + "_mask.png", self.resultadoIMGSCL[0])
-        with TIFF.open(
-            f"{output_path}{image_name}_clean.tif", "w", **self.ndwiMETA
-        ) as dst:
-            dst.write(self.resultadoIMGNDWI)
+        write_raster(
+            f"{output_path}{image_name}_clean.tif",
+            self.resultadoIMGNDWI,
+            self.ndwiMETA,
+            predictor=tifffile_predictor(self.ndwiMETA["dtype"]),
+            descriptions=self.ndwiDescriptions,
+        )
@@ -0,0 +1,240 @@
+import logging
+import os
+import tempfile
+from collections import defaultdict
+from datetime import datetime as dt
+
+import numpy as np
+import rasterio as TIFF
+
+from utils.raster_io.cog import tifffile_predictor, write_raster
+
+logging.getLogger("rasterio").setLevel(logging.ERROR)
+logger = logging.getLogger(__name__)
+
+# O BCL copia só as 12 primeiras bandas; as demais (ex.: B10/cirrus, a última
+# da seleção do GEE) ficam 0 nas imagens limpas. Feito igual aqui para que a
+# entrada da UNet (que lê todas as bandas) não mude com o método
+BCL_BANDS = 12
+
+
+def date_from_file_name(file_name: str) -> str:
+    """Date (YYYYMMDD) at the end of an image or mask file name"""
+    return file_name.split("_")[-1].split(".")[0].replace("-", "")
+
+
+def list_year_scenes(path_images_year: str, path_masks_year: str) -> list:
+    """Pair the images and masks of a year by date, listing the directories
+
+    Args:
+        path_images_year (str): Directory with the images of the year
+        path_masks_year (str): Directory with the cloud masks of the year
+
+    Returns:
+        list: (date, image path, mask path), sorted by date, for the dates
+              that have both an image and a mask
+    """
+    masks = {
+        date_from_file_name(name): path_masks_year + name
+        for name in os.listdir(path_masks_year)
+        if name.endswith(".tif")
+    }
+    images = {
+        date_from_file_name(name): path_images_year + name
+        for name in os.listdir(path_images_year)
+        if name.endswith(".tif")
+    }
+    return pair_scenes(images, masks)
+
+
+def pair_scenes(images_by_date: dict, masks_by_date: dict) -> list:
+    """(date, image path, mask path) of the dates with an image and a mask"""
+    return sorted(
+        (date, image_path, masks_by_date[date])
+        for date, image_path in images_by_date.items()
+        if date in masks_by_date
+    )
+
+
+def nearest_clear_index(
+    clear: np.ndarray, dates: list, max_block_mb: float = 256
+) -> tuple:
+    """Index of the scene used by every pixel of every target date
+
+    For each target date the scenes are ranked by their distance in days to
+    it (the target itself first, ties to the earlier date), and each pixel
+    takes the first scene of that ranking where it is clear, as BCL does.
+    All targets are solved at once, in strips of rows that fit max_block_mb.
+
+    Args:
+        clear (np.ndarray): (T, H, W) True where the pixel of a scene is clear
+        dates (list): T dates (YYYYMMDD) of the scenes
+        max_block_mb (float): Memory of the (T, T, rows, W) ranking block
+
+    Returns:
+        tuple: (T, H, W) int16 scene index (-1 where no scene is clear) and,
+               for each target, the rank of the farthest scene it used
+    """
+    n_scenes, height, width = clear.shape
+    days = np.array([dt.strptime(date, "%Y%m%d").toordinal() for date in dates])
+
+    distance = np.abs(days[:, None] - days[None, :])
+    np.fill_diagonal(distance, -1)
+    order = np.argsort(distance, axis=1, kind="stable")
+    rank = np.empty_like(order)
+    np.put_along_axis(rank, order, np.arange(n_scenes)[None, :], axis=1)
+    rank = rank.astype(np.int16)
+
+    # rank n_scenes means that no scene is clear, it maps to index -1
+    order = np.concatenate(
+        [order, np.full((n_scenes, 1), -1)], axis=1
+    ).astype(np.int16)
+
+    index = np.empty((n_scenes, height, width), dtype=np.int16)
+    farthest_rank = np.zeros(n_scenes, dtype=np.int64)
+
+    bytes_per_row = n_scenes * n_scenes * width * rank.itemsize
+    rows = max(1, int(max_block_mb * 1024 * 1024 // bytes_per_row))
+    targets = np.arange(n_scenes)[:, None, None]
+
+    for row in range(0, height, rows):
+        strip = clear[:, row : row + rows]
+        ranked = np.where(strip[None], rank[:, :, None, None], n_scenes)
+        best = ranked.min(axis=1)
+        del ranked
+
+        index[:, row : row + rows] = order[targets, best]
+        farthest_rank = np.maximum(
+            farthest_rank, best.reshape(n_scenes, -1).max(axis=1)
+        )
+
+    # when a pixel can not be corrected every scene is visited
+    farthest_rank = np.minimum(farthest_rank, n_scenes - 1)
+    return index, farthest_rank
+
+
+def write_color_file(
+    color_file: str, target: int, days: np.ndarray, farthest_rank: int, mask_names: list
+) -> None:
+    """Write the same color log as BCL: one color per visited scene
+
+    Args:
+        color_file (str): Path of the log
+        target (int): Index of the target scene
+        days (np.ndarray): Ordinal day of every scene
+        farthest_rank (int): Number of scenes visited after the target
+        mask_names (list): Mask file name of every scene
+    """
+    distance_order = np.argsort(np.abs(days - days[target]), kind="stable")
+
+    dict_color_image = {}
+    color = 5
+    for i in distance_order[1 : farthest_rank + 1]:
+        if color < 255:
+            color += 5
+        dict_color_image[str(color)] = mask_names[i]
+
+    with open(color_file, "w") as file:
+        file.write("0 is the actual color of the image\n")
+        for key, value in dict_color_image.items():
+            file.write(f"{key} is the color of {value}\n")
+
+
+def composite_year(
+    scenes: list,
+    output_path: str,
+    color_file_path: str,
+    cloud_pixels: list,
+    max_block_mb: float = 256,
+):
+    """Remove the clouds of every image of a year by temporal compositing
+
+    The masks and bands of the year are read once: the bands into a
+    memory-mapped (T, B, H, W) stack. The nearest clear date of every pixel
+    is computed for all the target dates at once and the replacement pixels
+    are gathered with fancy indexing. The outputs are the same
+    {image}_clean.tif files and color logs written by BCL: as in BCL, only
+    the first BCL_BANDS bands are corrected and the others are written as 0.
+
+    Args:
+        scenes (list): (date, image path, mask path) of the year, as returned
+                       by list_year_scenes or pair_scenes
+        output_path (str): Directory of the clean images
+        color_file_path (str): Directory of the color logs
+        cloud_pixels (list): Mask values of cloud and cloud shadow pixels
+        max_block_mb (float): Memory of the ranking blocks
+
+    Yields:
+        str: path of every clean image, as soon as it is written
+    """
+    # Only scenes with the same shape can replace each other's pixels
+    groups = defaultdict(list)
+    for date, image_path, mask_path in scenes:
+        with TIFF.open(image_path) as src:
+            groups[(src.count, src.height, src.width)].append(
+                (date, image_path, mask_path, src.dtypes[0])
+            )
+
+    for (count, height, width), group in groups.items():
+        dates = [date for date, _, _, _ in group]
+        n_scenes = len(group)
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            stack = np.lib.format.open_memmap(
+                os.path.join(tmp_dir, "stack.npy"),
+                mode="w+",
+                dtype=np.result_type(*[dtype for _, _, _, dtype in group]),
+                shape=(n_scenes, count, height, width),
+            )
+            clear = np.empty((n_scenes, height, width), dtype=bool)
+            metas = []
+            descriptions = []
+
+            for t, (_, image_path, mask_path, _) in enumerate(group):
+                with TIFF.open(image_path) as src:
+                    stack[t] = src.read()
+                    metas.append(src.meta)
+                    descriptions.append(src.descriptions)
+                with TIFF.open(mask_path) as src:
+                    clear[t] = np.logical_not(np.isin(src.read(1), cloud_pixels))
+
+            index, farthest_rank = nearest_clear_index(clear, dates, max_block_mb)
+            del clear
+
+            ordinal_days = np.array(
+                [dt.strptime(date, "%Y%m%d").toordinal() for date in dates]
+            )
+            mask_names = [os.path.basename(mask_path) for _, _, mask_path, _ in group]
+
+            for t, (date, image_path, _, _) in enumerate(group):
+                source = index[t]
+                uncorrected = source < 0
+                source = np.where(uncorrected, 0, source)[None]
+
+                result = np.zeros((count, height, width), dtype=stack.dtype)
+                for band in range(min(count, BCL_BANDS)):
+                    result[band] = np.take_along_axis(stack[:, band], source, axis=0)[0]
+                result[:, uncorrected] = 0
+
+                image_name = os.path.basename(image_path).replace(".tif", "")
+                output_file = f"{output_path}{image_name}_clean.tif"
+                # as imagens limpas também são lidas com tifffile
+                write_raster(
+                    output_file,
+                    result,
+                    metas[t],
+                    predictor=tifffile_predictor(result.dtype),
+                    descriptions=descriptions[t],
+                )
+
+                write_color_file(
+                    f"{color_file_path}color_file_{date}.txt",
+                    target=t,
+                    days=ordinal_days,
+                    farthest_rank=int(farthest_rank[t]),
+                    mask_names=mask_names,
+                )
+
+                yield output_file
+
+            del stack
@@ -6,6 +6,9 @@ import matplotlib.pyplot as plt
 import numpy as np
 import rasterio
 
+from utils.raster_io.cog import write_raster
+from utils.raster_io.quantization import read_values
+
 logger = logging.getLogger(__name__)
 
 class Canny:
@@ -20,11 +23,18 @@ class Canny:
         self.upper_factor = upper_factor
 
     def detect_border(self, tif_path, output_path):
-        img = cv2.imread(tif_path, cv2.IMREAD_UNCHANGED)
+        img = None
+        if os.path.exists(tif_path):
+            # valores decodificados quando o raster é quantizado (uint8/uint16)
+            with rasterio.open(tif_path) as src:
+                img = read_values(src)
 
         if img is not None:
-            # Converta para 32 bits
+            # Converta para 32 bits, nodata recebe o menor valor da imagem
             img_32bit = img.astype(np.float32)
+            nodata = np.isnan(img_32bit)
+            if nodata.any():
+                img_32bit[nodata] = np.nanmin(img_32bit) if not nodata.all() else 0
 
             # Converta para 8 bits usando cv2.normalize
             img_8bit = cv2.normalize(img_32bit, None, 0, 255, cv2.NORM_MINMAX).astype(
@@ -42,12 +52,10 @@ class Canny:
 
             # Salvar o resultado do Canny em um novo arquivo .tiff
             with rasterio.open(tif_path) as src:
-                profile = src.profile  # Copie o perfil do NDWI
-                profile.update(
-                    dtype=rasterio.uint8, count=1
-                )  # Atualize o tipo de dados e o número de bandas
-                with rasterio.open(output_path, "w", **profile) as dst:
-                    dst.write(auto_canny, 1)  # Escreva o resultado do Canny na banda 1
+                # Perfil do NDWI, com o tipo de dados e o número de bandas do Canny
+                write_raster(
+                    output_path, auto_canny, src.profile, dtype=rasterio.uint8, count=1
+                )
 
             logger.info(f"Resultado do Canny salvo como {output_path}")
         else:
@@ -0,0 +1,242 @@
+import logging
+import os
+
+import numpy as np
+import pandas as pd
+import rasterio
+import xarray as xr
+
+from utils.raster_io.quantization import decode
+from utils.scene_catalog.scene_catalog import parse_scene_name
+
+logger = logging.getLogger(__name__)
+
+
+def date_to_time(date: str) -> np.datetime64:
+    """datetime64 of a YYYYMMDD date"""
+    return np.datetime64(f"{date[:4]}-{date[4:6]}-{date[6:8]}", "ns")
+
+
+def band_names(src) -> list:
+    """Band descriptions of a raster (GEE writes the band names), or b1..bN"""
+    return [
+        description or f"b{i}" for i, description in enumerate(src.descriptions, 1)
+    ]
+
+
+class DataCube:
+    """Zarr datacube (time, band, y, x) of one product of a location
+
+    Every product (TOA, BOA, mask, clean, water_mask, as in the scene
+    catalogue) of a location is stored in {root}{location}/{product}.zarr,
+    chunked in space (chunk_size) and time (time_chunk). Scenes are appended
+    one date at a time, so the cube grows with each pipeline run, and a time
+    slice or the time series of a pixel is read from the chunks that hold it
+    instead of opening every GeoTIFF.
+
+    All the scenes of a cube share the grid (shape, transform and bands) of
+    the first one; scenes on another grid are not appended. The satellite,
+    source file and source modification time of every date are kept along
+    the time axis: a date whose GeoTIFF was written again (masks recomputed,
+    images composited again) is overwritten in place, and a scene of another
+    satellite on a date already in the cube is skipped with a warning.
+    """
+
+    def __init__(
+        self,
+        root: str,
+        location: str,
+        product: str,
+        chunk_size: int = 512,
+        time_chunk: int = 1,
+    ):
+        self.path = os.path.join(f"{root}{location}", f"{product}.zarr")
+        self.location = location
+        self.product = product
+        self.chunk_size = chunk_size
+        self.time_chunk = time_chunk
+        self._scenes = None
+
+    def exists(self) -> bool:
+        return os.path.exists(self.path)
+
+    def open(self) -> xr.DataArray:
+        """Lazy (time, band, y, x) array of the cube, sorted by time"""
+        dataset = xr.open_zarr(self.path, chunks=None, mask_and_scale=False)
+        return dataset[self.product].sortby("time")
+
+    def dates(self) -> set:
+        """Dates (YYYYMMDD) already in the cube"""
+        return set(self.scenes())
+
+    def scenes(self) -> dict:
+        """{date: (position on the time axis, satellite, source mtime)} of the
+        scenes in the cube"""
+        if self._scenes is None:
+            self._scenes = {}
+            if self.exists():
+                dataset = xr.open_zarr(self.path, chunks=None)
+                dates = pd.to_datetime(dataset["time"].values).strftime("%Y%m%d")
+                for position, (date, satellite, mtime) in enumerate(
+                    zip(
+                        dates,
+                        dataset["satellite"].values,
+                        dataset["source_mtime"].values,
+                    )
+                ):
+                    self._scenes[date] = (position, str(satellite), float(mtime))
+        return self._scenes
+
+    def _scene_array(
+        self, src, date: str, satellite: str, mtime: float
+    ) -> xr.DataArray:
+        transform = src.transform
+        cols = np.arange(src.width) + 0.5
+        rows = np.arange(src.height) + 0.5
+
+        attrs = {
+            "crs": src.crs.to_wkt() if src.crs else "",
+            "transform": list(transform)[:6],
+        }
+        if src.nodata is not None:
+            attrs["nodata"] = src.nodata
+        # mapas quantizados guardam os códigos, decodificados na leitura
+        if src.scales[0] != 1 or src.offsets[0] != 0:
+            attrs["scale"] = src.scales[0]
+            attrs["offset"] = src.offsets[0]
+
+        return xr.DataArray(
+            src.read()[np.newaxis],
+            dims=("time", "band", "y", "x"),
+            coords={
+                "time": [date_to_time(date)],
+                # strings de tamanho variável, nomes mais longos ainda entram
+                "satellite": ("time", np.array([str(satellite)], dtype=object)),
+                "source": ("time", np.array([src.name], dtype=object)),
+                "source_mtime": ("time", [mtime]),
+                "band": band_names(src),
+                "y": transform.f + rows * transform.e,
+                "x": transform.c + cols * transform.a,
+            },
+            name=self.product,
+            attrs=attrs,
+        )
+
+    def _same_grid(self, scene: xr.DataArray) -> bool:
+        cube = self.open()
+        return (
+            cube.shape[1:] == scene.shape[1:]
+            and list(cube["band"].values) == list(scene["band"].values)
+            and np.allclose(cube.attrs["transform"], scene.attrs["transform"])
+        )
+
+    def append(self, tif_path: str, date: str, satellite: str = None) -> bool:
+        """Append the scene of a date to the cube, or overwrite the date when
+        the GeoTIFF is newer than the scene in the cube
+
+        Returns:
+            bool: False when the date is already in the cube and up to date,
+                  holds a scene of another satellite, or the scene is on
+                  another grid
+        """
+        satellite = satellite or parse_scene_name(tif_path, self.location)[0]
+        mtime = os.path.getmtime(tif_path)
+
+        stored = self.scenes().get(date)
+        if stored is not None:
+            position, stored_satellite, stored_mtime = stored
+            if stored_satellite != str(satellite):
+                logger.warning(
+                    f"{date} of {self.path} holds a {stored_satellite} scene, "
+                    f"{tif_path} skipped"
+                )
+                return False
+            if mtime <= stored_mtime:
+                return False
+        else:
+            position = len(self._scenes)
+
+        with rasterio.open(tif_path) as src:
+            scene = self._scene_array(src, date, satellite, mtime)
+
+        if not self.exists():
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            chunks = (self.time_chunk, 1, self.chunk_size, self.chunk_size)
+            scene.to_dataset().to_zarr(
+                self.path, mode="w-", encoding={self.product: {"chunks": chunks}}
+            )
+        elif not self._same_grid(scene):
+            logger.warning(f"{tif_path} is not on the grid of {self.path}, skipped")
+            return False
+        elif stored is None:
+            scene.to_dataset().to_zarr(self.path, append_dim="time")
+        else:
+            # só a fatia da data é regravada
+            scene.to_dataset().drop_vars(["band", "y", "x"]).to_zarr(
+                self.path, region={"time": slice(position, position + 1)}
+            )
+
+        self._scenes[date] = (position, str(satellite), mtime)
+        return True
+
+    def _decode(self, data: xr.DataArray) -> xr.DataArray:
+        if "scale" not in data.attrs:
+            return data
+        attrs = data.attrs
+        values = decode(data.values, attrs["scale"], attrs["offset"], attrs.get("nodata"))
+        return data.copy(data=values)
+
+    def time_slice(self, start: str, end: str = None, bands: list = None) -> xr.DataArray:
+        """Scenes between two dates (YYYYMMDD, inclusive), or of a single date
+
+        Quantized products are decoded to probabilities (NaN for nodata).
+        """
+        data = self.open()
+        end = end or start
+        data = data.sel(time=slice(date_to_time(start), date_to_time(end)))
+        if bands is not None:
+            data = data.sel(band=bands)
+        return self._decode(data.load())
+
+    def pixel_series(self, x: float, y: float, bands: list = None) -> xr.DataArray:
+        """(time, band) series of the pixel nearest to x, y (CRS of the cube)"""
+        data = self.open().sel(x=x, y=y, method="nearest")
+        if bands is not None:
+            data = data.sel(band=bands)
+        return self._decode(data.load())
+
+
+def append_scene_paths(
+    datacube_path: str, location: str, paths: list, product: str
+) -> int:
+    """Append the scenes written by a node to the product datacube, if enabled
+
+    The date of each scene comes from its file name; dates already in the
+    cube are skipped unless their GeoTIFF is newer, so nodes can pass every
+    scene they know of.
+
+    Args:
+        datacube_path (str): Root of the datacubes, disabled when empty
+        location (str): Location name
+        paths (list): GeoTIFFs of the product
+        product (str): TOA, BOA, mask, clean or water_mask
+
+    Returns:
+        int: number of scenes appended
+    """
+    if not datacube_path:
+        return 0
+
+    cube = DataCube(datacube_path, location, product)
+    scenes = sorted(
+        (parse_scene_name(path, location)[1], str(path))
+        for path in paths
+        if os.path.exists(path)
+    )
+
+    appended = 0
+    for date, path in scenes:
+        appended += cube.append(path, date)
+
+    logger.info(f"{appended} scenes appended to (or updated in) {cube.path}")
+    return appended
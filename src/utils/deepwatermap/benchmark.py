@@ -0,0 +1,77 @@
+""" Benchmarks the per-scene cost of DeepWaterMap inference.
+
+Compares loading the model for every scene (the previous behaviour of
+apply_deep_water_map) with a single DeepWaterMapSession shared by all scenes.
+
+example:
+$ PYTHONPATH=src python -m utils.deepwatermap.benchmark --scenes 20 --shape 512 512
+$ PYTHONPATH=src python -m utils.deepwatermap.benchmark \
+    --image_path data/04_clean_images/sume/2020/*.tif
+"""
+
+import argparse
+import logging
+import time
+
+import numpy as np
+
+from utils.deepwatermap.inference import (
+    DeepWaterMapSession,
+    checkpoint_path,
+    read_image,
+)
+
+logger = logging.getLogger(__name__)
+
+
+def load_scenes(image_paths=None, scenes=10, shape=(512, 512), seed=0):
+    """Return the scenes to segment, read from disk or synthetic."""
+    if image_paths:
+        return [read_image(image_path) for image_path in image_paths]
+
+    rng = np.random.default_rng(seed)
+    return [
+        rng.integers(0, 10000, size=(*shape, 6)).astype(np.uint16)
+        for _ in range(scenes)
+    ]
+
+
+def benchmark_per_scene_load(images, checkpoint_path=checkpoint_path):
+    """Mean seconds per scene when the model is loaded for every scene."""
+    start = time.perf_counter()
+    for image in images:
+        DeepWaterMapSession(checkpoint_path).predict(image)
+    return (time.perf_counter() - start) / len(images)
+
+
+def benchmark_shared_session(images, checkpoint_path=checkpoint_path):
+    """Mean seconds per scene when one session is shared by every scene.
+
+    The model load is included, amortized across the scenes.
+    """
+    start = time.perf_counter()
+    session = DeepWaterMapSession(checkpoint_path)
+    for image in images:
+        session.predict(image)
+    return (time.perf_counter() - start) / len(images)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--checkpoint_path", type=str, default=checkpoint_path)
+    parser.add_argument("--image_path", type=str, nargs="*", default=None)
+    parser.add_argument("--scenes", type=int, default=10)
+    parser.add_argument("--shape", type=int, nargs=2, default=[512, 512])
+    args = parser.parse_args()
+
+    images = load_scenes(args.image_path, args.scenes, tuple(args.shape))
+
+    per_scene = benchmark_per_scene_load(images, args.checkpoint_path)
+    shared = benchmark_shared_session(images, args.checkpoint_path)
+
+    logger.info(f"Scenes: {len(images)}")
+    logger.info(f"Model loaded per scene: {per_scene:.3f} s/scene")
+    logger.info(f"Shared session:         {shared:.3f} s/scene")
+    logger.info(f"Speedup:                {per_scene / shared:.1f}x")
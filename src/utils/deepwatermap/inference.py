@@ -3,6 +3,9 @@
 example:
 $ python inference.py --checkpoint_path checkpoints/cp.135.ckpt \
     --image_path sample_data/sentinel2_example.tif --save_path water_map.png
+
+Several images can be segmented with a single model load:
+$ python inference.py --image_path a.tif b.tif c.tif --save_path water_maps/
 """
 
 # Uncomment this to run inference on CPU if your GPU runs out of memory
@@ -12,15 +15,28 @@ $ python inference.py --checkpoint_path checkpoints/cp.135.ckpt \
 import argparse
 import gc
 import os
+from collections import defaultdict
 
 import numpy as np
 import rasterio
-import tifffile as tiff
 
 from utils.deepwatermap import deepwatermap
+from utils.raster_io.background import WaterMapSink
+from utils.raster_io.band_reader import read_band_stack
+from utils.raster_io.quantization import write_probability_map
 
 checkpoint_path = os.path.abspath("src/utils/deepwatermap/checkpoints/cp.135.ckpt")
 
+# Bands used by DeepWaterMap, read by name (read_band_stack)
+deepwatermap_band_names = ["blue", "green", "red", "nir", "swir1", "swir2"]
+
+# Their positions in the Sentinel-2 stack, used when the image has no band names
+deepwatermap_bands = [1, 2, 3, 7, 10, 11]
+
+# Rough number of float32 values alive per input pixel while the network runs
+# (input bands plus the encoder/decoder activations), used to size batches
+activation_floats_per_pixel = 64
+
 
 def find_padding(v, divisor=32):
     v_divisible = max(divisor, int(divisor * np.ceil(v / divisor)))
@@ -30,27 +46,21 @@ def find_padding(v, divisor=32):
     return pad_1, pad_2
 
 
-def main(image_path, save_path, scale_factor, offset, threshold):
-    # load the model
-    model = deepwatermap.model()
-    model.load_weights(checkpoint_path)
+def preprocess_image(image: np.ndarray) -> tuple:
+    """Pad the image to a multiple of 32 and normalize it to [0, 1].
 
-    # load and preprocess the input image
-    image = tiff.imread(image_path)
-    image = image[:, :, [1, 2, 3, 7, 10, 11]]  # select bands Blue, Green, Red, NIR, SWIR1, SWIR2
+    Args:
+        image (np.ndarray): (rows, cols, 6) image with the DeepWaterMap bands
 
+    Returns:
+        tuple: the model ready image and the (row, col) paddings applied
+    """
     pad_r = find_padding(image.shape[0])
     pad_c = find_padding(image.shape[1])
     image = np.pad(
         image, ((pad_r[0], pad_r[1]), (pad_c[0], pad_c[1]), (0, 0)), "reflect"
     )
 
-    # solve no-pad index issue after inference
-    if pad_r[1] == 0:
-        pad_r = (pad_r[0], 1)
-    if pad_c[1] == 0:
-        pad_c = (pad_c[0], 1)
-
     image = image.astype(np.float32)
 
     # remove nans (and infinity) - replace with 0s
@@ -59,49 +69,223 @@ def main(image_path, save_path, scale_factor, offset, threshold):
     image = image - np.min(image)
     image = image / np.maximum(np.max(image), 1)
 
-    # run inference
-    image = np.expand_dims(image, axis=0)
-    dwm = model.predict(image)
+    return image, pad_r, pad_c
+
+
+def postprocess_prediction(dwm: np.ndarray, pad_r: tuple, pad_c: tuple) -> np.ndarray:
+    """Remove the padding of a raw prediction and apply the soft threshold."""
     dwm = np.squeeze(dwm)
-    dwm = dwm[pad_r[0] : -pad_r[1], pad_c[0] : -pad_c[1]]
+    dwm = dwm[pad_r[0] : dwm.shape[0] - pad_r[1], pad_c[0] : dwm.shape[1] - pad_c[1]]
 
     # soft threshold
     dwm = 1.0 / (1 + np.exp(-(16 * (dwm - 0.5))))
     # dwm = np.clip(dwm, 0, 1) * 255
     dwm = np.clip(dwm, 0, 1)
 
-    dwm_binary = (dwm >= threshold).astype(np.uint8)
+    return dwm
 
-    # save the output water map
-    # cv2.imwrite(save_path, dwm * 255)
+
+def read_image(image_path: str) -> np.ndarray:
+    """Read only the bands used by DeepWaterMap of a GeoTIFF, as (rows, cols, 6)."""
+    image = read_band_stack(
+        image_path,
+        deepwatermap_band_names,
+        default_indexes=[band + 1 for band in deepwatermap_bands],
+    )
+    return np.transpose(image, [1, 2, 0])
+
+
+def save_water_map(
+    dwm: np.ndarray,
+    image_path: str,
+    save_path: str,
+    encoding: str = "float32",
+    thresholds: list = (),
+) -> None:
+    """Save the water map using the profile of the source image.
+
+    encoding is float32, or uint8 / uint16 for a quantized map that keeps the
+    areas of thresholds (see write_probability_map).
+    """
     with rasterio.open(image_path) as src:
-        profile = src.profile
-        profile.update(count=1, dtype=rasterio.float32)
-        with rasterio.open(save_path, "w", **profile) as dst:
-            # dst.write(dwm_binary, 1)
-            dst.write(dwm, 1)
+        write_probability_map(
+            save_path, dwm, src.profile, encoding=encoding, thresholds=thresholds
+        )
+
+
+class DeepWaterMapSession:
+    """DeepWaterMap model loaded once and shared by every scene of a run.
+
+    Building the graph and reading the checkpoint costs far more than the
+    prediction of a clipped scene, so callers that segment many images should
+    create one session and reuse it.
+
+    write_mode chooses how the water maps are saved: sync, async (in a
+    background thread, overlapping the next prediction) or none, when an
+    area_estimator (StreamingAreaEstimator) takes the maps in memory instead.
+    Call close() at the end of the run to wait for the pending writes.
+    """
+
+    def __init__(
+        self,
+        checkpoint_path: str = checkpoint_path,
+        encoding: str = "float32",
+        thresholds: list = (),
+        write_mode: str = "sync",
+        area_estimator=None,
+    ):
+        self.checkpoint_path = checkpoint_path
+        self.model = deepwatermap.model()
+        self.model.load_weights(checkpoint_path)
+
+        # encoding of the saved water maps (save_water_map)
+        self.encoding = encoding
+        self.thresholds = thresholds
+        self.sink = WaterMapSink(self.save, write_mode, area_estimator)
+
+    def save(self, dwm: np.ndarray, image_path: str, save_path: str) -> None:
+        """Save a water map with the encoding of the session."""
+        save_water_map(
+            dwm,
+            image_path,
+            save_path,
+            encoding=self.encoding,
+            thresholds=self.thresholds,
+        )
+
+    def close(self) -> None:
+        """Wait for the water maps still being written."""
+        self.sink.close()
+
+    def predict(self, image: np.ndarray) -> np.ndarray:
+        """Return the water probability map of a (rows, cols, 6) image."""
+        image, pad_r, pad_c = preprocess_image(image)
+
+        # run inference
+        image = np.expand_dims(image, axis=0)
+        dwm = self.model.predict(image, verbose=0)
+
+        return postprocess_prediction(dwm, pad_r, pad_c)
+
+    def predict_batch(self, images: list) -> list:
+        """Return the water probability maps of scenes with the same padded shape.
+
+        Each scene is normalized on its own, exactly as in predict, and the
+        batch runs through a single model call.
+        """
+        batch, paddings = [], []
+        for image in images:
+            image, pad_r, pad_c = preprocess_image(image)
+            batch.append(image)
+            paddings.append((pad_r, pad_c))
 
-            # del model
-            del image
-            del dwm
-            del dwm_binary
-            del dst
+        batch = np.stack(batch, axis=0)
+        dwm = self.model.predict(batch, batch_size=len(batch), verbose=0)
+        del batch
 
-            gc.collect()
+        return [
+            postprocess_prediction(dwm[i], pad_r, pad_c)
+            for i, (pad_r, pad_c) in enumerate(paddings)
+        ]
+
+    def infer_batch(
+        self, image_paths: list, save_paths: list, memory_budget_mb: float = 2048
+    ):
+        """Segment many GeoTIFFs, batching the scenes that share a padded shape.
+
+        Scenes are bucketed by padded shape, each bucket is split in batches
+        that fit memory_budget_mb and every batch runs a single prediction.
+        The results are saved with the profile of their source image.
+
+        Yields:
+            int: number of scenes saved by each batch, for progress reporting
+        """
+        save_path_by_image = dict(zip(image_paths, save_paths))
+
+        for shape, paths in group_by_padded_shape(image_paths).items():
+            batch_size = batch_size_for_shape(shape, memory_budget_mb)
+
+            for i in range(0, len(paths), batch_size):
+                batch_paths = paths[i : i + batch_size]
+                water_maps = self.predict_batch(
+                    [read_image(image_path) for image_path in batch_paths]
+                )
+
+                for image_path, dwm in zip(batch_paths, water_maps):
+                    self.sink.put(dwm, image_path, save_path_by_image[image_path])
+
+                del water_maps
+                gc.collect()
+
+                yield len(batch_paths)
+
+    def infer(self, image_path: str, save_path: str) -> None:
+        """Segment a GeoTIFF and save the water probability map."""
+        dwm = self.predict(read_image(image_path))
+        self.sink.put(dwm, image_path, save_path)
+
+        del dwm
+        gc.collect()
+
+
+def padded_shape(shape: tuple) -> tuple:
+    """Shape of a scene after the padding applied by preprocess_image."""
+    return tuple(v + sum(find_padding(v)) for v in shape[:2])
+
+
+def group_by_padded_shape(image_paths: list) -> dict:
+    """Group GeoTIFF paths by the padded shape of their scenes.
+
+    Only the headers are read, so grouping a whole archive is cheap.
+    """
+    groups = defaultdict(list)
+    for image_path in image_paths:
+        with rasterio.open(image_path) as src:
+            groups[padded_shape(src.shape)].append(image_path)
+    return dict(groups)
+
+
+def estimate_scene_memory(shape: tuple) -> int:
+    """Approximate bytes used by one padded scene during a prediction."""
+    return shape[0] * shape[1] * activation_floats_per_pixel * 4
+
+
+def batch_size_for_shape(shape: tuple, memory_budget_mb: float) -> int:
+    """Number of scenes of a padded shape that fit the memory budget."""
+    budget = memory_budget_mb * 1024 * 1024
+    return max(1, int(budget // estimate_scene_memory(shape)))
+
+
+def main(image_path, save_path, scale_factor, offset, threshold, session=None):
+    # load the model only when no session is shared by the caller
+    if session is None:
+        session = DeepWaterMapSession()
+
+    session.infer(image_path=image_path, save_path=save_path)
 
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
-    # parser.add_argument(
-    #     "--checkpoint_path",
-    #     type=str,
-    #     help="Path to the dir where the checkpoints are stored",
-    # )
     parser.add_argument(
-        "--image_path", type=str, help="Path to the input GeoTIFF image"
+        "--checkpoint_path",
+        type=str,
+        default=checkpoint_path,
+        help="Path to the checkpoint with the model weights",
     )
     parser.add_argument(
-        "--save_path", type=str, help="Path where the output map will be saved"
+        "--image_path", type=str, nargs="+", help="Path(s) to the input GeoTIFF image"
+    )
+    parser.add_argument(
+        "--save_path",
+        type=str,
+        help="Path where the output map will be saved, a directory if there are many inputs",
     )
     args = parser.parse_args()
-    main(args.checkpoint_path, args.image_path, args.save_path)
+
+    session = DeepWaterMapSession(args.checkpoint_path)
+    for image_path in args.image_path:
+        save_path = args.save_path
+        if len(args.image_path) > 1 or os.path.isdir(save_path):
+            os.makedirs(save_path, exist_ok=True)
+            save_path = os.path.join(save_path, os.path.basename(image_path))
+        session.infer(image_path=image_path, save_path=save_path)
@@ -0,0 +1,107 @@
+def band_mappings(is_toa: bool) -> dict:
+    """Logical band names (blue, nir, QA_PIXEL, ...) to the GEE band names of
+    each satellite, None when the satellite has no such band
+    """
+    band_prefix = "" if is_toa else "SR_"
+    band_prefix_thermal = "" if is_toa else "ST_"
+
+    return {
+        "LT05": {
+            "coastal": None,
+            "blue": f"{band_prefix}B1",
+            "green": f"{band_prefix}B2",
+            "red": f"{band_prefix}B3",
+            "nir": f"{band_prefix}B4",
+            "swir1": f"{band_prefix}B5",
+            "swir2": f"{band_prefix}B7",
+            "pan": None,
+            "cirrus": None,
+            "thermal1": f"{band_prefix_thermal}B6",
+            "thermal2": None,
+            "QA_PIXEL": "QA_PIXEL",
+        },
+        "LE07": {
+            "coastal": None,
+            "blue": f"{band_prefix}B1",
+            "green": f"{band_prefix}B2",
+            "red": f"{band_prefix}B3",
+            "nir": f"{band_prefix}B4",
+            "swir1": f"{band_prefix}B5",
+            "swir2": f"{band_prefix}B7",
+            "pan": f"{band_prefix}B8",
+            "cirrus": None,
+            "thermal1": f"{band_prefix_thermal}B6",
+            "thermal2": None,
+            "QA_PIXEL": "QA_PIXEL",
+        },
+        "LC08": {
+            "coastal": f"{band_prefix}B1",
+            "blue": f"{band_prefix}B2",
+            "green": f"{band_prefix}B3",
+            "red": f"{band_prefix}B4",
+            "nir": f"{band_prefix}B5",
+            "swir1": f"{band_prefix}B6",
+            "swir2": f"{band_prefix}B7",
+            "pan": f"{band_prefix}B8",
+            "cirrus": f"{band_prefix}B9",
+            "thermal1": f"{band_prefix_thermal}B10",
+            "thermal2": f"{band_prefix}B11",
+            "QA_PIXEL": "QA_PIXEL",
+        },
+        "LC09": {
+            "coastal": "B1",
+            "blue": f"{band_prefix}B2",
+            "green": f"{band_prefix}B3",
+            "red": f"{band_prefix}B4",
+            "nir": f"{band_prefix}B5",
+            "swir1": f"{band_prefix}B6",
+            "swir2": f"{band_prefix}B7",
+            "pan": f"{band_prefix}B8",
+            "cirrus": f"{band_prefix}B9",
+            "thermal1": f"{band_prefix_thermal}B10",
+            "thermal2": f"{band_prefix}B11",
+            "QA_PIXEL": "QA_PIXEL",
+        },
+        "S2": {
+            "coastal": "B1",
+            "blue": "B2",
+            "green": "B3",
+            "red": "B4",
+            "rededge1": "B5",
+            "rededge2": "B6",
+            "rededge3": "B7",
+            "nir": "B8",
+            "nir_narrow": "B8A",
+            "water_vapour": "B9",
+            "cirrus": "B10",
+            "swir1": "B11",
+            "swir2": "B12",
+            "QA_PIXEL": "QA60",
+        },
+        "S2_SR": {
+            "coastal": "B1",
+            "blue": "B2",
+            "green": "B3",
+            "red": "B4",
+            "rededge1": "B5",
+            "rededge2": "B6",
+            "rededge3": "B7",
+            "nir": "B8",
+            "nir_narrow": "B8A",
+            "water_vapour": "B9",
+            "swir1": "B11",
+            "swir2": "B12",
+            "QA_PIXEL": "QA60",
+        },
+    }
+
+
+def original_band_name(satelite: str, band: str, is_toa: bool):
+    """GEE name of a logical band, None when the satellite does not have it"""
+    return band_mappings(is_toa).get(satelite, {}).get(band, None)
+
+
+def get_original_bands_name(satelite: str, fake_name_bands: list, is_toa: bool):
+    bands = [original_band_name(satelite, band, is_toa) for band in fake_name_bands]
+
+    return [band for band in bands if band is not None]  # Remove None values
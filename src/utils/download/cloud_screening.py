@@ -0,0 +1,153 @@
+import glob
+import logging
+import os
+
+import ee
+import pandas as pd
+
+from utils.download.manifest import DownloadManifest
+
+logger = logging.getLogger(__name__)
+
+# Coluna dos metadados com a porcentagem de nuvens dentro da ROI
+ROI_CLOUD_COLUMN = "ROI_CLOUD_PERCENTAGE"
+
+S2_CLOUD_PROBABILITY = "COPERNICUS/S2_CLOUD_PROBABILITY"
+
+# QA60: bit 10 nuvens opacas, bit 11 cirrus
+S2_QA60_CLOUD_BITS = (1 << 10) | (1 << 11)
+
+# QA_PIXEL: bit 1 nuvem dilatada, bit 2 cirrus, bit 3 nuvem
+LANDSAT_QA_PIXEL_CLOUD_BITS = (1 << 1) | (1 << 2) | (1 << 3)
+
+
+def cloud_mask(image: ee.Image, satellite: str) -> ee.Image:
+    """1 where the QA band of the image flags clouds, 0 otherwise
+
+    Args:
+        image (ee.Image): Sentinel-2 (QA60) or Landsat Collection 2 (QA_PIXEL)
+        satellite (str): S2, S2_SR or the Landsat id (LT05, LE07, LC08, ...)
+    """
+    if satellite.startswith("S2"):
+        return image.select("QA60").bitwiseAnd(S2_QA60_CLOUD_BITS).neq(0)
+    return image.select("QA_PIXEL").bitwiseAnd(LANDSAT_QA_PIXEL_CLOUD_BITS).neq(0)
+
+
+def group_cloud_fraction(
+    image_ids: list,
+    satellite: str,
+    geometry: ee.Geometry,
+    scale: int = 60,
+    source: str = "qa",
+    probability_threshold: int = 50,
+) -> ee.Number:
+    """Cloud fraction (0-1) of the mosaic of a date group inside the ROI
+
+    With source="probability" (Sentinel-2 only) the clouds come from the
+    S2 cloud probability collection instead of QA60, which is empty for part
+    of the harmonized collection. The result is a server-side object, null
+    when the mosaic has no valid pixel inside the ROI.
+    """
+    if source == "probability" and satellite.startswith("S2"):
+        indexes = [image_id.split("/")[-1] for image_id in image_ids]
+        clouds = (
+            ee.ImageCollection(S2_CLOUD_PROBABILITY)
+            .filter(ee.Filter.inList("system:index", indexes))
+            .mosaic()
+            .select("probability")
+            .gte(probability_threshold)
+        )
+    else:
+        clouds = ee.ImageCollection(
+            [cloud_mask(ee.Image(image_id), satellite) for image_id in image_ids]
+        ).mosaic()
+
+    stats = clouds.rename("cloud").reduceRegion(
+        reducer=ee.Reducer.mean(),
+        geometry=geometry,
+        scale=scale,
+        maxPixels=1e10,
+        bestEffort=True,
+    )
+    return stats.get("cloud")
+
+
+def roi_cloud_percentages(
+    image_groups: list,
+    satellite: str,
+    roi: ee.FeatureCollection,
+    scale: int = 60,
+    source: str = "qa",
+    probability_threshold: int = 50,
+    batch_size: int = 250,
+) -> list:
+    """Cloud percentage inside the ROI of every date group
+
+    The reductions of all the groups are evaluated together, batch_size
+    groups per ee.Dictionary round trip, before anything is downloaded.
+
+    Args:
+        image_groups (list): Image ids of each date group (group_images_by_date)
+        satellite (str): S2, S2_SR or the Landsat id
+        roi (ee.FeatureCollection): Region of interest
+        scale (int): Scale of the reduction in meters, coarser is faster
+        source (str): "qa" (QA60 / QA_PIXEL) or "probability" (S2 only)
+        probability_threshold (int): Cloud probability (%) considered cloud
+        batch_size (int): Groups per round trip
+
+    Returns:
+        list: percentage (0-100) of each group, None when it has no valid pixel
+    """
+    geometry = roi.geometry()
+
+    percentages = []
+    for start in range(0, len(image_groups), batch_size):
+        batch = image_groups[start : start + batch_size]
+        fractions = ee.Dictionary(
+            {
+                str(i): group_cloud_fraction(
+                    image_ids,
+                    satellite,
+                    geometry,
+                    scale=scale,
+                    source=source,
+                    probability_threshold=probability_threshold,
+                )
+                for i, image_ids in enumerate(batch)
+            }
+        ).getInfo()
+
+        for i in range(len(batch)):
+            fraction = fractions.get(str(i))
+            percentages.append(None if fraction is None else 100 * fraction)
+
+    return percentages
+
+
+def load_roi_cloud_percentages(metadata_path: str) -> dict:
+    """ROI cloud percentage of the downloaded images, by date (YYYYMMDD)
+
+    Read from the download manifest and the metadata CSVs of a location.
+    """
+    records = []
+
+    manifest_path = os.path.join(metadata_path, "download_manifest.jsonl")
+    if os.path.exists(manifest_path):
+        for entry in DownloadManifest(manifest_path).entries.values():
+            for image in entry.get("metadata", []):
+                records.append((entry["file"], image.get(ROI_CLOUD_COLUMN)))
+
+    for csv_path in glob.glob(os.path.join(metadata_path, "*metadata*.csv")):
+        df = pd.read_csv(csv_path)
+        if ROI_CLOUD_COLUMN in df.columns and "file_name" in df.columns:
+            records.extend(zip(df["file_name"], df[ROI_CLOUD_COLUMN]))
+
+    percentages = {}
+    for file_name, percentage in records:
+        if percentage is None or pd.isna(percentage):
+            continue
+        date = os.path.splitext(os.path.basename(str(file_name)))[0].split("_")[-1]
+        percentages[date[:8]] = float(percentage)
+
+    logger.info(f"ROI cloud percentage of {len(percentages)} dates loaded")
+    return percentages
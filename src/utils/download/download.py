@@ -2,6 +2,7 @@ import json
 import logging
 import os
 import re
+import tempfile
 from collections import defaultdict
 from datetime import datetime, timezone
 from pathlib import Path
@@ -11,6 +12,12 @@ import pandas as pd
 import requests
 from tqdm import tqdm
 
+from utils.download.tiling import (
+    download_bytes_per_value,
+    mosaic_tiles,
+    plan_tiles,
+)
+from utils.download.transfer import fetch_to_file, run_concurrently
 from utils.gee.authenticate import authenticate_earth_engine
 
 logger = logging.getLogger(__name__)
@@ -36,111 +43,6 @@ def is_TOA(colecao):
     return False
 
 
-def get_original_bands_name(satelite: str, fake_name_bands: list, is_toa: bool):
-    band_prefix = "" if is_toa else "SR_"
-    band_prefix_thermal = "" if is_toa else "ST_"
-
-    band_mappings = {
-        "LT05": {
-            "coastal": None,
-            "blue": f"{band_prefix}B1",
-            "green": f"{band_prefix}B2",
-            "red": f"{band_prefix}B3",
-            "nir": f"{band_prefix}B4",
-            "swir1": f"{band_prefix}B5",
-            "swir2": f"{band_prefix}B7",
-            "pan": None,
-            "cirrus": None,
-            "thermal1": f"{band_prefix_thermal}B6",
-            "thermal2": None,
-            "QA_PIXEL": "QA_PIXEL",
-        },
-        "LE07": {
-            "coastal": None,
-            "blue": f"{band_prefix}B1",
-            "green": f"{band_prefix}B2",
-            "red": f"{band_prefix}B3",
-            "nir": f"{band_prefix}B4",
-            "swir1": f"{band_prefix}B5",
-            "swir2": f"{band_prefix}B7",
-            "pan": f"{band_prefix}B8",
-            "cirrus": None,
-            "thermal1": f"{band_prefix_thermal}B6",
-            "thermal2": None,
-            "QA_PIXEL": "QA_PIXEL",
-        },
-        "LC08": {
-            "coastal": f"{band_prefix}B1",
-            "blue": f"{band_prefix}B2",
-            "green": f"{band_prefix}B3",
-            "red": f"{band_prefix}B4",
-            "nir": f"{band_prefix}B5",
-            "swir1": f"{band_prefix}B6",
-            "swir2": f"{band_prefix}B7",
-            "pan": f"{band_prefix}B8",
-            "cirrus": f"{band_prefix}B9",
-            "thermal1": f"{band_prefix_thermal}B10",
-            "thermal2": f"{band_prefix}B11",
-            "QA_PIXEL": "QA_PIXEL",
-        },
-        "LC09": {
-            "coastal": "B1",
-            "blue": f"{band_prefix}B2",
-            "green": f"{band_prefix}B3",
-            "red": f"{band_prefix}B4",
-            "nir": f"{band_prefix}B5",
-            "swir1": f"{band_prefix}B6",
-            "swir2": f"{band_prefix}B7",
-            "pan": f"{band_prefix}B8",
-            "cirrus": f"{band_prefix}B9",
-            "thermal1": f"{band_prefix_thermal}B10",
-            "thermal2": f"{band_prefix}B11",
-            "QA_PIXEL": "QA_PIXEL",
-        },
-        "S2": {
-            "coastal": "B1",
-            "blue": "B2",
-            "green": "B3",
-            "red": "B4",
-            "rededge1": "B5",
-            "rededge2": "B6",
-            "rededge3": "B7",
-            "nir": "B8",
-            "nir_narrow": "B8A",
-            "water_vapour": "B9",
-            "cirrus": "B10",
-            "swir1": "B11",
-            "swir2": "B12",
-            "QA_PIXEL": "QA60",
-        },
-        "S2_SR": {
-            "coastal": "B1",
-            "blue": "B2",
-            "green": "B3",
-            "red": "B4",
-            "rededge1": "B5",
-            "rededge2": "B6",
-            "rededge3": "B7",
-            "nir": "B8",
-            "nir_narrow": "B8A",
-            "water_vapour": "B9",
-            "swir1": "B11",
-            "swir2": "B12",
-            "QA_PIXEL": "QA60",
-        },
-    }
-
-    bands = (
-        [band_mappings[satelite].get(band, None) for band in fake_name_bands]
-        if satelite in band_mappings
-        else []
-    )
-    if None in bands:
-        bands.remove(None)  # Remove None values
-
-    return bands
-
-
 def adjust_date(satelite: str, start_date_str: str, end_date_str: str) -> tuple:
     satellite_dates = {
         "LT05": ("1984-03-01", "2013-06-05"),
@@ -226,12 +128,85 @@ def group_images_by_date(images_info):
     return list(grouped.values())
 
 
+def get_roi_bounds(roi: ee.FeatureCollection) -> tuple:
+    """(min_x, min_y, max_x, max_y) of the ROI in EPSG:4326, one round trip"""
+    coordinates = roi.geometry().bounds().getInfo()["coordinates"][0]
+    xs = [x for x, _ in coordinates]
+    ys = [y for _, y in coordinates]
+    return min(xs), min(ys), max(xs), max(ys)
+
+
+def get_band_layout(image: ee.Image) -> tuple:
+    """(number of bands, bytes of each value) of the image GeoTIFF, from its
+    band types (one round trip)"""
+    band_types = image.bandTypes().getInfo()
+    return len(band_types), download_bytes_per_value(band_types)
+
+
+def request_grid(tiles: list, max_request_mb: float) -> str:
+    """Grid of the requests of a download: "region" when the ROI fits in one
+    request, otherwise the tiles of the bounding box grid and their size
+    limit"""
+    if len(tiles) <= 1:
+        return "region"
+    return f"tiles:{max_request_mb}"
+
+
+def download_tiles(
+    image: ee.Image,
+    tiles: list,
+    output_file: str,
+    session: requests.Session = None,
+    max_retries: int = 5,
+    max_workers: int = 4,
+) -> None:
+    """Download an image in tiles (plan_tiles) and mosaic them into output_file
+
+    Each tile is requested on the pixel grid of the whole ROI, through
+    crs_transform and dimensions, so the tiles do not overlap.
+    """
+    output_file = str(output_file)
+
+    with tempfile.TemporaryDirectory(dir=os.path.dirname(output_file) or ".") as tmp_dir:
+
+        def download_tile(i, tile):
+            url = image.getDownloadURL(
+                {
+                    "crs": "EPSG:4326",
+                    "crs_transform": tile["crs_transform"],
+                    "dimensions": f"{tile['width']}x{tile['height']}",
+                    "format": "GeoTIFF",
+                }
+            )
+            tile_file = os.path.join(tmp_dir, f"tile_{i}.tif")
+            fetch_to_file(url, tile_file, session=session, max_retries=max_retries)
+            return tile_file
+
+        tile_files = []
+        for (i, _), result in run_concurrently(
+            download_tile, list(enumerate(tiles)), max_workers=max_workers
+        ):
+            if isinstance(result, Exception):
+                raise result
+            tile_files.append(result)
+
+        mosaic_tiles(sorted(tile_files), output_file)
+
+
 def download_mosaic_image(
     image_ids: list,
     output_file: str,
     selected_bands: list,
     roi: ee.FeatureCollection,
     scale: int = 10,
+    session: requests.Session = None,
+    max_retries: int = 5,
+    metadata: dict = None,
+    roi_bounds: tuple = None,
+    n_bands: int = None,
+    max_request_mb: float = 40,
+    tile_workers: int = 4,
+    bytes_per_value: int = None,
 ):
     try:
         # Carrega as imagens como ee.Image e faz mosaico
@@ -242,22 +217,47 @@ def download_mosaic_image(
         if selected_bands:
             mosaic = mosaic.select(selected_bands)
 
-        # Define a URL para download
-        url = mosaic.getDownloadURL(
-            {
-                "scale": scale,
-                "region": roi.geometry(),
-                "crs": "EPSG:4326",
-                "format": "GeoTIFF",
-            }
-        )
+        # ROIs maiores que o limite do getDownloadURL são baixadas em tiles;
+        # as que cabem em uma requisição continuam usando a região da ROI
+        tiles = []
+        if roi_bounds is not None:
+            if n_bands is None or bytes_per_value is None:
+                n_bands, bytes_per_value = get_band_layout(mosaic)
+            tiles = plan_tiles(
+                roi_bounds,
+                scale=scale,
+                n_bands=n_bands,
+                bytes_per_value=bytes_per_value,
+                max_request_bytes=int(max_request_mb * 1024 * 1024),
+            )
+
+        if len(tiles) > 1:
+            download_tiles(
+                mosaic,
+                tiles,
+                output_file,
+                session=session,
+                max_retries=max_retries,
+                max_workers=tile_workers,
+            )
+        else:
+            # Define a URL para download
+            url = mosaic.getDownloadURL(
+                {
+                    "scale": scale,
+                    "region": roi.geometry(),
+                    "crs": "EPSG:4326",
+                    "format": "GeoTIFF",
+                }
+            )
 
-        # Faz download do arquivo
-        response = requests.get(url)
-        with open(output_file, "wb") as file:
-            file.write(response.content)
+            # Faz download do arquivo (arquivo temporário renomeado ao final)
+            fetch_to_file(url, output_file, session=session, max_retries=max_retries)
 
         # logger.info(f"Imagem salva em: {output_file}")
+        if metadata is not None:
+            # metadados já consultados em lote (get_images_properties)
+            return [dict(metadata[image_id]) for image_id in image_ids]
         return list(map(lambda img: get_image_metadata(ee.Image(img)), images))
 
     except Exception as e:
@@ -271,6 +271,8 @@ def download_scene(
     selected_bands: list,
     roi: ee.FeatureCollection = None,
     scale: int = 10,
+    session: requests.Session = None,
+    max_retries: int = 5,
 ):
     try:
         image = ee.Image(image_id)
@@ -314,9 +316,7 @@ def download_scene(
         # )
 
         # Faz o download da imagem e salva no diretório especificado
-        response = requests.get(url)
-        with open(output_file, "wb") as file:
-            file.write(response.content)
+        fetch_to_file(url, output_file, session=session, max_retries=max_retries)
 
         return image_info
 
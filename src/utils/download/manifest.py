@@ -0,0 +1,158 @@
+import hashlib
+import json
+import logging
+import os
+from datetime import datetime
+
+logger = logging.getLogger(__name__)
+
+
+def file_checksum(path: str, chunk_size: int = 1024 * 1024) -> str:
+    """sha256 of a file, read in chunks"""
+    digest = hashlib.sha256()
+    with open(path, "rb") as file:
+        for chunk in iter(lambda: file.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def roi_hash(roi) -> str:
+    """Hash of the ROI, from the serialized ee object (no round trip to GEE)"""
+    serialized = roi.serialize() if hasattr(roi, "serialize") else json.dumps(roi)
+    return hashlib.sha256(serialized.encode()).hexdigest()[:16]
+
+
+class DownloadManifest:
+    """Record of the date groups already downloaded for a location
+
+    Every downloaded file is appended as one JSON line keyed by (collection,
+    date group, image ids, bands, scale, ROI hash, grid), with its size, checksum
+    and GEE metadata. A group whose key, size (and optionally checksum)
+    match is complete and is not downloaded again; files that were truncated,
+    modified or written by an interrupted run are fetched again. Groups left
+    out by the ROI cloud screening are recorded too, with their percentage,
+    so they are not screened again while the limit does not change.
+    """
+
+    def __init__(self, path: str):
+        self.path = str(path)
+        self.entries = {}
+
+        if os.path.exists(self.path):
+            with open(self.path) as file:
+                for line in file:
+                    line = line.strip()
+                    if not line:
+                        continue
+                    try:
+                        entry = json.loads(line)
+                    except json.JSONDecodeError:
+                        # linha incompleta de uma execução interrompida
+                        logger.warning(f"Linha inválida no manifesto {self.path}")
+                        continue
+                    self.entries[entry["key"]] = entry
+
+    @staticmethod
+    def key(
+        collection_id: str,
+        date: str,
+        image_ids: list,
+        bands: list,
+        scale: int,
+        roi_hash: str,
+        grid: str = "region",
+    ) -> str:
+        """Identifier of a download request
+
+        grid is "region" for a request on the ROI region, or the tiling of
+        the bounding box grid (see request_grid); region requests keep the
+        keys of the manifests written before tiling.
+        """
+        request = [collection_id, date, sorted(image_ids), bands or [], scale, roi_hash]
+        if grid != "region":
+            request.append(grid)
+        return hashlib.sha256(json.dumps(request).encode()).hexdigest()
+
+    def is_complete(
+        self, key: str, output_file: str, verify_checksum: bool = False
+    ) -> bool:
+        """True if the file of the request was downloaded and is intact"""
+        entry = self.entries.get(key)
+        output_file = str(output_file)
+
+        if entry is None or entry["file"] != output_file or entry.get("screened"):
+            return False
+        if not os.path.exists(output_file):
+            return False
+        if os.path.getsize(output_file) != entry["size"]:
+            logger.warning(f"Arquivo incompleto, será baixado novamente: {output_file}")
+            return False
+        if verify_checksum and file_checksum(output_file) != entry["checksum"]:
+            logger.warning(f"Checksum diferente, será baixado novamente: {output_file}")
+            return False
+        return True
+
+    def is_screened(
+        self, key: str, output_file: str, max_roi_cloud_percentage: float
+    ) -> bool:
+        """True if the request was left out by the ROI cloud screening and its
+        percentage is still above the limit"""
+        entry = self.entries.get(key)
+        if entry is None or not entry.get("screened"):
+            return False
+        return (
+            entry["file"] == str(output_file)
+            and entry["roi_cloud_percentage"] > max_roi_cloud_percentage
+        )
+
+    def roi_cloud_percentage(self, key: str) -> float:
+        """ROI cloud percentage recorded for a screened request"""
+        return self.entries[key]["roi_cloud_percentage"]
+
+    def metadata(self, key: str) -> list:
+        """GEE metadata saved with the request"""
+        return self.entries[key].get("metadata", [])
+
+    def record(self, key: str, output_file: str, metadata: list = None, **fields):
+        """Append a downloaded file to the manifest"""
+        output_file = str(output_file)
+        entry = {
+            "key": key,
+            "file": output_file,
+            "size": os.path.getsize(output_file),
+            "checksum": file_checksum(output_file),
+            "downloaded_at": datetime.now().isoformat(timespec="seconds"),
+            "metadata": metadata or [],
+            **fields,
+        }
+
+        self._append(entry)
+
+    def record_screened(
+        self, key: str, output_file: str, roi_cloud_percentage: float, **fields
+    ):
+        """Append a request left out by the ROI cloud screening"""
+        self._append(
+            {
+                "key": key,
+                "file": str(output_file),
+                "screened": True,
+                "roi_cloud_percentage": roi_cloud_percentage,
+                "screened_at": datetime.now().isoformat(timespec="seconds"),
+                **fields,
+            }
+        )
+
+    def _append(self, entry: dict):
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        with open(self.path, "a") as file:
+            file.write(json.dumps(entry, default=str) + "\n")
+        self.entries[entry["key"]] = entry
+
+    def compact(self):
+        """Rewrite the manifest with only the latest entry of every key"""
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w") as file:
+            for entry in self.entries.values():
+                file.write(json.dumps(entry, default=str) + "\n")
+        os.replace(tmp_path, self.path)
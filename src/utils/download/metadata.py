@@ -0,0 +1,86 @@
+import json
+import logging
+import os
+from datetime import datetime, timezone
+
+import ee
+
+logger = logging.getLogger(__name__)
+
+
+def timestamp_to_date(timestamp) -> str:
+    """YYYY-MM-DD (UTC) of a GEE system:time_start, None when it is missing"""
+    if timestamp is None:
+        return None
+    return datetime.fromtimestamp(timestamp / 1000, tz=timezone.utc).strftime(
+        "%Y-%m-%d"
+    )
+
+
+def get_collection_summary(collection: ee.ImageCollection) -> dict:
+    """Size, image ids and date range of a collection in a single round trip
+
+    Args:
+        collection (ee.ImageCollection): Filtered collection
+
+    Returns:
+        dict: size, ids, min_date and max_date (YYYY-MM-DD)
+    """
+    summary = ee.Dictionary(
+        {
+            "size": collection.size(),
+            "ids": collection.aggregate_array("system:id"),
+            "min_time": collection.aggregate_min("system:time_start"),
+            "max_time": collection.aggregate_max("system:time_start"),
+        }
+    ).getInfo()
+
+    return {
+        "size": summary["size"],
+        "ids": summary["ids"],
+        "min_date": timestamp_to_date(summary.get("min_time")),
+        "max_date": timestamp_to_date(summary.get("max_time")),
+    }
+
+
+def get_images_properties(
+    image_ids: list, cache_path: str = None, batch_size: int = 500
+) -> dict:
+    """Property dictionaries of many images, batched and cached
+
+    The properties of an image never change, so they are cached by image id
+    in cache_path (JSON) and only the missing ones are requested, batch_size
+    images per ee.Dictionary evaluation.
+
+    Args:
+        image_ids (list): GEE ids of the images
+        cache_path (str): JSON file of the cache, no cache when None
+        batch_size (int): Images per round trip
+
+    Returns:
+        dict: {image id: properties}
+    """
+    cache = {}
+    if cache_path and os.path.exists(cache_path):
+        with open(cache_path) as file:
+            cache = json.load(file)
+
+    missing = list(dict.fromkeys(i for i in image_ids if i not in cache))
+    for start in range(0, len(missing), batch_size):
+        batch = missing[start : start + batch_size]
+        cache.update(
+            ee.Dictionary(
+                {image_id: ee.Image(image_id).toDictionary() for image_id in batch}
+            ).getInfo()
+        )
+
+    if missing:
+        logger.info(f"Metadata of {len(missing)} images requested to GEE")
+        if cache_path:
+            os.makedirs(os.path.dirname(str(cache_path)) or ".", exist_ok=True)
+            tmp_path = f"{cache_path}.tmp"
+            with open(tmp_path, "w") as file:
+                json.dump(cache, file)
+            os.replace(tmp_path, cache_path)
+
+    return {image_id: cache[image_id] for image_id in image_ids}
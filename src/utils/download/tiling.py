@@ -0,0 +1,158 @@
+import math
+import os
+
+import rasterio
+from rasterio.merge import merge
+
+# Limites do getDownloadURL do GEE
+MAX_REQUEST_BYTES = 50331648
+MAX_GRID_DIMENSION = 32768
+
+# O GEE converte a escala (m) em graus pelo comprimento do grau no equador
+METERS_PER_DEGREE = 111319.49079327357
+
+
+def pixel_grid(bounds: tuple, scale: float) -> tuple:
+    """Pixel grid of a bounding box in EPSG:4326 at scale meters
+
+    Args:
+        bounds (tuple): (min_x, min_y, max_x, max_y) in degrees
+        scale (float): Pixel size in meters
+
+    Returns:
+        tuple: (x0, y0, resolution in degrees, width, height), (x0, y0) is the
+               upper left corner
+    """
+    min_x, min_y, max_x, max_y = bounds
+    resolution = scale / METERS_PER_DEGREE
+    width = max(1, math.ceil((max_x - min_x) / resolution))
+    height = max(1, math.ceil((max_y - min_y) / resolution))
+    return min_x, max_y, resolution, width, height
+
+
+def download_bytes_per_value(band_types: dict) -> int:
+    """Bytes of each value of a GEE download, from ee.Image.bandTypes()
+
+    The GeoTIFF of a download has one data type for every band, so the widest
+    band sets the size (float bands, as the TOA Landsat ones, take 4 bytes).
+
+    Args:
+        band_types (dict): {band: PixelType info} of the selected bands
+
+    Returns:
+        int: 1, 2, 4 or 8
+    """
+    sizes = [1]
+    for band_type in band_types.values():
+        precision = band_type.get("precision")
+        if precision == "double":
+            sizes.append(8)
+        elif precision == "float":
+            sizes.append(4)
+        else:
+            low, high = band_type.get("min", 0), band_type.get("max", 0)
+            for size in (1, 2, 4):
+                bits = 8 * size
+                if (0 <= low and high < 2**bits) or (
+                    -(2 ** (bits - 1)) <= low and high < 2 ** (bits - 1)
+                ):
+                    break
+            else:
+                size = 8
+            sizes.append(size)
+    return max(sizes)
+
+
+def request_bytes(width: int, height: int, n_bands: int, bytes_per_value: int = 2):
+    """Approximate size of a getDownloadURL request"""
+    return width * height * n_bands * bytes_per_value
+
+
+def plan_tiles(
+    bounds: tuple,
+    scale: float,
+    n_bands: int,
+    bytes_per_value: int = 2,
+    max_request_bytes: int = 40 * 1024 * 1024,
+    max_dimension: int = MAX_GRID_DIMENSION,
+) -> list:
+    """Split a bounding box into requests under the getDownloadURL limits
+
+    The tiles share the pixel grid of the whole box, so they fit side by side
+    without gaps or overlaps when mosaicked.
+
+    Args:
+        bounds (tuple): (min_x, min_y, max_x, max_y) in degrees
+        scale (float): Pixel size in meters
+        n_bands (int): Bands requested
+        bytes_per_value (int): Bytes of each band value (2 for uint16, 4 for
+                               float32), see download_bytes_per_value()
+        max_request_bytes (int): Size limit of a request, with a margin
+        max_dimension (int): Maximum width and height of a request
+
+    Returns:
+        list: dicts with crs_transform, width, height, row_off and col_off of
+              every tile; a single tile when the box fits in one request
+    """
+    x0, y0, resolution, width, height = pixel_grid(bounds, scale)
+
+    pixels_per_tile = max(1, max_request_bytes // (n_bands * bytes_per_value))
+    side = max(1, min(max_dimension, int(math.sqrt(pixels_per_tile))))
+    n_cols, n_rows = math.ceil(width / side), math.ceil(height / side)
+    if request_bytes(width, height, n_bands, bytes_per_value) <= max_request_bytes:
+        if width <= max_dimension and height <= max_dimension:
+            n_cols, n_rows = 1, 1
+
+    tile_width, tile_height = math.ceil(width / n_cols), math.ceil(height / n_rows)
+
+    tiles = []
+    for row_off in range(0, height, tile_height):
+        for col_off in range(0, width, tile_width):
+            tiles.append(
+                {
+                    "crs_transform": [
+                        resolution,
+                        0,
+                        x0 + col_off * resolution,
+                        0,
+                        -resolution,
+                        y0 - row_off * resolution,
+                    ],
+                    "width": min(tile_width, width - col_off),
+                    "height": min(tile_height, height - row_off),
+                    "row_off": row_off,
+                    "col_off": col_off,
+                }
+            )
+    return tiles
+
+
+def mosaic_tiles(tile_paths: list, output_file: str) -> None:
+    """Assemble the downloaded tiles into one GeoTIFF
+
+    The mosaic is written to a temporary file and renamed over output_file.
+    """
+    sources = [rasterio.open(path) for path in tile_paths]
+    try:
+        mosaic, transform = merge(sources)
+        profile = sources[0].profile
+        descriptions = sources[0].descriptions
+        profile.update(
+            driver="GTiff",
+            height=mosaic.shape[1],
+            width=mosaic.shape[2],
+            transform=transform,
+        )
+        # Mosaicos grandes são gravados em blocos internos, para leitura por janela
+        profile.update(tiled=True, blockxsize=512, blockysize=512, BIGTIFF="IF_SAFER")
+    finally:
+        for src in sources:
+            src.close()
+
+    tmp_file = f"{output_file}.part"
+    with rasterio.open(tmp_file, "w", **profile) as dst:
+        dst.write(mosaic)
+        # nomes das bandas do GEE, usados pelos leitores de bandas
+        if any(descriptions):
+            dst.descriptions = descriptions
+    os.replace(tmp_file, output_file)
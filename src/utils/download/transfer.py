@@ -0,0 +1,137 @@
+import logging
+import os
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import requests
+from requests.adapters import HTTPAdapter
+
+logger = logging.getLogger(__name__)
+
+# Respostas que indicam sobrecarga ou falha temporária do servidor
+RETRY_STATUS = {429, 500, 502, 503, 504}
+
+
+class DownloadError(Exception):
+    """Raised when a file can not be downloaded after all the retries"""
+
+
+def create_session(pool_size: int = 8) -> requests.Session:
+    """Session shared by the download threads, with one pooled connection per
+    thread.
+    """
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+def retry_delay(attempt: int, backoff_factor: float, response=None) -> float:
+    """Seconds to wait before the next attempt: the Retry-After header of the
+    response when there is one, otherwise backoff_factor * 2 ** attempt.
+    """
+    if response is not None:
+        retry_after = response.headers.get("Retry-After")
+        if retry_after is not None and retry_after.isdigit():
+            return float(retry_after)
+    return backoff_factor * 2**attempt
+
+
+def fetch_to_file(
+    url: str,
+    output_file: str,
+    session: requests.Session = None,
+    max_retries: int = 5,
+    backoff_factor: float = 1.0,
+    timeout: float = 300,
+    chunk_size: int = 1024 * 1024,
+) -> int:
+    """Download url into output_file
+
+    The response is streamed to a temporary file in the same directory, which
+    is renamed to output_file only when it is complete, so an interrupted
+    download never leaves a truncated GeoTIFF behind. Connection errors and
+    429/5xx responses are retried with exponential backoff.
+
+    Args:
+        url (str): URL of the file
+        output_file (str): Path of the downloaded file
+        session (requests.Session): Shared session, plain requests when None
+        max_retries (int): Attempts after the first one
+        backoff_factor (float): Base of the exponential backoff, in seconds
+        timeout (float): Seconds to wait for the server
+        chunk_size (int): Bytes written at a time
+
+    Returns:
+        int: size of the file in bytes
+    """
+    session = session or requests
+    output_file = str(output_file)
+    directory = os.path.dirname(output_file) or "."
+    os.makedirs(directory, exist_ok=True)
+
+    for attempt in range(max_retries + 1):
+        response = None
+        try:
+            response = session.get(url, stream=True, timeout=timeout)
+
+            if response.status_code in RETRY_STATUS:
+                raise requests.HTTPError(
+                    f"{response.status_code} {response.reason}", response=response
+                )
+            response.raise_for_status()
+
+            with tempfile.NamedTemporaryFile(
+                dir=directory, suffix=".part", delete=False
+            ) as tmp_file:
+                try:
+                    for chunk in response.iter_content(chunk_size=chunk_size):
+                        tmp_file.write(chunk)
+                except BaseException:
+                    tmp_file.close()
+                    os.remove(tmp_file.name)
+                    raise
+
+            os.replace(tmp_file.name, output_file)
+            return os.path.getsize(output_file)
+
+        except (
+            requests.ConnectionError,
+            requests.Timeout,
+            requests.HTTPError,
+            requests.exceptions.ChunkedEncodingError,
+        ) as e:
+            retryable = not isinstance(e, requests.HTTPError) or (
+                e.response is not None and e.response.status_code in RETRY_STATUS
+            )
+            if not retryable or attempt == max_retries:
+                raise DownloadError(f"Erro ao baixar {output_file}: {e}") from e
+
+            delay = retry_delay(attempt, backoff_factor, response)
+            logger.warning(
+                f"Tentativa {attempt + 1} de {output_file} falhou ({e}), "
+                f"nova tentativa em {delay:.1f} s"
+            )
+            time.sleep(delay)
+
+        finally:
+            if response is not None:
+                response.close()
+
+
+def run_concurrently(func, tasks: list, max_workers: int = 4):
+    """Run func(*task) for every task in a thread pool
+
+    Yields:
+        tuple: (task, result or the exception raised), as soon as each task
+               finishes
+    """
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {executor.submit(func, *task): task for task in tasks}
+        for future in as_completed(futures):
+            try:
+                yield futures[future], future.result()
+            except Exception as e:
+                yield futures[future], e
@@ -1,22 +1,37 @@
 import os
+import time
 
 import matplotlib.pyplot as plt
 import numpy as np
+import rasterio
 from PIL import Image, ImageFilter
 
 from utils.fmask.fmask_utils import (
     calculate_brightness_temperature,
     calculate_flood_fill_transformation,
-    calculate_ndsi,
-    calculate_ndvi,
     calculate_ndwi,
-    read_bands,
+    compose_mask,
+    iter_block_windows,
+    read_mask_preview,
     save_mask_tif,
     save_overlayed_mask_plot,
 )
+from utils.raster_io.band_reader import band_indexes, read_band_stack
+from utils.raster_io.cog import open_cog
 
 
 class Fmask:
+    # Bands used by create_fmask, read by name (read_band_stack); the rasterio
+    # (1-based) indexes are used when the image has no band names
+    sentinel_band_indexes = {
+        "blue": 2,
+        "green": 3,
+        "red": 4,
+        "nir": 8,
+        "swir1": 11,
+        "swir2": 12,
+    }
+
     def __init__(self, scale_factor):
         self.scale_factor = scale_factor
 
@@ -138,6 +153,97 @@ class Fmask:
 
         return pcp
 
+    def pass_one_and_water_test(
+        self,
+        blue: np.ndarray,
+        green: np.ndarray,
+        red: np.ndarray,
+        nir: np.ndarray,
+        swir1: np.ndarray,
+        swir2: np.ndarray,
+        dtype=None,
+    ) -> tuple[np.ndarray, np.ndarray]:
+        """Fused pass_one (with its ndvi, ndsi and whiteness) and water_test
+
+        Every intermediate is written into a few preallocated buffers with
+        out=, instead of allocating a full-size array per operation. The
+        operations are the same, in the same order, as the separate methods,
+        so with the default dtype the masks are bit-identical to them for
+        float bands (scale_factor < 1). Integer bands (scale_factor=1 on a
+        uint16 scene) are cast to float32 first, while the separate methods
+        subtract them in uint16 and wrap around, so those masks differ.
+
+        Args:
+            blue, green, red, nir, swir1, swir2 (np.ndarray): Scaled bands
+            dtype: Float type of the computation, the bands dtype if None.
+                float32 halves the memory, but pixels lying on a threshold
+                may be classified differently than in float64
+
+        Returns:
+            tuple: potential cloud pixels (Eq. 6) and water test (Eq. 5)
+        """
+        if dtype is None:
+            dtype = np.result_type(red.dtype, np.float32)
+        blue, green, red, nir, swir1, swir2 = (
+            np.asarray(band, dtype=dtype)
+            for band in (blue, green, red, nir, swir1, swir2)
+        )
+
+        ndvi = np.empty(red.shape, dtype=dtype)
+        mean_visible = np.empty(red.shape, dtype=dtype)
+        whiteness = np.empty(red.shape, dtype=dtype)
+        tmp = np.empty(red.shape, dtype=dtype)
+        pcp = np.empty(red.shape, dtype=bool)
+        water = np.empty(red.shape, dtype=bool)
+        test = np.empty(red.shape, dtype=bool)
+        aux = np.empty(red.shape, dtype=bool)
+
+        # Eq. 1: swir2 > 0.03, bt < 27, ndvi < 0.8 and ndsi < 0.8
+        np.greater(swir2, 0.03, out=pcp)
+        np.subtract(swir2, 273.15, out=tmp)
+        pcp &= np.less(tmp, 27, out=test)
+
+        np.subtract(nir, red, out=ndvi)
+        np.add(nir, red, out=tmp)
+        np.divide(ndvi, tmp, out=ndvi)
+        pcp &= np.less(ndvi, 0.8, out=test)
+
+        np.subtract(green, swir1, out=whiteness)
+        np.add(green, swir1, out=tmp)
+        np.divide(whiteness, tmp, out=tmp)
+        pcp &= np.less(tmp, 0.8, out=test)
+
+        # Eq. 2: whiteness < 0.8
+        np.add(red, green, out=mean_visible)
+        np.add(mean_visible, blue, out=mean_visible)
+        np.divide(mean_visible, 3, out=mean_visible)
+        whiteness.fill(0)
+        for band in (red, green, blue):
+            np.subtract(band, mean_visible, out=tmp)
+            np.divide(tmp, mean_visible, out=tmp)
+            np.abs(tmp, out=tmp)
+            np.add(whiteness, tmp, out=whiteness)
+        pcp &= np.less(whiteness, 0.8, out=test)
+
+        # Eq. 3: hot test
+        np.multiply(red, 0.5, out=tmp)
+        np.subtract(blue, tmp, out=tmp)
+        np.subtract(tmp, 0.08, out=tmp)
+        pcp &= np.greater(tmp, 0, out=test)
+
+        # Eq. 4: nir / swir1 > 0.75
+        np.divide(nir, swir1, out=tmp)
+        pcp &= np.greater(tmp, 0.75, out=test)
+
+        # Eq. 5
+        np.less(ndvi, 0.01, out=water)
+        water &= np.less(nir, 0.11, out=test)
+        np.less(ndvi, 0.1, out=test)
+        test &= np.less(nir, 0.05, out=aux)
+        water |= test
+
+        return pcp, water
+
     def water_test(self, ndvi: np.ndarray, nir: np.ndarray) -> np.ndarray:
         """_summary_
 
@@ -418,6 +524,135 @@ class Fmask:
         return result
         # return ((flood_fill_b4 - b4) < 25) & np.logical_not(water_test)
 
+    def detect_shadows_block(
+        self,
+        nir: np.ndarray,
+        water_test: np.ndarray,
+        nir_min: float,
+        nir_max: float,
+    ) -> np.ndarray:
+        """Same as detect_shadows for a block, given the scene min/max of nir
+
+        The flood fill of calculate_flood_fill_transformation never raises a
+        pixel above the normalized band, so its result is the set of pixels
+        whose normalized value is 255, which only depends on the scene min/max.
+
+        Args:
+            nir (np.ndarray): NIR band of the block
+            water_test (np.ndarray): Water test of the block
+            nir_min (float): Minimum of the NIR band in the whole scene
+            nir_max (float): Maximum of the NIR band in the whole scene
+
+        Returns:
+            np.ndarray: Potential cloud shadow layer of the block
+        """
+        normalized = ((nir - nir_min) / (nir_max - nir_min) * 255).astype(np.uint8)
+        flood_fill_nir = normalized // 255
+
+        return (
+            ((flood_fill_nir - nir) > -0.1297589)
+            & ((flood_fill_nir - nir) < -0.0249)
+            & np.logical_not(water_test)
+        )
+
+    def read_scaled_bands(self, src, window=None) -> dict:
+        """Read only the bands used by Fmask, scaled to reflectance
+
+        Args:
+            src (rasterio.DatasetReader): Opened scene
+            window (rasterio.windows.Window): Block to read, the whole scene if None
+
+        Returns:
+            dict: Band name to scaled band
+        """
+        bands = read_band_stack(
+            src,
+            list(self.sentinel_band_indexes),
+            default_indexes=list(self.sentinel_band_indexes.values()),
+            window=window,
+        )
+        return {
+            name: bands[i] * self.scale_factor
+            for i, name in enumerate(self.sentinel_band_indexes)
+        }
+
+    def scene_statistics(self, src, block_size: int = 1024) -> dict:
+        """First streaming pass gathering the scene-wide values used per pixel
+
+        Args:
+            src (rasterio.DatasetReader): Opened scene
+            block_size (int): Side of the blocks read at once
+
+        Returns:
+            dict: min/max of the NIR band, used by the shadow normalization
+        """
+        nir_index = band_indexes(
+            src, ["nir"], default_indexes=[self.sentinel_band_indexes["nir"]]
+        )[0]
+        nir_min, nir_max = [], []
+        for block, _, _ in iter_block_windows(src.height, src.width, block_size):
+            nir = src.read(nir_index, window=block)
+            nir = nir * self.scale_factor
+            nir_min.append(np.min(nir))
+            nir_max.append(np.max(nir))
+
+        return {"nir_min": np.min(nir_min), "nir_max": np.max(nir_max)}
+
+    def create_fmask_tiled(
+        self, tif_file: str, output_file: str, block_size: int = 1024
+    ) -> None:
+        """Block by block version of create_fmask + save_mask_tif for large scenes
+
+        Only one block of the six used bands is in memory at a time. A first
+        pass gathers the scene statistics and a second one computes the tests
+        of each block (read with a 1 pixel halo for the water dilation) and
+        writes its part of the mask, giving the same mask as the in-memory path.
+
+        Args:
+            tif_file (str): Path to .tif with the bands
+            output_file (str): Path of the mask .tif
+            block_size (int): Side of the blocks read at once
+        """
+        with rasterio.open(tif_file) as src:
+            stats = self.scene_statistics(src, block_size)
+
+            profile = src.profile
+            with open_cog(output_file, profile, count=1) as dst:
+                for block, read_window, inner in iter_block_windows(
+                    src.height, src.width, block_size, halo=1
+                ):
+                    bands = self.read_scaled_bands(src, read_window)
+                    blue, green, red = bands["blue"], bands["green"], bands["red"]
+                    nir, swir1, swir2 = bands["nir"], bands["swir1"], bands["swir2"]
+
+                    ndwi = calculate_ndwi(green=green, nir=nir)
+                    cloud_mask, water_test = self.pass_one_and_water_test(
+                        blue=blue,
+                        green=green,
+                        red=red,
+                        nir=nir,
+                        swir1=swir1,
+                        swir2=swir2,
+                    )
+                    shadow_mask = self.detect_shadows_block(
+                        nir=nir,
+                        water_test=water_test,
+                        nir_min=stats["nir_min"],
+                        nir_max=stats["nir_max"],
+                    )
+                    water_mask = np.logical_and(ndwi > 0.1, water_test)
+                    water_mask = np.asarray(
+                        Image.fromarray(water_mask).filter(ImageFilter.MaxFilter(size=3))
+                    )
+
+                    dst.write(
+                        compose_mask(
+                            cloud_mask[inner], shadow_mask[inner], water_mask[inner]
+                        ),
+                        1,
+                        window=block,
+                    )
+
     def create_fmask(self, tif_file: str) -> np.ndarray:
         """Receives the landsat image and return the segmentation mask for
            cloud and cloud shadow
@@ -429,8 +664,12 @@ class Fmask:
             np.ndarray: Mask containing cloud segmentation(value 1)
                         and cloud shadow (value 2)
         """
-        # Open .tif
-        bands = read_bands(tif_file)
+        # Open .tif, reading only the bands used
+        bands = read_band_stack(
+            tif_file,
+            list(self.sentinel_band_indexes),
+            default_indexes=list(self.sentinel_band_indexes.values()),
+        )
 
         # # Extract each band landsat
         # B1 = bands[0]
@@ -446,12 +685,12 @@ class Fmask:
         # vza_band = bands[12]
 
         # Extract each band sentinel
-        B2 = bands[1] * self.scale_factor  # Blue
-        B3 = bands[2] * self.scale_factor  # Green
-        B4 = bands[3] * self.scale_factor  # Red
-        B8 = bands[7] * self.scale_factor  # NIR
-        B11 = bands[10] * self.scale_factor  # SWIR 1
-        B12 = bands[11] * self.scale_factor  # SWIR 2
+        B2 = bands[0] * self.scale_factor  # Blue
+        B3 = bands[1] * self.scale_factor  # Green
+        B4 = bands[2] * self.scale_factor  # Red
+        B8 = bands[3] * self.scale_factor  # NIR
+        B11 = bands[4] * self.scale_factor  # SWIR 1
+        B12 = bands[5] * self.scale_factor  # SWIR 2
 
         # rgb = [B4/np.max(B4), B3/np.max(B3), B2/np.max(B2)]
 
@@ -462,29 +701,12 @@ class Fmask:
         # plt.show()
 
         # Calculate the necessary indices
-        ndvi, modified_ndvi = calculate_ndvi(red=B4, nir=B8)
         ndwi = calculate_ndwi(green=B3, nir=B8)
 
-        ndsi, modified_ndsi = calculate_ndsi(green=B3, swir1=B11)
-        bt = B12 - 273.15
-        whiteness, whiteness_test = self.whiteness_test(red=B4, green=B3, blue=B2)
-        water_test = self.water_test(ndvi=ndvi, nir=B8)
-
-        # Get cloud mask
-        cloud_mask = self.detect_clouds(
-            blue=B2,
-            red=B4,
-            nir=B8,
-            swir1=B11,
-            swir2=B12,
-            bt=bt,
-            ndvi=ndvi,
-            ndsi=ndsi,
-            modified_ndvi=modified_ndvi,
-            modified_ndsi=modified_ndsi,
-            whiteness=whiteness,
-            whiteness_test=whiteness_test,
-            water=water_test,
+        # Get cloud mask (pass one, pass two is disabled in detect_clouds)
+        # and the water test with the fused kernel
+        cloud_mask, water_test = self.pass_one_and_water_test(
+            blue=B2, green=B3, red=B4, nir=B8, swir1=B11, swir2=B12
         )
 
         # plt.figure()
@@ -500,13 +722,81 @@ class Fmask:
         water_mask = Image.fromarray(water_mask).filter(ImageFilter.MaxFilter(size=3))
         # return ndwi, cloud_mask, shadow_mask
         return (
-            np.transpose(np.array([bands[3], bands[2], bands[1]]), [1, 2, 0]),
+            np.transpose(np.array([bands[2], bands[1], bands[0]]), [1, 2, 0]),
             cloud_mask,
             shadow_mask,
             water_mask,
         )
 
 
+def is_up_to_date(input_file: str, output_files: list) -> bool:
+    """Check if every output exists and is newer than the input
+
+    Args:
+        input_file (str): File the outputs are generated from
+        output_files (list): Generated files
+
+    Returns:
+        bool: True if the outputs do not need to be regenerated
+    """
+    input_mtime = os.path.getmtime(input_file)
+    return all(
+        os.path.exists(output) and os.path.getmtime(output) >= input_mtime
+        for output in output_files
+    )
+
+
+def process_single_scene(args) -> dict:
+    """Create and save the Fmask mask and overlay plot of one scene
+
+    A top-level function so it can be submitted to a process pool.
+
+    Args:
+        args (tuple): (tif_file, mask_file, plot_file, scale_factor, tiled,
+                       block_size, skip_existing)
+
+    Returns:
+        dict: scene path, elapsed seconds and whether it was skipped
+    """
+    tif_file, mask_file, plot_file, scale_factor, tiled, block_size, skip_existing = args
+    start = time.perf_counter()
+
+    if skip_existing and is_up_to_date(tif_file, [mask_file, plot_file]):
+        return {"scene": tif_file, "seconds": 0.0, "skipped": True}
+
+    fmask = Fmask(scale_factor=scale_factor)
+
+    if tiled:
+        # The mask is written block by block, the plot uses a decimated preview
+        fmask.create_fmask_tiled(tif_file, output_file=mask_file, block_size=block_size)
+        color_composite, masks = read_mask_preview(tif_file, mask_file)
+        save_overlayed_mask_plot(masks, color_composite, output_file=plot_file)
+    else:
+        color_composite, cloud_mask, shadow_mask, water_mask = fmask.create_fmask(
+            tif_file
+        )
+
+        save_overlayed_mask_plot(
+            [cloud_mask, shadow_mask, water_mask],
+            color_composite,
+            output_file=plot_file,
+        )
+
+        save_mask_tif(
+            cloud_mask=cloud_mask,
+            cloud_shadow_mask=shadow_mask,
+            water_mask=water_mask,
+            original_tif_file=tif_file,
+            output_file=mask_file,
+        )
+
+    return {
+        "scene": tif_file,
+        "seconds": time.perf_counter() - start,
+        "skipped": False,
+    }
+
+
 if __name__ == "__main__":
     import os
 
@@ -0,0 +1,103 @@
+"""Micro-benchmark of the Fmask pass-one and water tests.
+
+Compares the separate methods (whiteness_test, pass_one, water_test and the
+ndvi/ndsi helpers) with the fused Fmask.pass_one_and_water_test kernel, in
+float64 and float32, on a synthetic Sentinel-2 tile. Reports the time, the
+peak memory traced by numpy and the number of pixels that differ from the
+reference masks.
+
+example:
+$ PYTHONPATH=src python -m utils.fmask.benchmark --size 10980
+$ PYTHONPATH=src python -m utils.fmask.benchmark --size 2048 --repeat 3
+"""
+
+import argparse
+import logging
+import time
+import tracemalloc
+
+import numpy as np
+
+from utils.fmask.Fmask import Fmask
+from utils.fmask.fmask_utils import calculate_ndsi, calculate_ndvi
+
+logger = logging.getLogger(__name__)
+
+
+def synthetic_tile(size: int = 10980, scale_factor: float = 0.0001, seed: int = 0):
+    """Scaled blue, green, red, nir, swir1 and swir2 bands of a random tile."""
+    rng = np.random.default_rng(seed)
+    return {
+        name: rng.integers(0, 10000, size=(size, size), dtype=np.uint16)
+        * scale_factor
+        for name in ["blue", "green", "red", "nir", "swir1", "swir2"]
+    }
+
+
+def reference_tests(fmask: Fmask, bands: dict) -> tuple:
+    """Pass one and water test computed with the separate methods."""
+    ndvi, _ = calculate_ndvi(red=bands["red"], nir=bands["nir"])
+    ndsi, _ = calculate_ndsi(green=bands["green"], swir1=bands["swir1"])
+    _, whiteness_test = fmask.whiteness_test(
+        red=bands["red"], green=bands["green"], blue=bands["blue"]
+    )
+    pcp = fmask.pass_one(
+        blue=bands["blue"],
+        red=bands["red"],
+        nir=bands["nir"],
+        swir1=bands["swir1"],
+        swir2=bands["swir2"],
+        bt=bands["swir2"] - 273.15,
+        ndvi=ndvi,
+        ndsi=ndsi,
+        whiteness_test=whiteness_test,
+    )
+    return pcp, fmask.water_test(ndvi=ndvi, nir=bands["nir"])
+
+
+def measure(func, repeat: int = 1) -> tuple:
+    """Best time (s) and peak traced memory (MB) of func, and its result."""
+    times = []
+    for _ in range(repeat):
+        tracemalloc.start()
+        start = time.perf_counter()
+        result = func()
+        times.append(time.perf_counter() - start)
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    return min(times), peak / 1024**2, result
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--size", type=int, default=10980)
+    parser.add_argument("--repeat", type=int, default=1)
+    args = parser.parse_args()
+
+    fmask = Fmask(scale_factor=0.0001)
+    bands = synthetic_tile(args.size)
+
+    candidates = {
+        "reference (separate methods)": lambda: reference_tests(fmask, bands),
+        "fused float64": lambda: fmask.pass_one_and_water_test(**bands),
+        "fused float32": lambda: fmask.pass_one_and_water_test(
+            **bands, dtype=np.float32
+        ),
+    }
+
+    reference = None
+    logger.info(f"Tile: {args.size}x{args.size}")
+    for name, func in candidates.items():
+        seconds, peak_mb, (pcp, water) = measure(func, args.repeat)
+        if reference is None:
+            reference = (pcp, water)
+        mismatches = np.count_nonzero(pcp != reference[0]) + np.count_nonzero(
+            water != reference[1]
+        )
+        logger.info(
+            f"{name:30s} {seconds:8.2f} s  peak {peak_mb:9.1f} MB  "
+            f"differing pixels: {mismatches}"
+        )
+        del pcp, water
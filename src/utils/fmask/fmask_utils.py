@@ -5,9 +5,14 @@ import matplotlib.pyplot as plt
 import numpy as np
 import rasterio
 from matplotlib.patches import Patch
+from rasterio.enums import Resampling
+from rasterio.windows import Window
 from PIL import Image, ImageDraw
 from segmentation_mask_overlay import overlay_masks
 
+from utils.raster_io.band_reader import band_indexes
+from utils.raster_io.cog import write_raster
+
 
 def calculate_ndvi(red: np.ndarray, nir: np.ndarray) -> tuple[np.ndarray]:
     """Calculate the NDVI spectral indice by: nir-red/nir+red
@@ -153,10 +158,7 @@ def save_one_band_tif(self, band: np.ndarray, tif_file: str, output_file: str) -
     """
 
     with rasterio.open(tif_file) as src:
-        profile = src.profile
-        profile.update(count=1)
-        with rasterio.open(output_file, "w", **profile) as dst:
-            dst.write(band, 1)
+        write_raster(output_file, band, src.profile, count=1)
 
 
 def save_overlayed_mask_plot(
@@ -209,6 +211,28 @@ def save_overlayed_mask_plot(
     gc.collect()
 
 
+def compose_mask(
+    cloud_mask: np.ndarray, cloud_shadow_mask: np.ndarray, water_mask: np.ndarray
+) -> np.ndarray:
+    """Merge the masks in a single band: cloud 1, cloud shadow 2 and water 3
+
+    Args:
+        cloud_mask (np.ndarray): Cloud mask
+        cloud_shadow_mask (np.ndarray): Cloud shadow mask
+        water_mask (np.ndarray): Water mask, may be a PIL image
+
+    Returns:
+        np.ndarray: int8 mask, clouds take precedence over shadows and water
+    """
+    mask_final = np.zeros_like(cloud_mask).astype(np.int8)
+
+    mask_final[np.asarray(water_mask) == 1] = 3
+    mask_final[np.asarray(cloud_shadow_mask) == 1] = 2
+    mask_final[np.asarray(cloud_mask) == 1] = 1
+
+    return mask_final
+
+
 def save_mask_tif(
     cloud_mask: np.ndarray,
     cloud_shadow_mask: np.ndarray,
@@ -224,28 +248,21 @@ def save_mask_tif(
         output_file (str): _description_
     """
 
-    mask_final = np.zeros_like(cloud_mask).astype(np.int8)
-
-    mask_final[water_mask == 1] = 3
-    mask_final[cloud_shadow_mask == 1] = 2
-    mask_final[cloud_mask == 1] = 1
+    mask_final = compose_mask(cloud_mask, cloud_shadow_mask, water_mask)
 
     # os.makedirs("/".join(output_file.split("/")[:-1]), exist_ok=True)
 
     with rasterio.open(original_tif_file) as src:
         profile = src.profile
-        profile.update(count=1)
-        with rasterio.open(output_file, "w", **profile) as dst:
-            dst.write(mask_final, 1)
+        write_raster(output_file, mask_final, profile, count=1)
 
-            del cloud_mask
-            del cloud_shadow_mask
-            del water_mask
-            del mask_final
-            del profile
-            del dst
+        del cloud_mask
+        del cloud_shadow_mask
+        del water_mask
+        del mask_final
+        del profile
 
-            gc.collect()
+        gc.collect()
 
 
 def read_bands(tif_file: str) -> np.ndarray:
@@ -261,3 +278,66 @@ def read_bands(tif_file: str) -> np.ndarray:
         bands = src.read()
 
     return bands
+
+
+def iter_block_windows(height: int, width: int, block_size: int, halo: int = 0):
+    """Split a raster in square blocks
+
+    Args:
+        height (int): Raster height
+        width (int): Raster width
+        block_size (int): Side of the blocks
+        halo (int): Pixels read around each block, clipped to the raster
+
+    Yields:
+        tuple: (block window, window with halo, block position inside the halo window)
+    """
+    for row_off in range(0, height, block_size):
+        for col_off in range(0, width, block_size):
+            block = Window(
+                col_off,
+                row_off,
+                min(block_size, width - col_off),
+                min(block_size, height - row_off),
+            )
+            row_start, col_start = max(row_off - halo, 0), max(col_off - halo, 0)
+            row_stop = min(row_off + block.height + halo, height)
+            col_stop = min(col_off + block.width + halo, width)
+            read_window = Window(
+                col_start, row_start, col_stop - col_start, row_stop - row_start
+            )
+            inner = (
+                slice(row_off - row_start, row_off - row_start + block.height),
+                slice(col_off - col_start, col_off - col_start + block.width),
+            )
+            yield block, read_window, inner
+
+
+def read_mask_preview(
+    original_tif_file: str, mask_tif_file: str, max_size: int = 2048
+) -> tuple:
+    """Read a decimated color composite and masks to plot large scenes
+
+    Args:
+        original_tif_file (str): Scene used to create the mask
+        mask_tif_file (str): Mask saved by save_mask_tif or Fmask.create_fmask_tiled
+        max_size (int): Largest side of the preview
+
+    Returns:
+        tuple: color composite (red, green, blue) and [cloud, shadow, water] masks
+    """
+    with rasterio.open(mask_tif_file) as src:
+        factor = max(1, int(np.ceil(max(src.height, src.width) / max_size)))
+        out_shape = (max(1, src.height // factor), max(1, src.width // factor))
+        mask = src.read(1, out_shape=out_shape, resampling=Resampling.nearest)
+
+    with rasterio.open(original_tif_file) as src:
+        indexes = band_indexes(
+            src, ["red", "green", "blue"], default_indexes=[4, 3, 2]
+        )
+        color_composite = src.read(
+            indexes, out_shape=(3, *out_shape), resampling=Resampling.nearest
+        )
+
+    masks = [mask == 1, mask == 2, mask == 3]
+    return np.transpose(color_composite, [1, 2, 0]), masks
@@ -38,15 +38,30 @@ def calculate_metrics_regression_by_month(
     )
 
 
-    # Extrair vetores
-    y_true = df_merged[col_real].values
-    y_pred = df_merged[col_pred].values
-
     # Cálculo dos erros ponto a ponto
-    df_erros = df_merged.copy()
+    df_erros = add_pointwise_errors(df_merged, col_real, col_pred)
+
+    return regression_metrics(df_erros, col_real, col_pred), df_erros
+
+
+def add_pointwise_errors(
+    df: pd.DataFrame, col_real: str, col_pred: str
+) -> pd.DataFrame:
+    """Cópia de df com os erros absoluto, quadrático e percentual de cada linha"""
+    y_true = df[col_real].values
+    y_pred = df[col_pred].values
+
+    df_erros = df.copy()
     df_erros["erro_absoluto"] = np.abs(y_true - y_pred)
     df_erros["erro_quadrado"] = (y_true - y_pred) ** 2
     df_erros["erro_percentual"] = np.abs((y_true - y_pred) / y_true) * 100
+    return df_erros
+
+
+def regression_metrics(df_erros: pd.DataFrame, col_real: str, col_pred: str) -> dict:
+    """MAE, MSE, RMSE, MAPE, R² e Pearson dos erros de add_pointwise_errors"""
+    y_true = df_erros[col_real].values
+    y_pred = df_erros[col_pred].values
 
     # Métricas globais
     mae = df_erros["erro_absoluto"].mean()
@@ -65,4 +80,32 @@ def calculate_metrics_regression_by_month(
         "Pearson": corr_pearson,
     }
 
-    return metricas, df_erros
+    return metricas
+
+
+def calculate_metrics_regression_by_group(
+    df_real: pd.DataFrame,
+    df_pred: pd.DataFrame,
+    col_real: str,
+    col_pred: str,
+    on: list,
+    by: str,
+) -> tuple[pd.DataFrame, pd.DataFrame]:
+    """
+    Métricas de calculate_metrics_regression_by_month para cada grupo de
+    df_pred (ex: threshold), com um único merge e os erros vetorizados.
+
+    Retorna:
+    - DataFrame com as métricas de cada grupo (coluna by ao final).
+    - DataFrame com a coluna by, real, previsto e os erros ponto a ponto.
+    """
+    df_merged = pd.merge(
+        df_real[on + [col_real]], df_pred[[by] + on + [col_pred]], on=on, how="inner"
+    )
+    df_erros = add_pointwise_errors(df_merged, col_real, col_pred)
+
+    metrics = [
+        {**regression_metrics(group, col_real, col_pred), by: key}
+        for key, group in df_erros.groupby(by, sort=True)
+    ]
+    return pd.DataFrame(metrics), df_erros
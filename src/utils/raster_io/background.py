@@ -0,0 +1,85 @@
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+# Escrita dos mapas de probabilidade: na hora, em segundo plano ou nenhuma
+# (só com a área calculada em memória)
+WRITE_MODES = ("sync", "async", "none")
+
+
+class BackgroundWriter:
+    """Run raster writes in a background thread
+
+    The inference of the next scene overlaps the compression and write of
+    the previous one (GDAL releases the GIL while writing). At most
+    max_pending writes are queued, so only a few maps wait in memory; the
+    first write error is raised by submit or close.
+    """
+
+    def __init__(self, max_pending: int = 2):
+        self.executor = ThreadPoolExecutor(max_workers=1)
+        self.slots = threading.BoundedSemaphore(max_pending)
+        self.futures = []
+
+    def submit(self, func, *args, **kwargs) -> None:
+        self._raise_errors()
+        self.slots.acquire()
+        future = self.executor.submit(func, *args, **kwargs)
+        future.add_done_callback(lambda _: self.slots.release())
+        self.futures.append(future)
+
+    def _raise_errors(self) -> None:
+        pending = []
+        for future in self.futures:
+            if future.done():
+                future.result()
+            else:
+                pending.append(future)
+        self.futures = pending
+
+    def close(self) -> None:
+        """Wait for every queued write"""
+        self.executor.shutdown(wait=True)
+        for future in self.futures:
+            future.result()
+        self.futures = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class WaterMapSink:
+    """Destination of the water maps of a segmentation run
+
+    Every map is first handed to the area estimator, if any (fused
+    inference-to-area mode, see StreamingAreaEstimator), and then saved with
+    save(probabilities, image_path, save_path) according to write_mode:
+    sync, async (BackgroundWriter) or none.
+    """
+
+    def __init__(self, save, write_mode: str = "sync", area_estimator=None):
+        if write_mode not in WRITE_MODES:
+            raise ValueError(f"Unknown write mode {write_mode}, use {WRITE_MODES}")
+        self.save = save
+        self.write_mode = write_mode
+        self.area_estimator = area_estimator
+        self.writer = BackgroundWriter() if write_mode == "async" else None
+
+    def put(self, probabilities, image_path: str, save_path: str) -> None:
+        if self.area_estimator is not None:
+            self.area_estimator.add(image_path, save_path, probabilities)
+
+        if self.write_mode == "sync":
+            self.save(probabilities, image_path, save_path)
+        elif self.write_mode == "async":
+            self.writer.submit(self.save, probabilities, image_path, save_path)
+
+    def close(self) -> None:
+        """Wait for the background writes"""
+        if self.writer is not None:
+            self.writer.close()
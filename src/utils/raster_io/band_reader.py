@@ -0,0 +1,127 @@
+import logging
+import os
+
+import numpy as np
+import rasterio
+
+from utils.download.bands import get_original_bands_name, original_band_name
+from utils.scene_catalog.scene_catalog import KNOWN_SATELLITES
+
+logger = logging.getLogger(__name__)
+
+
+def scene_sensor(file_name: str) -> tuple:
+    """Satellite and level of an image from its name
+
+    The names follow {prefix}_{satellite}_{location}_{date}.tif, the prefix of
+    the TOA images contains TOA (sentinel_6B_TOA, landsat_6B_TOA).
+
+    Returns:
+        tuple: (satellite, is_toa), satellite is None when it is not found
+    """
+    tokens = os.path.basename(str(file_name)).split(".")[0].split("_")
+    satellite = None
+    for i, token in enumerate(tokens):
+        if token == "S2":
+            satellite = "S2_SR" if tokens[i + 1 : i + 2] == ["SR"] else "S2"
+            break
+        if token in KNOWN_SATELLITES:
+            satellite = token
+            break
+    return satellite, "TOA" in tokens
+
+
+def stack_band_names(
+    src, satellite: str = None, is_toa: bool = False, selected_bands: list = None
+) -> list:
+    """GEE names of the bands of a stack, in order
+
+    Taken from the band descriptions (written by GEE and kept by the COG
+    writers), or from the selected_bands of the download when the file has
+    none. None when neither is available.
+    """
+    if all(src.descriptions):
+        return list(src.descriptions)
+    if selected_bands and satellite:
+        names = get_original_bands_name(satellite, selected_bands, is_toa)
+        if len(names) == src.count:
+            return names
+    return None
+
+
+def band_indexes(
+    src,
+    bands: list,
+    satellite: str = None,
+    is_toa: bool = None,
+    selected_bands: list = None,
+    default_indexes: list = None,
+) -> list:
+    """Rasterio (1-based) indexes of logical bands (blue, nir, QA_PIXEL, ...)
+
+    Args:
+        src: rasterio dataset
+        bands (list): Logical band names, as in the download selected_bands
+        satellite (str): S2, S2_SR or the Landsat id, from the file name when None
+        is_toa (bool): Level of the image, from the file name when None
+        selected_bands (list): Bands of the download, used when the file has no
+                               band descriptions
+        default_indexes (list): Indexes used when the bands are not found
+
+    Returns:
+        list: index of each band in src
+    """
+    name_satellite, name_is_toa = scene_sensor(src.name)
+    satellite = satellite or name_satellite
+    is_toa = name_is_toa if is_toa is None else is_toa
+
+    names = stack_band_names(src, satellite, is_toa, selected_bands)
+    if names is not None and satellite is not None:
+        wanted = [original_band_name(satellite, band, is_toa) or band for band in bands]
+        if all(name in names for name in wanted):
+            return [names.index(name) + 1 for name in wanted]
+
+    if default_indexes is None:
+        raise ValueError(f"Bands {bands} not found in {src.name} (bands: {names})")
+
+    logger.debug(f"Bands of {src.name} unknown, using the indexes {default_indexes}")
+    return list(default_indexes)
+
+
+def read_band_stack(
+    image,
+    bands: list,
+    satellite: str = None,
+    is_toa: bool = None,
+    selected_bands: list = None,
+    default_indexes: list = None,
+    window=None,
+) -> np.ndarray:
+    """Read only the requested bands of an image
+
+    Only the selected bands are decoded (src.read(indexes=...)), instead of
+    reading the whole stack and indexing it.
+
+    Args:
+        image: Path of the image or an opened rasterio dataset
+        bands (list): Logical band names (blue, green, red, nir, swir1, ...)
+        satellite (str): S2, S2_SR or the Landsat id, from the file name when None
+        is_toa (bool): Level of the image, from the file name when None
+        selected_bands (list): Bands of the download, used when the file has no
+                               band descriptions
+        default_indexes (list): 1-based indexes used when the bands are not found
+        window (rasterio.windows.Window): Part of the image to read
+
+    Returns:
+        np.ndarray: (len(bands), rows, cols) array, in the order of bands
+    """
+    if isinstance(image, (str, os.PathLike)):
+        with rasterio.open(image) as src:
+            return read_band_stack(
+                src, bands, satellite, is_toa, selected_bands, default_indexes, window
+            )
+
+    indexes = band_indexes(
+        image, bands, satellite, is_toa, selected_bands, default_indexes
+    )
+    return image.read(indexes, window=window)
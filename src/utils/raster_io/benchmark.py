@@ -0,0 +1,150 @@
+"""Disk footprint and read time of the raster output profiles.
+
+Writes the same synthetic float32 water probability map with the legacy
+profile (striped, uncompressed copy of src.profile), as COGs (write_raster)
+with DEFLATE and ZSTD and as quantized uint16 / uint8 COGs, then times the area estimation of a reservoir sized
+ROI in the middle of the scene (process_single_mask: windowed read of the
+ROI and the threshold areas). Reports the file size, the write time,
+the best read time and whether the areas match the legacy file.
+
+example:
+$ PYTHONPATH=src python -m utils.raster_io.benchmark --size 10980
+$ PYTHONPATH=src python -m utils.raster_io.benchmark --size 4096 --repeat 5
+"""
+
+import argparse
+import logging
+import os
+import tempfile
+import time
+
+import geopandas as gpd
+import numpy as np
+import rasterio
+from rasterio.transform import from_origin
+from shapely.geometry import box
+
+from utils.area_and_volume_estimation.water import process_single_mask
+from utils.raster_io.cog import write_raster
+from utils.raster_io.quantization import write_probability_map
+
+logger = logging.getLogger(__name__)
+
+THRESHOLDS = [0.05, 0.25, 0.5, 0.75, 0.95]
+
+
+def synthetic_probability_map(size: int = 10980, seed: int = 0) -> np.ndarray:
+    """Water probabilities like the soft thresholded model outputs: a few lakes
+    and coarse noise, saturated towards 0 and 1 by a sigmoid."""
+    rng = np.random.default_rng(seed)
+    rows, cols = np.ogrid[:size, :size]
+    water = np.zeros((size, size), dtype=np.float32)
+    for _ in range(8):
+        r, c = rng.integers(0, size, 2)
+        radius = rng.integers(size // 40, size // 10)
+        water += np.exp(-((rows - r) ** 2 + (cols - c) ** 2) / (2.0 * radius**2))
+    coarse = rng.normal(0, 0.1, (size // 8 + 1, size // 8 + 1)).astype(np.float32)
+    water += np.kron(coarse, np.ones((8, 8), dtype=np.float32))[:size, :size]
+    return (1.0 / (1 + np.exp(-16 * (water - 0.5)))).astype(np.float32)
+
+
+def source_profile(size: int) -> dict:
+    """Striped profile of a Sentinel-2 tile downloaded from GEE (10 m)."""
+    resolution = 10 / 111319.49079327357
+    return {
+        "driver": "GTiff",
+        "width": size,
+        "height": size,
+        "count": 1,
+        "dtype": "float32",
+        "crs": "EPSG:4326",
+        "transform": from_origin(-38.5, -6.9, resolution, resolution),
+        "nodata": None,
+    }
+
+
+def write_roi(profile: dict, path: str, fraction: float = 0.1) -> None:
+    """GeoJSON of a square ROI covering fraction of the scene side, centered."""
+    transform, size = profile["transform"], profile["width"]
+    center = size / 2
+    half = size * fraction / 2
+    min_x, max_y = transform * (center - half, center - half)
+    max_x, min_y = transform * (center + half, center + half)
+    gpd.GeoDataFrame(
+        geometry=[box(min_x, min_y, max_x, max_y)], crs=profile["crs"]
+    ).to_file(path, driver="GeoJSON")
+
+
+def measure(func, repeat: int = 1) -> tuple:
+    """Best time (s) of func and its result."""
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        times.append(time.perf_counter() - start)
+    return min(times), result
+
+
+def write_legacy(path: str, data: np.ndarray, profile: dict) -> None:
+    """Writer used before the COG layer: src.profile with count/dtype only."""
+    with rasterio.open(path, "w", **profile) as dst:
+        dst.write(data, 1)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--size", type=int, default=10980)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--roi-fraction", type=float, default=0.1)
+    args = parser.parse_args()
+
+    data = synthetic_probability_map(args.size)
+    profile = source_profile(args.size)
+
+    candidates = {
+        "legacy (striped, uncompressed)": lambda path: write_legacy(
+            path, data, profile
+        ),
+        "COG deflate": lambda path: write_raster(
+            path, data, profile, overview_resampling="average"
+        ),
+        "COG zstd": lambda path: write_raster(
+            path, data, profile, overview_resampling="average", compress="zstd"
+        ),
+        "COG uint16 (quantized)": lambda path: write_probability_map(
+            path, data, profile, encoding="uint16", thresholds=THRESHOLDS
+        ),
+        "COG uint8 (quantized)": lambda path: write_probability_map(
+            path, data, profile, encoding="uint8", thresholds=THRESHOLDS
+        ),
+    }
+
+    logger.info(f"Scene: {args.size}x{args.size}, ROI: {args.roi_fraction:.0%}")
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        roi_path = os.path.join(tmp_dir, "roi.geojson")
+        write_roi(profile, roi_path, args.roi_fraction)
+
+        reference = None
+        for i, (name, write) in enumerate(candidates.items()):
+            path = os.path.join(tmp_dir, f"candidate_{i}_20240101.tif")
+            try:
+                write_seconds, _ = measure(lambda: write(path))
+            except rasterio.errors.RasterioError as e:
+                logger.info(f"{name:32s} not available: {e}")
+                continue
+
+            read_seconds, results = measure(
+                lambda: process_single_mask((path, roi_path, THRESHOLDS)),
+                args.repeat,
+            )
+            areas = [r["m2_area"] for r in results]
+            if reference is None:
+                reference = areas
+
+            logger.info(
+                f"{name:32s} {os.path.getsize(path) / 1024**2:9.1f} MB  "
+                f"write {write_seconds:6.2f} s  area {read_seconds:6.3f} s  "
+                f"same areas: {areas == reference}"
+            )
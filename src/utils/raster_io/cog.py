@@ -0,0 +1,234 @@
+import logging
+import os
+import tempfile
+from contextlib import contextmanager
+
+import numpy as np
+import rasterio
+from rasterio.enums import Resampling
+from rasterio.env import GDALVersion
+from rasterio.shutil import copy as copy_dataset
+
+logger = logging.getLogger(__name__)
+
+# DEFLATE é lido por qualquer GDAL e pelo tifffile sem imagecodecs,
+# ZSTD comprime mais rápido mas depende do build do GDAL
+COMPRESSION = "deflate"
+
+# Lado dos blocos internos (múltiplo de 16)
+BLOCK_SIZE = 512
+
+COG_PREDICTORS = {1: "NO", 2: "STANDARD", 3: "FLOATING_POINT"}
+
+
+def predictor_for(dtype) -> int:
+    """TIFF predictor of a dtype: 3 for floats, 2 for integers wider than a
+    byte and 1 (none) for bytes, where differencing does not help.
+    """
+    dtype = np.dtype(dtype)
+    if np.issubdtype(dtype, np.floating):
+        return 3
+    if dtype.itemsize > 1:
+        return 2
+    return 1
+
+
+def tifffile_predictor(dtype) -> int:
+    """Predictor of rasters also read with tifffile, which does not decode the
+    floating point predictor without imagecodecs (clean images).
+    """
+    return 1 if np.issubdtype(np.dtype(dtype), np.floating) else predictor_for(dtype)
+
+
+def tiled_profile(
+    profile: dict,
+    compress: str = COMPRESSION,
+    block_size: int = BLOCK_SIZE,
+    **updates,
+) -> dict:
+    """Copy of a source profile for an internally tiled, compressed GeoTIFF
+
+    Args:
+        profile (dict): Profile of the source raster (src.profile)
+        compress (str): deflate, zstd, lzw or None
+        block_size (int): Side of the internal tiles
+        **updates: Changes to the profile (count, dtype, nodata, ...)
+
+    Returns:
+        dict: profile for rasterio.open(path, "w", **profile)
+    """
+    profile = dict(profile)
+    profile.update(updates)
+    # perfis de origem em faixas (striped) trazem blocos de 1 linha
+    for key in ("blockxsize", "blockysize", "tiled", "compress", "predictor"):
+        profile.pop(key, None)
+
+    profile.update(
+        driver="GTiff",
+        tiled=True,
+        blockxsize=block_size,
+        blockysize=block_size,
+        BIGTIFF="IF_SAFER",
+    )
+    if compress:
+        profile.update(compress=compress, predictor=predictor_for(profile["dtype"]))
+    return profile
+
+
+def translate_to_cog(
+    src_path: str,
+    output_file: str,
+    compress: str = COMPRESSION,
+    block_size: int = BLOCK_SIZE,
+    overview_resampling: str = "nearest",
+    predictor: int = None,
+) -> None:
+    """Copy a GeoTIFF to output_file as a Cloud-Optimized GeoTIFF
+
+    Uses the GDAL COG driver (GDAL >= 3.1), which builds the overviews and
+    writes them before the full resolution tiles. On older GDAL the overviews
+    are built in src_path and copied with COPY_SRC_OVERVIEWS. The COG is
+    written to a temporary file and renamed over output_file.
+    """
+    output_file = str(output_file)
+    tmp_file = f"{output_file}.part"
+
+    if not compress:
+        predictor = 1
+    elif predictor is None:
+        with rasterio.open(src_path) as src:
+            predictor = predictor_for(src.dtypes[0])
+
+    options = {"BIGTIFF": "IF_SAFER"}
+    if compress:
+        options["COMPRESS"] = compress.upper()
+
+    if GDALVersion.runtime().at_least("3.1"):
+        copy_dataset(
+            src_path,
+            tmp_file,
+            driver="COG",
+            BLOCKSIZE=block_size,
+            PREDICTOR=COG_PREDICTORS[predictor],
+            OVERVIEW_RESAMPLING=overview_resampling.upper(),
+            **options,
+        )
+    else:
+        with rasterio.open(src_path, "r+") as src:
+            factors = []
+            factor = 2
+            while max(src.width, src.height) / factor >= block_size:
+                factors.append(factor)
+                factor *= 2
+            src.build_overviews(factors, Resampling[overview_resampling])
+        copy_dataset(
+            src_path,
+            tmp_file,
+            driver="GTiff",
+            TILED="YES",
+            BLOCKXSIZE=block_size,
+            BLOCKYSIZE=block_size,
+            COPY_SRC_OVERVIEWS="YES",
+            PREDICTOR=predictor,
+            **options,
+        )
+
+    os.replace(tmp_file, output_file)
+
+
+@contextmanager
+def open_cog(
+    output_file: str,
+    profile: dict,
+    compress: str = COMPRESSION,
+    block_size: int = BLOCK_SIZE,
+    overview_resampling: str = "nearest",
+    predictor: int = None,
+    **updates,
+):
+    """Open a raster for writing that becomes a COG when closed
+
+    The dataset is a tiled, uncompressed temporary GeoTIFF, so writers that
+    write block by block (window=...) work unchanged; when the context exits
+    it is translated to output_file with translate_to_cog.
+
+    Args:
+        output_file (str): Path of the COG
+        profile (dict): Profile of the source raster (src.profile)
+        compress (str): deflate, zstd, lzw or None
+        block_size (int): Side of the internal tiles
+        overview_resampling (str): nearest for masks and classes, average for
+                                   probabilities and indices
+        predictor (int): TIFF predictor, chosen by dtype (predictor_for) when
+                         None
+        **updates: Changes to the profile (count, dtype, nodata, ...), scales,
+                   offsets and descriptions (band names) of the bands are set
+                   on the dataset
+
+    Yields:
+        rasterio.io.DatasetWriter
+    """
+    output_file = str(output_file)
+    directory = os.path.dirname(output_file) or "."
+    os.makedirs(directory, exist_ok=True)
+
+    scales = updates.pop("scales", None)
+    offsets = updates.pop("offsets", None)
+    descriptions = updates.pop("descriptions", None)
+
+    profile = tiled_profile(profile, compress=None, block_size=block_size, **updates)
+    fd, tmp_file = tempfile.mkstemp(dir=directory, suffix=".tif")
+    os.close(fd)
+    try:
+        with rasterio.open(tmp_file, "w", **profile) as dst:
+            if scales is not None:
+                dst.scales = scales
+            if offsets is not None:
+                dst.offsets = offsets
+            if descriptions is not None and any(descriptions):
+                dst.descriptions = descriptions
+            yield dst
+
+        translate_to_cog(
+            tmp_file,
+            output_file,
+            compress=compress,
+            block_size=block_size,
+            overview_resampling=overview_resampling,
+            predictor=predictor,
+        )
+    finally:
+        os.remove(tmp_file)
+
+
+def write_raster(
+    output_file: str,
+    data: np.ndarray,
+    profile: dict,
+    overview_resampling: str = "nearest",
+    predictor: int = None,
+    **updates,
+) -> None:
+    """Write a (bands, rows, cols) or (rows, cols) array as a COG
+
+    Args:
+        output_file (str): Path of the COG
+        data (np.ndarray): Raster values
+        profile (dict): Profile of the source raster (src.profile)
+        overview_resampling (str): Resampling of the overviews
+        predictor (int): TIFF predictor, chosen by dtype when None
+        **updates: Changes to the profile (count, dtype, nodata, ...)
+    """
+    data = np.asarray(data)
+    if data.ndim == 2:
+        data = data[np.newaxis]
+    updates.setdefault("count", data.shape[0])
+
+    with open_cog(
+        output_file,
+        profile,
+        overview_resampling=overview_resampling,
+        predictor=predictor,
+        **updates,
+    ) as dst:
+        dst.write(data.astype(dst.dtypes[0], copy=False))
@@ -0,0 +1,143 @@
+import logging
+
+import numpy as np
+
+from utils.raster_io.cog import write_raster
+
+logger = logging.getLogger(__name__)
+
+# Codificações dos mapas de probabilidade, o maior valor do inteiro é o nodata
+ENCODINGS = ("float32", "uint8", "uint16")
+
+
+def encoding_parameters(encoding: str) -> tuple:
+    """(scale, offset, nodata) of a quantized encoding: codes 0..max-1 map
+    linearly to the probabilities 0..1 and max is nodata.
+    """
+    nodata = np.iinfo(encoding).max
+    return 1.0 / (nodata - 1), 0.0, nodata
+
+
+def decode(codes: np.ndarray, scale: float, offset: float, nodata=None) -> np.ndarray:
+    """float32 values of quantized codes, NaN where the code is nodata"""
+    values = codes.astype(np.float32) * np.float32(scale) + np.float32(offset)
+    if nodata is not None:
+        values[codes == nodata] = np.nan
+    return values
+
+
+def is_quantized(src) -> bool:
+    """True if the first band of a rasterio dataset has a scale or offset"""
+    return src.scales[0] != 1 or src.offsets[0] != 0
+
+
+def read_values(src, data: np.ndarray = None, **kwargs) -> np.ndarray:
+    """Values of the first band of src, decoded when it is quantized
+
+    Args:
+        src: rasterio dataset
+        data (np.ndarray): Codes already read from src (e.g. reprojected or
+                           cropped), read with src.read(1, **kwargs) when None
+
+    Returns:
+        np.ndarray: the band as stored, or float32 probabilities with NaN for
+                    nodata when the band is quantized
+    """
+    if data is None:
+        data = src.read(1, **kwargs)
+    if not is_quantized(src):
+        return data
+    return decode(data, src.scales[0], src.offsets[0], src.nodata)
+
+
+def quantize(
+    probabilities: np.ndarray, encoding: str = "uint8", thresholds: list = ()
+) -> np.ndarray:
+    """Quantize probabilities (0-1) to uint8 / uint16 codes
+
+    Codes are rounded to the nearest level, then the ones that fall on the
+    wrong side of a threshold are moved to the level next to it, so that
+    decode(codes) > threshold is exactly probabilities > threshold: the areas
+    of the requested thresholds do not change. NaN probabilities become
+    nodata.
+
+    Args:
+        probabilities (np.ndarray): Water probabilities
+        encoding (str): uint8 or uint16
+        thresholds (list): Thresholds whose areas must be preserved
+
+    Returns:
+        np.ndarray: codes
+    """
+    scale, offset, nodata = encoding_parameters(encoding)
+    probabilities = np.asarray(probabilities, dtype=np.float32)
+    valid = np.isfinite(probabilities)
+
+    codes = np.rint((np.clip(probabilities, 0, 1) - offset) / scale)
+    levels = decode(np.arange(nodata, dtype=encoding), scale, offset)
+
+    last_level = -2
+    for threshold in sorted(thresholds):
+        # maior código que não ultrapassa o limiar
+        level = np.count_nonzero(~(levels > threshold)) - 1
+        if level == last_level:
+            logger.warning(
+                f"Thresholds closer than the {encoding} resolution ({scale:.2g}), "
+                "their areas may differ from the float32 map"
+            )
+        last_level = level
+
+        above = probabilities > threshold
+        codes = np.where(above, np.maximum(codes, level + 1), np.minimum(codes, level))
+
+    codes = np.clip(codes, 0, nodata - 1)
+    return np.where(valid, codes, nodata).astype(encoding)
+
+
+def write_probability_map(
+    save_path: str,
+    probabilities: np.ndarray,
+    profile: dict,
+    encoding: str = "float32",
+    thresholds: list = (),
+) -> None:
+    """Save a water probability map as float32 or quantized uint8 / uint16
+
+    Quantized maps store the scale and offset of the band and a nodata value,
+    read_values decodes them back to probabilities.
+
+    Args:
+        save_path (str): Path of the COG
+        probabilities (np.ndarray): Water probabilities (0-1)
+        profile (dict): Profile of the source image
+        encoding (str): float32, uint8 or uint16
+        thresholds (list): Thresholds whose areas must be preserved
+    """
+    if encoding not in ENCODINGS:
+        raise ValueError(f"Unknown probability encoding {encoding}, use {ENCODINGS}")
+
+    if encoding == "float32":
+        write_raster(
+            save_path,
+            probabilities,
+            profile,
+            overview_resampling="average",
+            count=1,
+            dtype="float32",
+        )
+        return
+
+    scale, offset, nodata = encoding_parameters(encoding)
+    codes = quantize(probabilities, encoding, thresholds)
+
+    write_raster(
+        save_path,
+        codes,
+        profile,
+        overview_resampling="average",
+        count=1,
+        dtype=encoding,
+        nodata=nodata,
+        scales=[scale],
+        offsets=[offset],
+    )
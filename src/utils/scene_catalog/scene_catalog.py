@@ -0,0 +1,293 @@
+import glob
+import logging
+import os
+import sqlite3
+
+logger = logging.getLogger(__name__)
+
+# Satellite names written by donwload_images, longest first so that S2_SR is
+# not taken for S2
+KNOWN_SATELLITES = ["S2_SR", "S2", "LT05", "LE07", "LC08", "LC09"]
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS scenes (
+    root TEXT NOT NULL,
+    location TEXT NOT NULL,
+    satellite TEXT,
+    date TEXT NOT NULL,
+    year INTEGER NOT NULL,
+    level TEXT,
+    path TEXT NOT NULL,
+    PRIMARY KEY (root, location, satellite, date)
+);
+CREATE INDEX IF NOT EXISTS scenes_by_level ON scenes (location, level, year, date);
+CREATE INDEX IF NOT EXISTS scenes_by_root ON scenes (root, location, year, date);
+CREATE TABLE IF NOT EXISTS directories (
+    root TEXT NOT NULL,
+    location TEXT NOT NULL,
+    directory TEXT NOT NULL,
+    mtime INTEGER NOT NULL,
+    PRIMARY KEY (root, location, directory)
+);
+"""
+
+
+def parse_scene_name(file_name: str, location: str) -> tuple:
+    """Satellite and date (YYYYMMDD) of an image, mask or clean image name
+
+    The names follow {prefix}_{satellite}_{location}_{date}.tif, optionally
+    with a mask_ prefix or a _clean suffix.
+
+    Args:
+        file_name (str): Name or path of the file
+        location (str): Location name used in the file name
+
+    Returns:
+        tuple: (satellite, date), satellite is None when it is not found
+    """
+    stem = os.path.basename(file_name).split(".")[0].replace("_clean", "")
+    date = stem.split("_")[-1].replace("-", "")[:8]
+
+    head = stem.rsplit(f"_{location}_", 1)[0] if f"_{location}_" in stem else ""
+    satellite = next(
+        (s for s in KNOWN_SATELLITES if head.endswith(f"_{s}")),
+        head.split("_")[-1] or None,
+    )
+    return satellite, date
+
+
+class SceneCatalog:
+    """Persistent index (SQLite) of the scenes of every pipeline stage
+
+    Each product directory (root) holds the scenes of a product level (TOA,
+    BOA, mask, clean, water_mask, ...) as {root}{location}/{year}/*.tif. The
+    catalogue is filled after the download and by the nodes that write new
+    products, so the stages query it instead of scanning directories. The
+    modification time of every year directory is kept too: a directory whose
+    files were added or removed (by a node that does not register them, or by
+    hand) is indexed again on the next query.
+    """
+
+    def __init__(self, db_path: str):
+        os.makedirs(os.path.dirname(db_path) or ".", exist_ok=True)
+        self.db_path = db_path
+        self.connection = sqlite3.connect(db_path)
+        self.connection.row_factory = sqlite3.Row
+        self.connection.executescript(SCHEMA)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        self.connection.close()
+
+    @staticmethod
+    def _record(root, location, path, level, satellite=None, date=None):
+        path = str(path).replace("\\", "/")
+        if date is None or satellite is None:
+            parsed_satellite, parsed_date = parse_scene_name(path, location)
+            satellite = satellite or parsed_satellite
+            date = date or parsed_date
+        date = date.replace("-", "")
+        return (root, location, satellite, date, int(date[:4]), level, path)
+
+    def register(
+        self,
+        root: str,
+        location: str,
+        path: str,
+        level: str,
+        satellite: str = None,
+        date: str = None,
+    ) -> None:
+        """Add (or replace) a scene written under root"""
+        self.register_many(root, location, [path], level, satellite, date)
+
+    def register_many(
+        self,
+        root: str,
+        location: str,
+        paths: list,
+        level: str,
+        satellite: str = None,
+        date: str = None,
+    ) -> None:
+        """Add (or replace) many scenes of the same product, in one transaction"""
+        records = [
+            self._record(root, location, path, level, satellite, date)
+            for path in paths
+        ]
+        with self.connection:
+            self.connection.executemany(
+                "INSERT OR REPLACE INTO scenes VALUES (?, ?, ?, ?, ?, ?, ?)", records
+            )
+
+    def index_directory(self, root: str, location: str, level: str) -> int:
+        """Rebuild the entries of a product directory from the files on disk
+
+        Returns:
+            int: number of scenes indexed
+        """
+        with self.connection:
+            for table in ("scenes", "directories"):
+                self.connection.execute(
+                    f"DELETE FROM {table} WHERE root = ? AND location = ?",
+                    (root, location),
+                )
+        n_scenes = self.refresh(root, location, level)
+        logger.info(f"Scene catalogue: {n_scenes} scenes in {root}{location}")
+        return n_scenes
+
+    def refresh(self, root: str, location: str, level: str = None) -> int:
+        """Index again the year directories of a product that changed on disk
+
+        A directory is indexed again when its modification time is not the
+        one stored (files added, removed or renamed), and its entries are
+        dropped when it no longer exists.
+
+        Returns:
+            int: number of scenes indexed
+        """
+        base = f"{root}{location}"
+        on_disk = {}
+        if os.path.isdir(base):
+            for entry in os.scandir(base):
+                if entry.is_dir():
+                    on_disk[entry.name] = entry.stat().st_mtime_ns
+
+        stored = dict(
+            self.connection.execute(
+                "SELECT directory, mtime FROM directories "
+                "WHERE root = ? AND location = ?",
+                (root, location),
+            ).fetchall()
+        )
+        changed = [name for name, mtime in on_disk.items() if stored.get(name) != mtime]
+        removed = [name for name in stored if name not in on_disk]
+        if not changed and not removed:
+            return 0
+
+        if level is None:
+            row = self.connection.execute(
+                "SELECT level FROM scenes WHERE root = ? AND location = ? LIMIT 1",
+                (root, location),
+            ).fetchone()
+            level = None if row is None else row["level"]
+
+        paths = []
+        with self.connection:
+            for name in changed + removed:
+                prefix = f"{base}/{name}/".replace("\\", "/")
+                self.connection.execute(
+                    "DELETE FROM scenes WHERE root = ? AND location = ? "
+                    "AND substr(path, 1, ?) = ?",
+                    (root, location, len(prefix), prefix),
+                )
+                self.connection.execute(
+                    "DELETE FROM directories WHERE root = ? AND location = ? "
+                    "AND directory = ?",
+                    (root, location, name),
+                )
+        for name in changed:
+            paths.extend(glob.glob(f"{base}/{name}/*.tif"))
+        self.register_many(root, location, paths, level)
+
+        # as datas dos diretórios só são gravadas depois das cenas
+        with self.connection:
+            self.connection.executemany(
+                "INSERT INTO directories VALUES (?, ?, ?, ?)",
+                [(root, location, name, on_disk[name]) for name in changed],
+            )
+        if stored:
+            logger.info(
+                f"Scene catalogue: {len(changed) + len(removed)} directories of "
+                f"{base} changed, {len(paths)} scenes indexed again"
+            )
+        return len(paths)
+
+    def scenes(
+        self,
+        location: str,
+        root: str = None,
+        level: str = None,
+        year: int = None,
+        satellite: str = None,
+    ) -> list:
+        """Scenes of a location sorted by date, filtered by root, level, year
+        and satellite.
+
+        The year directories of root that changed on disk since they were
+        indexed (or that were never indexed) are indexed first.
+
+        Returns:
+            list: sqlite3.Row with root, location, satellite, date, year, level
+                  and path
+        """
+        if root is not None:
+            self.refresh(root, location, level)
+
+        query = "SELECT * FROM scenes WHERE location = ?"
+        params = [location]
+        for column, value in (
+            ("root", root),
+            ("level", None if root is not None else level),
+            ("year", year),
+            ("satellite", satellite),
+        ):
+            if value is not None:
+                query += f" AND {column} = ?"
+                params.append(value)
+
+        return self.connection.execute(query + " ORDER BY date, path", params).fetchall()
+
+    def paths_by_date(self, location: str, root: str, year: int = None) -> dict:
+        """{date: path} of the scenes of a product directory"""
+        return {
+            scene["date"]: scene["path"]
+            for scene in self.scenes(location, root=root, year=year)
+        }
+
+    def get(self, location: str, root: str, date: str, satellite: str = None):
+        """Path of the scene of a date in a product directory, None if missing"""
+        self.refresh(root, location)
+
+        query = "SELECT path FROM scenes WHERE root = ? AND location = ? AND date = ?"
+        params = [root, location, date.replace("-", "")]
+        if satellite is not None:
+            query += " AND satellite = ?"
+            params.append(satellite)
+
+        row = self.connection.execute(query, params).fetchone()
+        return None if row is None else row["path"]
+
+
+def list_scene_paths(root: str, location: str, scene_catalog_path: str = None) -> list:
+    """Paths of the scenes of a product directory, sorted by date
+
+    Queries the catalogue when scene_catalog_path is given, otherwise the
+    directory is scanned.
+    """
+    if not scene_catalog_path:
+        return sorted(
+            path.replace("\\", "/")
+            for path in glob.glob(
+                os.path.join(f"{root}{location}", "**", "*.tif"), recursive=True
+            )
+        )
+
+    with SceneCatalog(scene_catalog_path) as catalog:
+        return [scene["path"] for scene in catalog.scenes(location, root=root)]
+
+
+def register_scene_paths(
+    root: str, location: str, paths: list, level: str, scene_catalog_path: str = None
+) -> None:
+    """Add the scenes written by a node to the catalogue, if there is one"""
+    if not scene_catalog_path:
+        return
+
+    with SceneCatalog(scene_catalog_path) as catalog:
+        catalog.register_many(root, location, paths, level)
@@ -1,10 +1,11 @@
 import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
 
 class imgPatch():
     '''
     author: xin luo, date: 2021.3.19
     description: 1. remote sensing image to multi-scale patches
-                 2. patches to remote sensing image 
+                 2. patches to remote sensing image
     '''
     def __init__(self, img, patch_size, edge_overlay):
         ''' edge_overlay = left overlay or, right overlay
@@ -14,27 +15,48 @@ class imgPatch():
         self.img = img[:,:,np.newaxis] if len(img.shape) == 2 else img
         self.img_row = img.shape[0]
         self.img_col = img.shape[1]
+        self.patch_step = self.patch_size - self.edge_overlay
+        ## number of patches whose central (non-overlapping) parts cover the image
+        self.img_patch_row = self._patch_number(self.img_row)
+        self.img_patch_col = self._patch_number(self.img_col)
+
+    def _patch_number(self, length):
+        return int(np.ceil((length + self.edge_overlay//2)/self.patch_step))
+
+    def _expand(self):
+        ''' pad the image so that every patch lies inside the padded array. '''
+        pad_row = (self.img_patch_row-1)*self.patch_step + self.patch_size - self.edge_overlay - self.img_row
+        pad_col = (self.img_patch_col-1)*self.patch_step + self.patch_size - self.edge_overlay - self.img_col
+        return np.pad(self.img, ((self.edge_overlay, pad_row),
+                                    (self.edge_overlay, pad_col), (0,0)), 'constant')
+
+    def toPatchArray(self):
+        '''
+        description: convert img to patches without copying them.
+        return:
+            np.ndarray (img_patch_row, img_patch_col, patch_size, patch_size, band),
+            a strided view of the padded image; patch_array[i, j] is the patch
+            of row i and column j, and contiguous slices of a row can be fed
+            to a model as a batch.
+        '''
+        windows = sliding_window_view(self._expand(), (self.patch_size, self.patch_size), axis=(0, 1))
+        windows = windows[::self.patch_step, ::self.patch_step]
+        return np.moveaxis(windows, 2, -1)
 
     def toPatch(self):
         '''
-        description: convert img to patches. 
-        return: 
-            patch_list, contains all generated patches.
-            start_list, contains all start positions(row, col) of the generated patches. 
+        description: convert img to patches.
+        return:
+            patch_list, contains all generated patches (views of toPatchArray).
+            start_list, contains all start positions(row, col) of the generated patches.
         '''
-        patch_list = []
-        start_list = []
-        patch_step = self.patch_size - self.edge_overlay
-        img_expand = np.pad(self.img, ((self.edge_overlay, patch_step),
-                                          (self.edge_overlay, patch_step), (0,0)), 'constant')
-        img_patch_row = (img_expand.shape[0]-self.edge_overlay)//patch_step
-        img_patch_col = (img_expand.shape[1]-self.edge_overlay)//patch_step
-        for i in range(img_patch_row):
-            for j in range(img_patch_col):
-                patch_list.append(img_expand[i*patch_step:i*patch_step+self.patch_size,
-                                                j*patch_step:j*patch_step+self.patch_size, :])
-                start_list.append([i*patch_step-self.edge_overlay, j*patch_step-self.edge_overlay])
-        return patch_list, start_list, img_patch_row, img_patch_col
+        patch_array = self.toPatchArray()
+        patch_list = [patch_array[i, j] for i in range(self.img_patch_row)
+                                            for j in range(self.img_patch_col)]
+        start_list = [[i*self.patch_step-self.edge_overlay, j*self.patch_step-self.edge_overlay]
+                                            for i in range(self.img_patch_row)
+                                            for j in range(self.img_patch_col)]
+        return patch_list, start_list, self.img_patch_row, self.img_patch_col
 
     def higher_patch_crop(self, higher_patch_size, start_list):
         '''
@@ -45,13 +67,12 @@ class imgPatch():
             patch_size, int, the lower-scale patch size
             crop_size, int, the higher-scale patch size
             start_list, list, the start position (row,col) corresponding to the original image (generated by the toPatch function)
-        return: 
+        return:
             higher_patch_list, list, contains higher-scale patches corresponding to the lower-scale patches.
         '''
         higher_patch_list = []
         radius_bias = higher_patch_size//2-self.patch_size//2
-        patch_step = self.patch_size - self.edge_overlay
-        img_expand = np.pad(self.img, ((self.edge_overlay, patch_step), (self.edge_overlay, patch_step), (0,0)), 'constant')
+        img_expand = self._expand()
         img_expand_higher = np.pad(img_expand, ((radius_bias, radius_bias), (radius_bias, radius_bias), (0,0)), 'constant')
         start_list_new = list(np.array(start_list)+self.edge_overlay+radius_bias)
         for start_i in start_list_new:
@@ -60,13 +81,60 @@ class imgPatch():
             higher_patch_list.append(higher_patch)
         return higher_patch_list
 
-    def toImage(self, patch_list, img_patch_row, img_patch_col):
-        patch_list = [patch[self.edge_overlay//2:-self.edge_overlay//2, self.edge_overlay//2:-self.edge_overlay//2,:]
-                                                        for patch in patch_list]
-        patch_list = [np.hstack((patch_list[i*img_patch_col:i*img_patch_col+img_patch_col]))
-                                                        for i in range(img_patch_row)]
-        img_array = np.vstack(patch_list)
-        img_array = img_array[self.edge_overlay//2:self.img_row+self.edge_overlay//2, \
-            self.edge_overlay//2:self.img_col+self.edge_overlay//2,:]
-        
-        return img_array
\ No newline at end of file
+    def _blend_weights(self):
+        ''' separable weights that ramp linearly to the patch borders over the overlay. '''
+        ramp = np.ones(self.patch_size, dtype=np.float32)
+        if self.edge_overlay > 0:
+            edge = (np.arange(self.edge_overlay, dtype=np.float32)+0.5)/self.edge_overlay
+            ramp[:self.edge_overlay] = edge
+            ramp[-self.edge_overlay:] = edge[::-1]
+        return np.outer(ramp, ramp)[:, :, np.newaxis]
+
+    def toImage(self, patch_list, img_patch_row, img_patch_col, blend=False):
+        '''
+        description: stitch the (predicted) patches into one preallocated image.
+        input:
+            patch_list, list or np.ndarray, patches in the order of toPatch.
+            blend, bool, if True the overlaps are averaged with weights that
+                decrease towards the patch borders, instead of keeping only the
+                central part of each patch.
+        return:
+            np.ndarray (row, col, band).
+        '''
+        band = patch_list[0].shape[-1]
+        half = self.edge_overlay//2
+        if blend:
+            img_array = np.zeros((self.img_row, self.img_col, band), dtype=np.float32)
+            weight_sum = np.zeros((self.img_row, self.img_col, 1), dtype=np.float32)
+            weights = self._blend_weights()
+        else:
+            img_array = np.empty((self.img_row, self.img_col, band), dtype=patch_list[0].dtype)
+
+        for i in range(img_patch_row):
+            for j in range(img_patch_col):
+                patch = patch_list[i*img_patch_col+j]
+                if blend:
+                    ## the whole patch contributes, weighted
+                    row_0, col_0 = i*self.patch_step-self.edge_overlay, j*self.patch_step-self.edge_overlay
+                    size = self.patch_size
+                else:
+                    ## only the central part of the patch is kept
+                    row_0, col_0 = i*self.patch_step-half, j*self.patch_step-half
+                    size = self.patch_step
+                r0, c0 = max(row_0, 0), max(col_0, 0)
+                r1, c1 = min(row_0+size, self.img_row), min(col_0+size, self.img_col)
+                if r1 <= r0 or c1 <= c0:
+                    continue
+                offset_r = r0-row_0+(0 if blend else half)
+                offset_c = c0-col_0+(0 if blend else half)
+                patch = patch[offset_r:offset_r+r1-r0, offset_c:offset_c+c1-c0]
+                if blend:
+                    weight = weights[offset_r:offset_r+r1-r0, offset_c:offset_c+c1-c0]
+                    img_array[r0:r1, c0:c1] += patch*weight
+                    weight_sum[r0:r1, c0:c1] += weight
+                else:
+                    img_array[r0:r1, c0:c1] = patch
+
+        if blend:
+            img_array /= weight_sum
+        return img_array
@@ -24,13 +24,20 @@ import numpy as np
 import rasterio
 import tensorflow as tf
 import tifffile as tiff
-from collections import defaultdict
 
+from utils.raster_io.background import WaterMapSink
+from utils.raster_io.band_reader import read_band_stack
+from utils.raster_io.quantization import write_probability_map
 from utils.watnet.utils.imgPatch import imgPatch
 
 ## default path of the pretrained watnet model
 path_watnet = "src/utils/watnet/model/pretrained/watnet.h5"
 
+## bands of the 6-channel watnet input, and their positions in the 12-band
+## stacks (used when the band names of a stack are unknown)
+watnet_bands = ["blue", "green", "red", "nir", "swir1", "swir2"]
+watnet_band_indexes = [1, 2, 3, 7, 10, 11]
+
 
 def get_args():
     description = "surface water mapping by using pretrained watnet"
@@ -66,104 +73,259 @@ def get_args():
     return parser.parse_args()
 
 
-def watnet_infer(image_path, save_path, path_model=path_watnet, patch_size=512):
+def watnet_infer(
+    image_path,
+    save_path,
+    path_model=path_watnet,
+    patch_size=512,
+    batch_size=32,
+    blend=False,
+    encoding="float32",
+    thresholds=(),
+    bands=None,
+):
     """des: surface water mapping by using pretrained watnet
     arg:
         img: np.array, surface reflectance data (!!data value: 0-1),
              consist of 6 bands (blue,green,red,nir,swir-1,swir-2).
         path_model: str, the path of the pretrained model.
+        batch_size: int, number of patches per model call.
+        blend: bool, blend the patch overlaps instead of cropping them.
+        encoding: str, float32, uint8 or uint16 saved probability map.
+        thresholds: list, thresholds whose areas a quantized map keeps.
+        bands: list, band names or positions to read (None reads all bands).
     retrun:
         water_map: np.array.
     """
     ###  ----- load the pretrained model -----#
     model = tf.keras.models.load_model(path_model, compile=False)
     ### ------ apply the pre-trained model
-    image = tiff.imread(image_path) / 10000.0  # normalize the image data to [0, 1]
-    # image = image[:, :, [1, 2, 3, 7, 10, 11]]  # select bands Blue, Green, Red, NIR, SWIR1, SWIR2
+    image = read_scene(image_path, bands)  # normalized to [0, 1]
 
     imgPatch_ins = imgPatch(image, patch_size=patch_size, edge_overlay=80)
-    patch_list, start_list, img_patch_row, img_patch_col = imgPatch_ins.toPatch()
-    result_patch_list = [model(patch[np.newaxis, :]) for patch in patch_list]
-    result_patch_list = [np.squeeze(patch, axis=0) for patch in result_patch_list]
-    pro_map = imgPatch_ins.toImage(result_patch_list, img_patch_row, img_patch_col)
-    pro_map_uint8 = (pro_map * 255).astype(np.uint8)
+    patch_array = imgPatch_ins.toPatchArray()
+    img_patch_row, img_patch_col = patch_array.shape[:2]
+
+    ## the patches are views of the padded image, only each batch is copied
+    patch_index = [(i, j) for i in range(img_patch_row) for j in range(img_patch_col)]
+    result_patch_list = []
+    for k in range(0, len(patch_index), batch_size):
+        batch = np.stack([patch_array[i, j] for i, j in patch_index[k : k + batch_size]])
+        result_patch_list.extend(np.asarray(model(batch, training=False)))
+
+    pro_map = imgPatch_ins.toImage(
+        result_patch_list, img_patch_row, img_patch_col, blend=blend
+    )
 
     # water_map = np.where(pro_map >= 0.5, 1, 0)
 
-    with rasterio.open(image_path) as src:
-        profile = src.profile
-        profile.update(count=1, dtype=rasterio.float32)
-        with rasterio.open(save_path, "w", **profile) as output:
-            output.write(np.squeeze(pro_map), 1)
-
-            # del model
-            del image
-            del output
+    save_probability_map(
+        pro_map, image_path, save_path, encoding=encoding, thresholds=thresholds
+    )
 
-            gc.collect()
+    del image
+    del patch_array
+    gc.collect()
 
     return pro_map
 
 
-def watnet_infer_optimized(
-    image_paths, save_path, path_model=path_watnet, patch_size=512
-):
-    all_patches = []  # lista com todos os patches
-    metadata = []  # lista com informações do patch
+class _SceneState:
+    """Patches of a scene that is waiting for its predictions."""
+
+    def __init__(self, image_path, save_path, patcher, n_rows, n_cols):
+        self.image_path = image_path
+        self.save_path = save_path
+        self.patcher = patcher
+        self.n_rows = n_rows
+        self.n_cols = n_cols
+        self.results = [None] * (n_rows * n_cols)
+        self.pending = n_rows * n_cols
 
-    model = tf.keras.models.load_model(path_model, compile=False)
 
-    for img_path in image_paths:
-        image = tiff.imread(img_path) / 10000.0
-        image = image[:, :, [1, 2, 3, 7, 10, 11]]
+def read_scene(image_path, bands=None):
+    """Read a scene normalized to [0, 1], optionally selecting its bands.
+    bands are band names (blue, nir, ...) or positions in the stack, only
+    the selected bands are read. A stack with as many bands as the names,
+    without band names, is taken as already holding them.
+    """
+    if bands is None:
+        image = tiff.imread(image_path)
+    else:
+        with rasterio.open(image_path) as src:
+            if all(isinstance(band, str) for band in bands):
+                default_indexes = None
+                if src.count == len(bands):
+                    default_indexes = list(range(1, src.count + 1))
+                elif list(bands) == watnet_bands:
+                    default_indexes = [band + 1 for band in watnet_band_indexes]
+                image = read_band_stack(src, bands, default_indexes=default_indexes)
+            else:
+                image = src.read([band + 1 for band in bands])
+        image = np.transpose(image, [1, 2, 0])
+    return image / 10000.0  # normalize the image data to [0, 1]
+
+
+def iter_scene_patches(
+    image_paths, save_paths, patch_size=512, edge_overlay=80, bands=None
+):
+    """Producer: read the scenes lazily and yield their patches one by one.
 
-        patcher = imgPatch(image, patch_size=512, edge_overlay=80)
-        patches, starts, n_rows, n_cols = patcher.toPatch()
+    A scene is only read when the consumer asks for its first patch, so at
+    most the scenes covered by the current batch are held in memory.
+
+    Yields:
+        tuple: (scene state, patch index, patch)
+    """
+    for image_path, save_path in zip(image_paths, save_paths):
+        patcher = imgPatch(
+            read_scene(image_path, bands),
+            patch_size=patch_size,
+            edge_overlay=edge_overlay,
+        )
+        patches, _, n_rows, n_cols = patcher.toPatch()
+        scene = _SceneState(image_path, save_path, patcher, n_rows, n_cols)
 
         for idx, patch in enumerate(patches):
-            all_patches.append(patch)
-            metadata.append(
-                {
-                    "image_name": os.path.basename(img_path),
-                    "index": idx,
-                    "n_rows": n_rows,
-                    "n_cols": n_cols,
-                    "start_coords": starts[idx],
-                    "patcher": patcher,  # salvar referência para reconstrução
-                }
-            )
-
-    batch_size = 32
-    all_preds = []
-
-    for i in range(0, len(all_patches), batch_size):
-        batch = np.stack(all_patches[i : i + batch_size], axis=0)
-        preds = model(batch, training=False).numpy()
-        all_preds.extend(preds)
-
-    results_by_image = defaultdict(list)
-
-    for i, meta in enumerate(metadata):
-        key = meta["image_name"]
-        results_by_image[key].append((meta["index"], all_preds[i], meta))
-
-    for image_name, results in results_by_image.items():
-        # Ordenar os patches para garantir ordem correta
-        results.sort(key=lambda x: x[0])  # x[0] é o índice do patch
-
-        patches = [r[1] for r in results]
-        patcher = results[0][2]["patcher"]
-        n_rows = results[0][2]["n_rows"]
-        n_cols = results[0][2]["n_cols"]
-
-        full_image = patcher.toImage(patches, n_rows, n_cols)
-
-        # Salvar com rasterio
-        original_path = [p for p in image_paths if os.path.basename(p) == image_name][0]
-        file_path = os.path.join(save_path, image_name)
-
-        with rasterio.open(original_path) as src:
-            profile = src.profile
-            profile.update(count=1, dtype=rasterio.float32)
-            with rasterio.open(file_path, "w", **profile) as dst:
-                dst.write(np.squeeze(full_image), 1)
+            yield scene, idx, patch
+
+
+def save_probability_map(
+    pro_map, image_path, save_path, encoding="float32", thresholds=()
+):
+    """Save a probability map using the profile of the source image.
+    encoding is float32, or uint8 / uint16 for a quantized map that keeps the
+    areas of thresholds (see write_probability_map).
+    """
+    with rasterio.open(image_path) as src:
+        write_probability_map(
+            save_path,
+            np.squeeze(pro_map),
+            src.profile,
+            encoding=encoding,
+            thresholds=thresholds,
+        )
+
+
+def watnet_infer_stream(
+    image_paths,
+    save_path,
+    path_model=path_watnet,
+    patch_size=512,
+    batch_size=32,
+    edge_overlay=80,
+    bands=watnet_bands,
+    model=None,
+    blend=False,
+    encoding="float32",
+    thresholds=(),
+    write_mode="sync",
+    area_estimator=None,
+):
+    """des: memory-bounded batch inference over many scenes.
+    Patches of consecutive scenes are packed in fixed-size batches, and each
+    scene is reassembled and saved as soon as its last patch is predicted.
+    arg:
+        image_paths: list, the scenes to segment.
+        save_path: str or list, output directory or one output path per scene.
+        path_model: str, the path of the pretrained model (if model is None).
+        batch_size: int, number of patches per model call.
+        bands: list, band names or positions to read from each scene
+               (the six watnet bands by default, None keeps all bands).
+        blend: bool, blend the patch overlaps instead of cropping them.
+        encoding: str, float32, uint8 or uint16 saved probability maps.
+        thresholds: list, thresholds whose areas a quantized map keeps.
+        write_mode: str, sync, async (written in a background thread) or none.
+        area_estimator: StreamingAreaEstimator, takes the areas of every map
+                        while it is in memory (fused inference-to-area).
+    yield:
+        save path of every scene, as soon as it is predicted (the async
+        writes are all finished when the generator is exhausted).
+    """
+    if isinstance(save_path, str):
+        save_paths = [
+            os.path.join(save_path, os.path.basename(p)) for p in image_paths
+        ]
+    else:
+        save_paths = list(save_path)
+
+    if model is None:
+        model = tf.keras.models.load_model(path_model, compile=False)
+
+    def save(pro_map, image_path, save_path):
+        save_probability_map(
+            pro_map,
+            image_path,
+            save_path,
+            encoding=encoding,
+            thresholds=thresholds,
+        )
+
+    sink = WaterMapSink(save, write_mode, area_estimator)
+
+    def run_batch(batch):
+        preds = model(np.stack([patch for _, _, patch in batch]), training=False)
+        preds = np.asarray(preds)
+        for (scene, idx, _), pred in zip(batch, preds):
+            scene.results[idx] = pred
+            scene.pending -= 1
+            if scene.pending == 0:
+                pro_map = scene.patcher.toImage(
+                    scene.results, scene.n_rows, scene.n_cols, blend=blend
+                )
+                sink.put(pro_map, scene.image_path, scene.save_path)
+                # release the scene before the next one is read
+                scene.results, scene.patcher = None, None
+                yield scene.save_path
+
+    try:
+        batch = []
+        for item in iter_scene_patches(
+            image_paths, save_paths, patch_size, edge_overlay, bands
+        ):
+            batch.append(item)
+            if len(batch) == batch_size:
+                yield from run_batch(batch)
+                batch = []
+
+        if batch:
+            yield from run_batch(batch)
+    finally:
+        sink.close()
+
+    gc.collect()
+
+
+def watnet_infer_optimized(
+    image_paths,
+    save_path,
+    path_model=path_watnet,
+    patch_size=512,
+    batch_size=32,
+    edge_overlay=80,
+    bands=watnet_bands,
+    model=None,
+    blend=False,
+    encoding="float32",
+    thresholds=(),
+):
+    """des: run watnet_infer_stream over all scenes, reading the six
+    watnet bands of each one by default.
+    retrun:
+        list with the save path of every scene.
+    """
+    return list(
+        watnet_infer_stream(
+            image_paths,
+            save_path,
+            path_model=path_model,
+            patch_size=patch_size,
+            batch_size=batch_size,
+            edge_overlay=edge_overlay,
+            bands=bands,
+            model=model,
+            blend=blend,
+            encoding=encoding,
+            thresholds=thresholds,
+        )
+    )
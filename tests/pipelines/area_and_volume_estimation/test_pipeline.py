@@ -7,3 +7,238 @@ Kedro recommends using `pytest` framework, more info about it can be found
 in the official documentation:
 https://docs.pytest.org/en/latest/getting-started.html
 """
+
+import os
+
+import geopandas as gpd
+import numpy as np
+import pandas as pd
+import pytest
+from pyproj import Geod, Transformer
+from rasterio.transform import from_origin
+from shapely.geometry import Point
+
+from utils.area_and_volume_estimation import roi_plan
+from utils.area_and_volume_estimation.executor import AREA_BACKENDS, run_area_tasks
+from utils.area_and_volume_estimation.result_store import ResultStore
+from utils.area_and_volume_estimation.roi_plan import cell_areas
+from utils.area_and_volume_estimation.streaming import StreamingAreaEstimator
+from utils.area_and_volume_estimation.water import (
+    calculate_areas_from_array,
+    calculate_volumes_to_multiple_methods,
+    preprocess_raster,
+    process_single_mask,
+    update_volumes,
+)
+from utils.raster_io.quantization import write_probability_map
+
+THRESHOLDS = [0.05, 0.25, 0.5, 0.75, 0.95]
+
+
+@pytest.fixture
+def scene(tmp_path):
+    """Water probability map on a geographic grid and a circular ROI"""
+    size = 600
+    resolution = 10 / 111319.49079327357
+    transform = from_origin(-38.5, -6.9, resolution, resolution)
+    rows, cols = np.mgrid[:size, :size]
+    probabilities = (np.sin(rows / 23.0) * np.cos(cols / 17.0) + 1) / 2
+
+    profile = {
+        "driver": "GTiff",
+        "width": size,
+        "height": size,
+        "count": 1,
+        "dtype": "float32",
+        "crs": "EPSG:4326",
+        "transform": transform,
+    }
+    roi_path = str(tmp_path / "roi.geojson")
+    center = transform * (size / 2, size / 2.5)
+    gpd.GeoDataFrame(
+        geometry=[Point(center).buffer(resolution * size / 3)], crs="EPSG:4326"
+    ).to_file(roi_path, driver="GeoJSON")
+
+    roi_plan._roi_plans.clear()
+    return probabilities.astype(np.float32), profile, roi_path
+
+
+@pytest.mark.parametrize("encoding", ["float32", "uint8"])
+def test_roi_plan_areas_match_the_crop_and_reprojection(scene, tmp_path, encoding):
+    probabilities, profile, roi_path = scene
+    mask_path = str(tmp_path / "water_S2_SR_loc_20240101.tif")
+    write_probability_map(
+        mask_path, probabilities, profile, encoding=encoding, thresholds=THRESHOLDS
+    )
+
+    image, pixel_area = preprocess_raster(mask_path, roi_path)
+    expected = calculate_areas_from_array(image, pixel_area, THRESHOLDS)
+
+    results = process_single_mask(
+        (mask_path, roi_path, THRESHOLDS, None, None, "reprojected")
+    )
+
+    assert {r["threshold"]: (r["m2_area"], r["km2_area"]) for r in results} == expected
+    assert all(r["m2_area"] > 0 for r in results)
+
+
+def test_roi_plans_are_built_once_per_grid(scene, tmp_path):
+    probabilities, profile, roi_path = scene
+    mask_paths = []
+    for day in range(1, 4):
+        mask_path = str(tmp_path / f"water_S2_SR_loc_2024010{day}.tif")
+        write_probability_map(mask_path, probabilities, profile)
+        mask_paths.append(mask_path)
+
+    plans = roi_plan.build_roi_plans(mask_paths, roi_path)
+
+    assert len(plans) == 1
+
+
+def test_area_backends_give_the_same_areas(scene, tmp_path):
+    probabilities, profile, roi_path = scene
+    tasks = []
+    for day in range(1, 4):
+        mask_path = str(tmp_path / f"water_S2_SR_loc_2024010{day}.tif")
+        write_probability_map(mask_path, probabilities**day, profile)
+        tasks.append((mask_path, roi_path, THRESHOLDS, None, None))
+    plans = roi_plan.build_roi_plans([task[0] for task in tasks], roi_path)
+
+    areas = {}
+    for backend in AREA_BACKENDS:
+        records = run_area_tasks(tasks, plans, backend, max_workers=2)
+        areas[backend] = sorted(
+            (r["water_masks"], r["threshold"], r["m2_area"])
+            for rows in records
+            for r in rows
+        )
+
+    assert len(areas["serial"]) == len(tasks) * len(THRESHOLDS)
+    assert areas["threads"] == areas["serial"] == areas["processes"]
+
+
+@pytest.mark.parametrize(
+    "crs, transform",
+    [
+        ("EPSG:4326", from_origin(-38.5, -6.9, 1e-4, 1e-4)),
+        ("EPSG:32724", from_origin(700000, 9250000, 10, 10)),
+    ],
+)
+def test_cell_areas_match_the_geodesic_polygon_area(crs, transform):
+    areas = cell_areas(crs, transform, height=4, width=3)
+
+    # contorno do pixel (2, 1) em longitude / latitude
+    cols, rows = [1, 2, 2, 1], [2, 2, 3, 3]
+    x, y = transform * (np.array(cols), np.array(rows))
+    lon, lat = Transformer.from_crs(crs, "EPSG:4326", always_xy=True).transform(x, y)
+    expected, _ = Geod(ellps="WGS84").polygon_area_perimeter(lon, lat)
+
+    assert areas[2, 1] == pytest.approx(abs(expected), rel=1e-6)
+
+
+def test_saved_histograms_answer_new_thresholds(scene, tmp_path):
+    probabilities, profile, roi_path = scene
+    mask_path = str(tmp_path / "water_S2_SR_loc_20240101.tif")
+    write_probability_map(
+        mask_path, probabilities, profile, encoding="uint8", thresholds=THRESHOLDS
+    )
+    histogram_dir = str(tmp_path / "histograms")
+    new_thresholds = [0.1, 0.3, 0.6, 0.9]
+
+    process_single_mask(
+        (mask_path, roi_path, THRESHOLDS, None, None, "reprojected", histogram_dir)
+    )
+    os.remove(mask_path)
+    from_histogram = process_single_mask(
+        (mask_path, roi_path, new_thresholds, None, None, "reprojected", histogram_dir)
+    )
+
+    write_probability_map(
+        mask_path, probabilities, profile, encoding="uint8", thresholds=THRESHOLDS
+    )
+    roi_plan._roi_plans.clear()
+    from_raster = process_single_mask(
+        (mask_path, roi_path, new_thresholds, None, None, "reprojected")
+    )
+
+    assert [r["m2_area"] for r in from_histogram] == [
+        r["m2_area"] for r in from_raster
+    ]
+
+
+@pytest.mark.parametrize("encoding", ["float32", "uint8"])
+def test_fused_areas_match_the_saved_probability_map(scene, tmp_path, encoding):
+    probabilities, profile, roi_path = scene
+    image_path = str(tmp_path / "image_S2_SR_loc_20240101.tif")
+    mask_path = str(tmp_path / "water_S2_SR_loc_20240101.tif")
+    write_probability_map(image_path, probabilities, profile)
+
+    estimator = StreamingAreaEstimator(roi_path, THRESHOLDS)
+    estimator.add(image_path, mask_path, probabilities)
+    write_probability_map(
+        mask_path, probabilities, profile, encoding=encoding, thresholds=THRESHOLDS
+    )
+    expected = process_single_mask((mask_path, roi_path, THRESHOLDS, None, None))
+
+    assert estimator.records == expected
+
+
+def test_incremental_volumes_match_the_sorted_series(tmp_path):
+    rng = np.random.default_rng(0)
+    dates = pd.date_range("2023-01-01", periods=40, freq="9D")
+    areas = pd.DataFrame(
+        {
+            "water_masks": [f"water_{d:%Y%m%d}.tif" for d in dates],
+            "date": dates,
+            "year": dates.strftime("%Y"),
+            "month": dates.strftime("%m"),
+            "m2_area": rng.random(len(dates)) * 2e6,
+            "CLOUDY_PIXEL_PERCENTAGE": 0.0,
+        }
+    )
+    df_cav = pd.DataFrame(
+        {"area": np.linspace(0, 2e6, 40), "volume": np.cumsum(rng.random(40)) * 1e6}
+    )
+    store = ResultStore(str(tmp_path / "store"))
+
+    # datas chegando fora de ordem, e a última leva repetida
+    batches = np.array_split(rng.permutation(len(dates)), 3)
+    for batch in batches + batches[-1:]:
+        stored = store.read("volumes", "loc", "method", 0.5)
+        volumes = update_volumes(
+            stored, areas.iloc[batch], df_cav, areas_columns=["m2_area"], escale=1e6
+        )
+        store.write("volumes", "loc", "method", 0.5, volumes)
+
+    expected = calculate_volumes_to_multiple_methods(
+        areas, df_cav, areas_columns=["m2_area"], escale=1e6
+    )
+    stored = store.read("volumes", "loc", "method", 0.5)
+
+    assert stored["date"].is_monotonic_increasing
+    pd.testing.assert_frame_equal(stored[expected.columns], expected, rtol=1e-9)
+
+
+def test_store_drops_rows_computed_with_other_settings(tmp_path):
+    dates = pd.date_range("2023-01-01", periods=4, freq="7D")
+    rows = pd.DataFrame(
+        {
+            "water_masks": [f"water_{d:%Y%m%d}.tif" for d in dates],
+            "date": dates,
+            "m2_area": [1.0, 2.0, 3.0, 4.0],
+            "mask_mtime": 1.0,
+        }
+    )
+    store = ResultStore(str(tmp_path / "store"))
+    store.upsert("areas", "loc", "method", 0.5, rows, config="reprojected")
+
+    assert len(store.scenes("areas", "loc", "method", [0.5], "reprojected")) == 4
+    # outro método de área (ou ROI, ou pasta de máscaras): nada é reaproveitado
+    assert store.scenes("areas", "loc", "method", [0.5], "geodesic") == {}
+    assert store.read("areas", "loc", "method", 0.5, "geodesic") is None
+
+    partition, _ = store.upsert(
+        "areas", "loc", "method", 0.5, rows.iloc[:2], config="geodesic"
+    )
+    assert list(partition["water_masks"]) == list(rows["water_masks"].iloc[:2])
+    assert store.read("areas", "loc", "method", 0.5, "reprojected") is None
@@ -7,3 +7,452 @@ Kedro recommends using `pytest` framework, more info about it can be found
 in the official documentation:
 https://docs.pytest.org/en/latest/getting-started.html
 """
+
+import os
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from utils.download.transfer import (
+    DownloadError,
+    create_session,
+    fetch_to_file,
+    run_concurrently,
+)
+
+PAYLOAD = os.urandom(256 * 1024)
+
+
+class FakeDownloadServer:
+    """Local stand-in for the GEE download URLs
+
+    Each path answers with the statuses queued in `script` ("ok", "truncated"
+    or an HTTP status code) and then with the whole payload.
+    """
+
+    def __init__(self):
+        self.script = {}
+        self.requests = []
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                server.requests.append(self.path)
+                queue = server.script.get(self.path, [])
+                action = queue.pop(0) if queue else "ok"
+
+                if isinstance(action, int):
+                    self.send_response(action)
+                    self.send_header("Content-Length", "0")
+                    if action == 429:
+                        self.send_header("Retry-After", "0")
+                    self.end_headers()
+                    return
+
+                self.send_response(200)
+                self.send_header("Content-Type", "image/tiff")
+                self.send_header("Content-Length", str(len(PAYLOAD)))
+                self.end_headers()
+                body = PAYLOAD[: len(PAYLOAD) // 2] if action == "truncated" else PAYLOAD
+                self.wfile.write(body)
+
+        self.httpd = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.url = f"http://127.0.0.1:{self.httpd.server_address[1]}"
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self.thread.start()
+
+    def close(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+@pytest.fixture
+def server():
+    fake = FakeDownloadServer()
+    yield fake
+    fake.close()
+
+
+def leftovers(directory):
+    return [name for name in os.listdir(directory) if name.endswith(".part")]
+
+
+class TestFetchToFile:
+    def test_downloads_the_whole_file(self, server, tmp_path):
+        output_file = tmp_path / "2020" / "image.tif"
+
+        size = fetch_to_file(f"{server.url}/image", output_file)
+
+        assert size == len(PAYLOAD)
+        assert output_file.read_bytes() == PAYLOAD
+        assert leftovers(output_file.parent) == []
+
+    def test_retries_throttling_and_server_errors(self, server, tmp_path):
+        server.script["/image"] = [429, 503, 500]
+        output_file = tmp_path / "image.tif"
+
+        fetch_to_file(f"{server.url}/image", output_file, backoff_factor=0)
+
+        assert output_file.read_bytes() == PAYLOAD
+        assert server.requests.count("/image") == 4
+
+    def test_truncated_response_is_fetched_again(self, server, tmp_path):
+        server.script["/image"] = ["truncated"]
+        output_file = tmp_path / "image.tif"
+
+        fetch_to_file(f"{server.url}/image", output_file, backoff_factor=0)
+
+        assert output_file.read_bytes() == PAYLOAD
+        assert leftovers(tmp_path) == []
+
+    def test_client_errors_are_not_retried(self, server, tmp_path):
+        server.script["/image"] = [404]
+        output_file = tmp_path / "image.tif"
+
+        with pytest.raises(DownloadError):
+            fetch_to_file(f"{server.url}/image", output_file, backoff_factor=0)
+
+        assert server.requests.count("/image") == 1
+        assert not output_file.exists()
+
+    def test_gives_up_without_leaving_a_partial_file(self, server, tmp_path):
+        server.script["/image"] = ["truncated"] * 3
+        output_file = tmp_path / "image.tif"
+
+        with pytest.raises(DownloadError):
+            fetch_to_file(
+                f"{server.url}/image", output_file, max_retries=2, backoff_factor=0
+            )
+
+        assert not output_file.exists()
+        assert leftovers(tmp_path) == []
+
+
+def test_concurrent_downloads_share_a_session(server, tmp_path):
+    server.script["/image_3"] = [503]
+    session = create_session(pool_size=4)
+    tasks = [(f"{server.url}/image_{i}", tmp_path / f"image_{i}.tif") for i in range(8)]
+
+    def download(url, output_file):
+        return fetch_to_file(url, output_file, session=session, backoff_factor=0)
+
+    results = dict(run_concurrently(download, tasks, max_workers=4))
+    session.close()
+
+    assert sorted(results.values()) == [len(PAYLOAD)] * 8
+    for _, output_file in tasks:
+        assert output_file.read_bytes() == PAYLOAD
+
+
+def test_concurrent_errors_are_returned_per_task(server, tmp_path):
+    server.script["/missing"] = [404]
+    tasks = [
+        (f"{server.url}/image", tmp_path / "image.tif"),
+        (f"{server.url}/missing", tmp_path / "missing.tif"),
+    ]
+
+    results = dict(run_concurrently(fetch_to_file, tasks, max_workers=2))
+
+    assert results[tasks[0]] == len(PAYLOAD)
+    assert isinstance(results[tasks[1]], DownloadError)
+
+
+class FakeEarthEngine:
+    """Test double of the `ee` module that counts the round trips to GEE
+
+    Every getInfo() is one round trip. Server-side objects are lazy and are
+    only evaluated by getInfo(), as in the real client.
+    """
+
+    def __init__(self, images: dict, download_url: str = None):
+        self.images = images
+        self.download_url = download_url
+        self.download_params = []
+        self.band_types = {}
+        self.round_trips = 0
+        fake = self
+
+        class Computed:
+            def __init__(self, evaluate):
+                self.evaluate = evaluate
+
+            def getInfo(self):
+                fake.round_trips += 1
+                return self.evaluate()
+
+        def evaluate(value):
+            if isinstance(value, Computed):
+                return value.evaluate()
+            if isinstance(value, dict):
+                return {key: evaluate(item) for key, item in value.items()}
+            return value
+
+        class Image:
+            def __init__(self, image_id):
+                self.image_id = image_id
+
+            def toDictionary(self):
+                return Computed(lambda: dict(fake.images[self.image_id]))
+
+            def select(self, bands):
+                return self
+
+            def bandTypes(self):
+                return Computed(lambda: dict(fake.band_types))
+
+            def getDownloadURL(self, params):
+                fake.download_params.append(params)
+                return fake.download_url
+
+        class ImageCollection:
+            def __init__(self, images):
+                self.image_list = images
+
+            def mosaic(self):
+                return Image(None)
+
+            def size(self):
+                return Computed(lambda: len(self.image_list))
+
+            def aggregate_array(self, name):
+                return Computed(
+                    lambda: [fake.images[i.image_id][name] for i in self.image_list]
+                )
+
+            def aggregate_min(self, name):
+                return Computed(
+                    lambda: min(fake.images[i.image_id][name] for i in self.image_list)
+                )
+
+            def aggregate_max(self, name):
+                return Computed(
+                    lambda: max(fake.images[i.image_id][name] for i in self.image_list)
+                )
+
+        def Dictionary(values):
+            return Computed(lambda: evaluate(values))
+
+        self.Image = Image
+        self.ImageCollection = ImageCollection
+        self.Dictionary = Dictionary
+        self.FeatureCollection = object
+
+    def collection(self):
+        return self.ImageCollection([self.Image(i) for i in self.images])
+
+    def roi(self):
+        class Roi:
+            def geometry(self):
+                return None
+
+        return Roi()
+
+
+def fake_s2_images(n: int = 6) -> dict:
+    return {
+        f"COPERNICUS/S2_HARMONIZED/2020010{1 + i // 2}T130251_20200101T130250_T24M{i}": {
+            "system:id": f"COPERNICUS/S2_HARMONIZED/2020010{1 + i // 2}T130251_20200101T130250_T24M{i}",
+            "system:time_start": 1577883771000 + (i // 2) * 86400000,
+            "CLOUDY_PIXEL_PERCENTAGE": float(i),
+        }
+        for i in range(n)
+    }
+
+
+@pytest.fixture
+def fake_ee(monkeypatch):
+    import sys
+
+    fake = FakeEarthEngine(fake_s2_images())
+    monkeypatch.setitem(sys.modules, "ee", fake)
+    for module in [
+        "utils.gee.authenticate",
+        "utils.download.download",
+        "utils.download.metadata",
+    ]:
+        monkeypatch.delitem(sys.modules, module, raising=False)
+    yield fake
+
+
+class TestBatchedMetadata:
+    def test_collection_summary_is_one_round_trip(self, fake_ee):
+        from utils.download.metadata import get_collection_summary
+
+        summary = get_collection_summary(fake_ee.collection())
+
+        assert fake_ee.round_trips == 1
+        assert summary["size"] == 6
+        assert summary["ids"] == list(fake_ee.images)
+        assert (summary["min_date"], summary["max_date"]) == ("2020-01-01", "2020-01-03")
+
+    def test_properties_are_batched_and_cached(self, fake_ee, tmp_path):
+        from utils.download.metadata import get_images_properties
+
+        image_ids = list(fake_ee.images)
+        cache_path = tmp_path / "cache.json"
+
+        properties = get_images_properties(image_ids, cache_path=cache_path, batch_size=4)
+        assert fake_ee.round_trips == 2
+        assert properties == fake_ee.images
+
+        # the second run reads everything from the cache
+        assert get_images_properties(image_ids, cache_path=cache_path) == properties
+        assert fake_ee.round_trips == 2
+
+    def test_mosaic_download_joins_the_batched_metadata(self, fake_ee, server, tmp_path):
+        from utils.download.download import download_mosaic_image, group_images_by_date
+        from utils.download.metadata import get_images_properties
+
+        fake_ee.download_url = f"{server.url}/mosaic"
+        groups = group_images_by_date([{"id": i} for i in fake_ee.images])
+        properties = get_images_properties(list(fake_ee.images))
+        round_trips = fake_ee.round_trips
+
+        for i, image_ids in enumerate(groups):
+            metadata = download_mosaic_image(
+                image_ids=image_ids,
+                output_file=tmp_path / f"mosaic_{i}.tif",
+                selected_bands=None,
+                roi=fake_ee.roi(),
+                metadata=properties,
+            )
+            assert [m["system:id"] for m in metadata] == image_ids
+            assert (tmp_path / f"mosaic_{i}.tif").read_bytes() == PAYLOAD
+
+        assert len(groups) == 3
+        assert fake_ee.round_trips == round_trips
+
+
+# bandTypes() de bandas do TOA Landsat: reflectâncias float e QA inteiro
+LANDSAT_TOA_BAND_TYPES = {
+    "B4": {"type": "PixelType", "precision": "float"},
+    "B5": {"type": "PixelType", "precision": "float"},
+    "QA_PIXEL": {"type": "PixelType", "precision": "int", "min": 0, "max": 65535},
+}
+
+
+class TestTiledDownload:
+    def test_bytes_per_value_follows_the_band_types(self):
+        from utils.download.tiling import download_bytes_per_value
+
+        uint16 = {"B2": {"precision": "int", "min": 0, "max": 65535}}
+        assert download_bytes_per_value(uint16) == 2
+        assert download_bytes_per_value(LANDSAT_TOA_BAND_TYPES) == 4
+
+    def test_float_tiles_fit_the_request_limit(self):
+        from utils.download.tiling import (
+            download_bytes_per_value,
+            plan_tiles,
+            request_bytes,
+        )
+
+        max_request_bytes = 40 * 1024 * 1024
+        bytes_per_value = download_bytes_per_value(LANDSAT_TOA_BAND_TYPES)
+        tiles = plan_tiles(
+            (-45.0, -10.0, -44.0, -9.0),
+            scale=30,
+            n_bands=7,
+            bytes_per_value=bytes_per_value,
+            max_request_bytes=max_request_bytes,
+        )
+
+        assert len(tiles) > 1
+        for tile in tiles:
+            size = request_bytes(tile["width"], tile["height"], 7, bytes_per_value)
+            assert size <= max_request_bytes
+
+    def test_small_roi_keeps_the_region_request(self, fake_ee, server, tmp_path):
+        from utils.download.download import download_mosaic_image
+
+        fake_ee.download_url = f"{server.url}/mosaic"
+        fake_ee.band_types = LANDSAT_TOA_BAND_TYPES
+
+        download_mosaic_image(
+            image_ids=list(fake_ee.images)[:1],
+            output_file=tmp_path / "mosaic.tif",
+            selected_bands=None,
+            roi=fake_ee.roi(),
+            scale=30,
+            metadata=fake_ee.images,
+            roi_bounds=(-45.0, -10.0, -44.99, -9.99),
+        )
+
+        # número de bandas e bytes por valor em uma única consulta
+        assert fake_ee.round_trips == 1
+        (params,) = fake_ee.download_params
+        assert "region" in params and "crs_transform" not in params
+        assert (tmp_path / "mosaic.tif").read_bytes() == PAYLOAD
+
+    def test_band_layout_comes_from_the_band_types(self, fake_ee):
+        from utils.download.download import get_band_layout
+
+        fake_ee.band_types = LANDSAT_TOA_BAND_TYPES
+
+        assert get_band_layout(fake_ee.Image("a")) == (3, 4)
+        assert fake_ee.round_trips == 1
+
+
+class TestDownloadManifest:
+    def test_complete_files_survive_a_compacted_reload(self, tmp_path):
+        from utils.download.manifest import DownloadManifest
+
+        path = tmp_path / "download_manifest.jsonl"
+        output_file = tmp_path / "2020" / "S2_loc_20200101.tif"
+        os.makedirs(output_file.parent)
+        output_file.write_bytes(PAYLOAD)
+        key = DownloadManifest.key("S2", "20200101", ["a"], ["B2"], 10, "roi")
+
+        manifest = DownloadManifest(path)
+        assert not manifest.is_complete(key, output_file)
+        manifest.record(key, output_file, metadata=[{"id": "old"}])
+        manifest.record(key, output_file, metadata=[{"id": "a"}])
+        with open(path, "a") as file:
+            file.write('{"key": "interrupted"')
+
+        manifest = DownloadManifest(path)
+        manifest.compact()
+        with open(path) as file:
+            assert len(file.readlines()) == 1
+
+        manifest = DownloadManifest(path)
+        assert manifest.is_complete(key, output_file, verify_checksum=True)
+        assert manifest.metadata(key) == [{"id": "a"}]
+        assert not manifest.is_complete(key, tmp_path / "other.tif")
+
+        # mesmo tamanho, conteúdo diferente: só o checksum detecta
+        output_file.write_bytes(bytes(len(PAYLOAD)))
+        assert manifest.is_complete(key, output_file)
+        assert not manifest.is_complete(key, output_file, verify_checksum=True)
+
+        output_file.write_bytes(PAYLOAD[:1024])
+        assert not manifest.is_complete(key, output_file)
+
+    def test_screened_groups_are_skipped_while_above_the_limit(self, tmp_path):
+        from utils.download.manifest import DownloadManifest
+
+        path = tmp_path / "download_manifest.jsonl"
+        output_file = tmp_path / "2020" / "S2_loc_20200101.tif"
+        key = DownloadManifest.key("S2", "20200101", ["a"], ["B2"], 10, "roi")
+
+        DownloadManifest(path).record_screened(key, output_file, 80.0)
+
+        manifest = DownloadManifest(path)
+        assert manifest.is_screened(key, output_file, max_roi_cloud_percentage=50)
+        assert not manifest.is_screened(key, output_file, max_roi_cloud_percentage=90)
+        assert not manifest.is_complete(key, output_file)
+
+    def test_key_changes_with_the_request_grid(self):
+        from utils.download.manifest import DownloadManifest
+
+        request = ("S2", "20200101", ["a"], ["B2"], 10, "roi")
+        region = DownloadManifest.key(*request)
+
+        assert DownloadManifest.key(*request, grid="region") == region
+        assert DownloadManifest.key(*request, grid="tiles:40") != region
+        assert DownloadManifest.key(*request, grid="tiles:20") != (
+            DownloadManifest.key(*request, grid="tiles:40")
+        )
@@ -7,3 +7,357 @@ Kedro recommends using `pytest` framework, more info about it can be found
 in the official documentation:
 https://docs.pytest.org/en/latest/getting-started.html
 """
+
+import importlib.util
+import os
+import sys
+import types
+
+import numpy as np
+import pytest
+import rasterio as TIFF
+from rasterio.transform import from_origin
+
+CLOUD_PIXELS = [1, 2]
+# datas com distâncias distintas entre si, sem empates na ordem do BCL
+DATES = ["2020-01-01", "2020-01-04", "2020-01-12", "2020-01-30"]
+SIZE = 16
+
+
+@pytest.fixture
+def bcl(monkeypatch):
+    """BCL class, with a stand-in OpenCV when it is not installed (BCL
+    imports cv2 but does not use it in the correction)"""
+    if importlib.util.find_spec("cv2") is None:
+        monkeypatch.setitem(sys.modules, "cv2", types.ModuleType("cv2"))
+    monkeypatch.delitem(sys.modules, "utils.cloud_removal.bcl", raising=False)
+
+    from utils.cloud_removal.bcl import BCL
+
+    return BCL
+
+
+@pytest.fixture
+def fmask(monkeypatch):
+    """Fmask class, with a stand-in segmentation_mask_overlay when it is not
+    installed (only the overlay plots use it)"""
+    if importlib.util.find_spec("segmentation_mask_overlay") is None:
+        overlay = types.ModuleType("segmentation_mask_overlay")
+        overlay.overlay_masks = None
+        monkeypatch.setitem(sys.modules, "segmentation_mask_overlay", overlay)
+    for module in [
+        "utils.fmask.fmask_utils",
+        "utils.fmask.Fmask",
+        "utils.fmask.benchmark",
+    ]:
+        monkeypatch.delitem(sys.modules, module, raising=False)
+
+    from utils.fmask.Fmask import Fmask
+
+    return Fmask
+
+
+def write_tif(path: str, data: np.ndarray) -> None:
+    profile = {
+        "driver": "GTiff",
+        "height": SIZE,
+        "width": SIZE,
+        "count": data.shape[0],
+        "dtype": data.dtype.name,
+        "crs": "EPSG:32723",
+        "transform": from_origin(500000, 9000000, 10, 10),
+    }
+    with TIFF.open(path, "w", **profile) as dst:
+        dst.write(data)
+
+
+def write_year(root, n_bands: int, seed: int = 0) -> dict:
+    """Synthetic year of images (uint16 bands) and cloud masks, laid out as
+    the download and Fmask nodes write them"""
+    rng = np.random.default_rng(seed)
+    paths = {
+        name: f"{root}/{name}/loc/2020/"
+        for name in ["images", "masks", "clean", "colors"]
+    }
+    for path in paths.values():
+        os.makedirs(path)
+
+    for date in DATES:
+        image = rng.integers(1, 10000, (n_bands, SIZE, SIZE), dtype=np.uint16)
+        # 0 = limpo, 1 e 2 = nuvem e sombra
+        mask = rng.choice([0, 0, 1, 2], (1, SIZE, SIZE)).astype(np.uint8)
+        write_tif(f"{paths['images']}S2_loc_{date}.tif", image)
+        write_tif(f"{paths['masks']}S2_loc_{date}.tif", mask)
+    return paths
+
+
+def run_bcl(BCL, paths: dict) -> None:
+    """BCL over every image of the year, as cloud_removal runs it without a
+    scene catalog (images and masks found by listing the directories)"""
+    for image in os.listdir(paths["images"]):
+        date = image.split("_")[-1].split(".")[0].replace("-", "")
+        bcl = BCL(
+            img_dim=(SIZE, SIZE),
+            scl_path=paths["masks"],
+            path_6B=paths["images"],
+            year=2020,
+            data=date,
+            intern_reservoir="loc",
+            cloud_pixels=CLOUD_PIXELS,
+            use_dec_tree=False,
+            color_file_path=paths["colors"],
+        )
+        bcl.singleImageCorrection(
+            date, 2020, paths["clean"], image.replace(".tif", "")
+        )
+        bcl.color_file.close()
+
+
+def read(path: str) -> np.ndarray:
+    with TIFF.open(path) as src:
+        return src.read()
+
+
+def test_bcl_without_scene_catalog_writes_clean_images(bcl, tmp_path):
+    paths = write_year(tmp_path, n_bands=12)
+
+    run_bcl(bcl, paths)
+
+    for date in DATES:
+        image = read(f"{paths['images']}S2_loc_{date}.tif")
+        clear = read(f"{paths['masks']}S2_loc_{date}.tif")[0] == 0
+        clean = read(f"{paths['clean']}S2_loc_{date}_clean.tif")
+
+        assert clean.shape == image.shape
+        np.testing.assert_array_equal(clean[:, clear], image[:, clear])
+
+
+def test_vectorized_engine_writes_the_bcl_clean_images(bcl, tmp_path):
+    from utils.cloud_removal.compositing import composite_year, list_year_scenes
+
+    paths = write_year(tmp_path / "bcl", n_bands=13)
+    run_bcl(bcl, paths)
+
+    vectorized = write_year(tmp_path / "vectorized", n_bands=13)
+    written = list(
+        composite_year(
+            scenes=list_year_scenes(vectorized["images"], vectorized["masks"]),
+            output_path=vectorized["clean"],
+            color_file_path=vectorized["colors"],
+            cloud_pixels=CLOUD_PIXELS,
+        )
+    )
+
+    assert len(written) == len(DATES)
+    for date in DATES:
+        expected = read(f"{paths['clean']}S2_loc_{date}_clean.tif")
+        result = read(f"{vectorized['clean']}S2_loc_{date}_clean.tif")
+
+        # a 13ª banda fica 0 nos dois métodos
+        assert not expected[12].any()
+        np.testing.assert_array_equal(result, expected)
+
+        color_file = f"color_file_{date.replace('-', '')}.txt"
+        with open(paths["colors"] + color_file) as file:
+            expected_colors = file.read()
+        with open(vectorized["colors"] + color_file) as file:
+            assert file.read() == expected_colors
+
+
+def test_scene_catalog_follows_masks_written_without_registering(tmp_path):
+    from utils.scene_catalog.scene_catalog import SceneCatalog
+
+    paths = write_year(tmp_path, n_bands=1)
+    masks_root = f"{tmp_path}/masks/"
+    first, *_, last = DATES
+
+    with SceneCatalog(str(tmp_path / "catalog.db")) as catalog:
+        assert len(catalog.paths_by_date("loc", masks_root, 2020)) == len(DATES)
+
+        # máscaras gravadas ou apagadas por um nó que não usa o catálogo
+        write_tif(
+            f"{paths['masks']}S2_loc_2020-02-15.tif", np.zeros((1, SIZE, SIZE), "uint8")
+        )
+        os.remove(f"{paths['masks']}S2_loc_{last}.tif")
+        os.makedirs(f"{masks_root}loc/2021")
+        write_tif(
+            f"{masks_root}loc/2021/S2_loc_2021-01-01.tif",
+            np.zeros((1, SIZE, SIZE), "uint8"),
+        )
+
+        by_date = catalog.paths_by_date("loc", masks_root, 2020)
+        assert "20200215" in by_date
+        assert last.replace("-", "") not in by_date
+        assert first.replace("-", "") in by_date
+        assert catalog.get("loc", masks_root, "2021-01-01") is not None
+
+
+class TestDataCube:
+    @pytest.fixture
+    def cube(self, tmp_path):
+        from utils.datacube.datacube import DataCube
+
+        return DataCube(f"{tmp_path}/datacube/", "loc", "mask", chunk_size=8)
+
+    def write_masks(self, tmp_path, dates: list, satellite: str = "S2") -> list:
+        os.makedirs(tmp_path / "masks", exist_ok=True)
+        paths = []
+        for i, date in enumerate(dates):
+            path = f"{tmp_path}/masks/{satellite}_loc_{date}.tif"
+            write_tif(path, np.full((1, SIZE, SIZE), i + 1, "uint8"))
+            paths.append(path)
+        return paths
+
+    def test_append_time_slice_and_pixel_series(self, cube, tmp_path):
+        paths = self.write_masks(tmp_path, DATES)
+
+        # a ordem de inclusão não importa, o cubo é lido em ordem de tempo
+        for path, date in reversed(list(zip(paths, DATES))):
+            assert cube.append(path, date.replace("-", ""))
+        assert not cube.append(paths[0], "20200101")
+
+        scene = cube.time_slice("20200104")
+        assert scene.shape == (1, 1, SIZE, SIZE)
+        assert (scene.values == 2).all()
+        assert cube.time_slice("20200101", "20200112").sizes["time"] == 3
+
+        series = cube.pixel_series(500005, 8999995)
+        np.testing.assert_array_equal(series.values[:, 0], [1, 2, 3, 4])
+
+    def test_newer_scene_overwrites_its_date(self, cube, tmp_path):
+        from utils.datacube.datacube import DataCube
+
+        paths = self.write_masks(tmp_path, DATES[:2])
+        for path, date in zip(paths, DATES[:2]):
+            cube.append(path, date.replace("-", ""))
+
+        # máscara recalculada depois de entrar no cubo
+        write_tif(paths[0], np.full((1, SIZE, SIZE), 9, "uint8"))
+        mtime = os.path.getmtime(paths[0]) + 10
+        os.utime(paths[0], (mtime, mtime))
+
+        reopened = DataCube(f"{tmp_path}/datacube/", "loc", "mask", chunk_size=8)
+        assert reopened.append(paths[0], "20200101")
+        assert not reopened.append(paths[0], "20200101")
+
+        data = reopened.open()
+        assert data.sizes["time"] == 2
+        assert (reopened.time_slice("20200101").values == 9).all()
+        assert (reopened.time_slice("20200104").values == 2).all()
+
+    def test_other_satellite_on_the_same_date_is_skipped(self, cube, tmp_path, caplog):
+        s2 = self.write_masks(tmp_path, DATES[:1])
+        landsat = self.write_masks(tmp_path, DATES[:1], satellite="L8")
+
+        assert cube.append(s2[0], "20200101")
+        assert not cube.append(landsat[0], "20200101")
+
+        assert "holds a S2 scene" in caplog.text
+        assert (cube.time_slice("20200101").values == 1).all()
+
+    def test_longer_names_are_appended(self, cube, tmp_path):
+        (s2,) = self.write_masks(tmp_path, DATES[:1])
+        (landsat,) = self.write_masks(tmp_path, DATES[1:2], satellite="LANDSAT_8")
+
+        assert cube.append(s2, "20200101")
+        assert cube.append(landsat, "20200104", satellite="LANDSAT_8")
+
+        assert list(cube.open()["satellite"].values) == ["S2", "LANDSAT_8"]
+
+
+def write_fmask_scene(path: str) -> None:
+    """Sentinel-2 scene (12 uint16 bands, no band names) with water in one
+    corner and shadow-like NIR values in the opposite one"""
+    rng = np.random.default_rng(0)
+    scene = rng.integers(1, 10000, (12, SIZE, SIZE), dtype=np.uint16)
+    # índices 0-based: 2 verde, 3 vermelho, 7 NIR
+    scene[2, :6, :6] = rng.integers(1500, 3000, (6, 6))
+    scene[3, :6, :6] = rng.integers(400, 600, (6, 6))
+    scene[7, :6, :6] = rng.integers(100, 400, (6, 6))
+    scene[3, 10:, 10:] = rng.integers(100, 300, (6, 6))
+    scene[7, 10:, 10:] = rng.integers(300, 1200, (6, 6))
+    write_tif(path, scene)
+
+
+def test_tiled_fmask_writes_the_in_memory_mask(fmask, tmp_path):
+    from utils.fmask.fmask_utils import compose_mask
+
+    scene = str(tmp_path / "S2_loc_2020-01-01.tif")
+    write_fmask_scene(scene)
+
+    _, cloud_mask, shadow_mask, water_mask = fmask(0.0001).create_fmask(scene)
+    expected = compose_mask(cloud_mask, shadow_mask, water_mask)
+
+    # blocos de 6 pixels: bordas parciais e dilatação da água entre blocos
+    fmask(0.0001).create_fmask_tiled(scene, str(tmp_path / "mask.tif"), block_size=6)
+    result = read(str(tmp_path / "mask.tif"))[0]
+
+    assert set(np.unique(expected)) == {0, 1, 2, 3}
+    np.testing.assert_array_equal(result, expected)
+
+
+def test_fused_pass_one_equals_the_separate_tests(fmask):
+    from utils.fmask.benchmark import reference_tests, synthetic_tile
+
+    bands = synthetic_tile(size=64, seed=1)
+    pcp, water = fmask(0.0001).pass_one_and_water_test(**bands)
+    expected_pcp, expected_water = reference_tests(fmask(0.0001), bands)
+
+    assert pcp.any() and water.any()
+    np.testing.assert_array_equal(pcp, expected_pcp)
+    np.testing.assert_array_equal(water, expected_water)
+
+
+def test_scenes_with_newer_outputs_are_skipped(fmask, tmp_path):
+    from utils.fmask.Fmask import is_up_to_date, process_single_scene
+
+    scene = str(tmp_path / "S2_loc_2020-01-01.tif")
+    mask, plot = str(tmp_path / "mask.tif"), str(tmp_path / "plot.png")
+    write_fmask_scene(scene)
+
+    assert not is_up_to_date(scene, [mask, plot])
+    for output in [mask, plot]:
+        open(output, "w").close()
+    assert is_up_to_date(scene, [mask, plot])
+
+    args = (scene, mask, plot, 0.0001, True, 6, True)
+    assert process_single_scene(args)["skipped"]
+
+    # cena baixada de novo depois das saídas
+    mtime = os.path.getmtime(mask) + 10
+    os.utime(scene, (mtime, mtime))
+    assert not is_up_to_date(scene, [mask, plot])
+
+
+def test_cog_writer_keeps_tiles_compression_overviews_and_band_names(tmp_path):
+    from utils.raster_io.cog import open_cog
+
+    # perfil em faixas, como os GeoTIFFs baixados do GEE
+    profile = {
+        "driver": "GTiff",
+        "height": 64,
+        "width": 64,
+        "count": 2,
+        "dtype": "float32",
+        "crs": "EPSG:32723",
+        "transform": from_origin(500000, 9000000, 10, 10),
+        "blockysize": 1,
+    }
+    data = np.random.default_rng(0).random((2, 64, 64), dtype=np.float32)
+    output_file = tmp_path / "cog.tif"
+
+    with open_cog(
+        output_file, profile, block_size=16, descriptions=("ndwi", "mndwi")
+    ) as dst:
+        # escrita bloco a bloco, como em create_fmask_tiled
+        for _, window in dst.block_windows(1):
+            dst.write(data[(slice(None), *window.toslices())], window=window)
+
+    assert sorted(os.listdir(tmp_path)) == ["cog.tif"]
+    with TIFF.open(output_file) as src:
+        assert src.profile["tiled"]
+        assert src.block_shapes == [(16, 16)] * 2
+        assert src.compression.name == "deflate"
+        assert src.overviews(1) == [2, 4]
+        assert src.descriptions == ("ndwi", "mndwi")
+        np.testing.assert_array_equal(src.read(), data)